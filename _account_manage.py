@@ -1,26 +1,19 @@
 import getpass
-import os
 import re
 
-from dotenv import load_dotenv
 from passlib.context import CryptContext
-from sqlalchemy import create_engine, insert, select
+from sqlalchemy import insert, select
 from sqlalchemy.orm import Session
 
 from common.models import AccountType, User
+from services._shared import engine
+from services.blobs import drop_user_blobs
+from services.changes import record_user_deleted
+from services.counters import bump_counter, forget_user
+from services.versions import bump_version
 
-load_dotenv()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-connection_str = "mysql+mysqlconnector://{}:{}@{}:{}/{}".format(
-    os.environ["MYSQL_USER"],
-    os.environ["MYSQL_PASS"],
-    os.environ["MYSQL_URI"],
-    os.environ["MYSQL_PORT"],
-    "nikodex",
-)
-
-engine = create_engine(connection_str, echo=True)
 session = Session(engine)
 title = r"""
  _   _ _ _             _
@@ -139,6 +132,7 @@ def add_account():
         account_type=account_type.value,
     )
     session.execute(stmt)
+    bump_counter(session, "users", 1)
     session.commit()
     print("")
     print("Account created!")
@@ -199,7 +193,12 @@ def delete_account():
     if confirm(
         f'Are you sure you want to delete account "{user.username}" (ID: {user.id})? You CANNOT undo this action'
     ):
+        forget_user(session, user)
+        drop_user_blobs(session, user)
         session.delete(user)
+        for name in ("nikos", "posts", "users"):
+            bump_version(session, name)
+        record_user_deleted(session, user.id)
         session.commit()
         print("")
         print("Account deleted!")
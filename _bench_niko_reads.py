@@ -0,0 +1,92 @@
+import argparse
+import statistics
+import time
+
+from sqlalchemy import event
+
+import services.nikos as service
+from common.dto import NikoResponse, SortType
+from services._shared import SessionLocal, engine
+
+PAGE_SIZES = [14, 100, 1000]
+
+queries = 0
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def count_query(*args):
+    global queries
+    queries += 1
+
+
+def orm_page(session, count: int, sort_by: SortType):
+    # what the endpoint does with the result: validate into NikoResponse
+    return [
+        NikoResponse.model_validate(niko, from_attributes=True)
+        for niko in service.get_nikos_page_orm(1, count, sort_by, db=session)
+    ]
+
+
+def json_page(session, count: int, sort_by: SortType):
+    return [
+        NikoResponse.model_validate(niko)
+        for niko in service.get_nikos_json_page(1, count, sort_by, db=session)
+    ]
+
+
+def measure(read, count: int, sort_by: SortType, runs: int):
+    global queries
+    timings = []
+    for _ in range(runs):
+        # a fresh session each run so the ORM path can't reuse loaded objects
+        with SessionLocal() as session:
+            queries = 0
+            start = time.perf_counter()
+            rows = read(session, count, sort_by)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[max(int(len(timings) * 0.95) - 1, 0)]
+    return rows, queries, statistics.median(timings), p95
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the ORM and JSON-aggregated niko page reads. "
+        "Read only; run it against a database with at least 1000 nikos."
+    )
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument(
+        "--sort-by", type=SortType, default=SortType.oldest_added, dest="sort_by"
+    )
+    args = parser.parse_args()
+
+    print(f"{'page':>6}{'path':>6}{'rows':>7}{'queries':>9}{'p50':>11}{'p95':>11}")
+    for count in PAGE_SIZES:
+        orm_rows, orm_queries, orm_p50, orm_p95 = measure(
+            orm_page, count, args.sort_by, args.runs
+        )
+        json_rows, json_queries, json_p50, json_p95 = measure(
+            json_page, count, args.sort_by, args.runs
+        )
+        print(
+            f"{count:>6}{'orm':>6}{len(orm_rows):>7}{orm_queries:>9}"
+            f"{orm_p50:>9.2f}ms{orm_p95:>9.2f}ms"
+        )
+        print(
+            f"{count:>6}{'json':>6}{len(json_rows):>7}{json_queries:>9}"
+            f"{json_p50:>9.2f}ms{json_p95:>9.2f}ms"
+        )
+
+        # JSON_ARRAYAGG doesn't promise an order, so compare abilities as sets
+        def normalized(rows):
+            return [
+                {**row.model_dump(), "abilities": sorted(a.id for a in row.abilities)}
+                for row in rows
+            ]
+
+        if normalized(orm_rows) != normalized(json_rows):
+            print(f"  warning: the two paths disagree at page size {count}")
+
+
+if __name__ == "__main__":
+    main()
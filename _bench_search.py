@@ -0,0 +1,90 @@
+import argparse
+import random
+import statistics
+import time
+
+from common.dto import AbilityResponse, NikoResponse, UserResponse
+from services.search import SearchIndex
+
+SYLLABLES = ["ni", "ko", "ma", "ru", "te", "so", "la", "pi", "an", "go", "ve", "zu"]
+WORDS = [
+    "sun", "lamp", "cat", "world", "robot", "glitch", "dream", "light", "tower",
+    "bulb", "shadow", "square", "prophet", "mine", "barrens", "refuge", "pancake",
+]  # fmt: skip
+QUERIES = ["niko", "ko", "sun lamp", "robot glitch", "pancake", "prophet tow", "zzz"]
+
+
+def make_word(rng: random.Random):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def make_sentence(rng: random.Random, words: int):
+    return " ".join(
+        rng.choice(WORDS) if rng.random() < 0.5 else make_word(rng)
+        for _ in range(words)
+    )
+
+
+def synthetic_catalog(size: int, seed: int):
+    rng = random.Random(seed)
+    users = [UserResponse(id=i, username=make_word(rng)) for i in range(1, 201)]
+    nikos = []
+    for id in range(1, size + 1):
+        user = rng.choice(users)
+        nikos.append(
+            NikoResponse(
+                id=id,
+                name=f"{make_word(rng)} {make_word(rng)}",
+                description=make_sentence(rng, 8),
+                full_desc=make_sentence(rng, 40),
+                is_blacklisted=False,
+                author_id=user.id,
+                author_name=user.username,
+                abilities=[
+                    AbilityResponse(id=id * 10 + i, name=make_word(rng), niko_id=id)
+                    for i in range(rng.randint(0, 3))
+                ],
+                user=user,
+            )
+        )
+    return nikos
+
+
+def measure(fn, runs: int):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the niko search index.")
+    parser.add_argument("--size", type=int, default=50_000)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    nikos = synthetic_catalog(args.size, args.seed)
+
+    start = time.perf_counter()
+    index = SearchIndex(nikos)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"{args.size} nikos, {len(index.terms)} terms, built in {build_ms:.0f} ms")
+
+    header = f"{'query':<16}{'matches':>9}{'page p50':>11}{'page p95':>11}"
+    print(header + f"{'suggest p50':>13}")
+    for query in QUERIES:
+        matches = len(index.scores(query)[0] or {})
+        page_p50, page_p95 = measure(lambda: index.search(query, 0, 14), args.runs)
+        suggest_p50, _ = measure(lambda: index.suggest(query, 8), args.runs)
+        print(
+            f"{query:<16}{matches:>9}{page_p50:>9.2f}ms{page_p95:>9.2f}ms"
+            f"{suggest_p50:>11.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
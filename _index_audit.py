@@ -0,0 +1,196 @@
+import argparse
+import sys
+
+from sqlalchemy import event
+
+import services.abilities as abilities
+import services.banner as banner
+import services.blogs as blogs
+import services.changes as changes
+import services.comments as comments
+import services.counters as counters
+import services.nikos as nikos
+import services.posts as posts
+import services.submissions as submissions
+import services.users as users
+from common.dto import SortType
+from services._shared import SessionLocal, engine
+
+# (name, call, full scan expected). Read-only service calls covering every
+# query shape the API runs; add one here whenever a service gains a query.
+# Reads of a whole table (catalog load, listings without paging) are
+# expected to scan, but should still never need a filesort.
+SCENARIOS = [
+    *[
+        (
+            f"nikos.get_nikos_page[{sort_by.value}]",
+            lambda db, sort_by=sort_by: nikos.get_nikos_page(1, 14, sort_by, db=db),
+            False,
+        )
+        for sort_by in SortType
+    ],
+    *[
+        (
+            f"nikos.get_nikos_keyset_page[{sort_by.value}]",
+            lambda db, sort_by=sort_by: nikos.get_nikos_keyset_page(
+                14, sort_by, None, db=db
+            ),
+            False,
+        )
+        for sort_by in SortType
+    ],
+    (
+        "nikos.get_nikos_page[author=]",
+        lambda db: nikos.get_nikos_page(1, 14, SortType.author, "admin", db=db),
+        False,
+    ),
+    (
+        "nikos.get_nikos_summary_page",
+        lambda db: nikos.get_nikos_summary_page(1, 14, SortType.name_ascending, db=db),
+        False,
+    ),
+    (
+        "nikos.get_nikos_json_page",
+        lambda db: nikos.get_nikos_json_page(1, 14, SortType.name_ascending, db=db),
+        False,
+    ),
+    (
+        "nikos.get_latest_niko_id_of_user",
+        lambda db: nikos.get_latest_niko_id_of_user(1, db=db),
+        False,
+    ),
+    ("abilities.get_abilities", lambda db: abilities.get_abilities(db=db), True),
+    ("banner.get_banner", lambda db: banner.get_banner(db=db), True),
+    ("blogs.get_blogs", lambda db: blogs.get_blogs(db=db), True),
+    ("blogs.get_blog_by_id", lambda db: blogs.get_blog_by_id(1, db=db), False),
+    ("changes.get_changes", lambda db: changes.get_changes(0, 500, db=db), False),
+    (
+        "comments.get_all_comments_by_post_id",
+        lambda db: comments.get_all_comments_by_post_id(1, db=db),
+        False,
+    ),
+    (
+        "comments.get_all_comments_by_user_id",
+        lambda db: comments.get_all_comments_by_user_id(1, db=db),
+        False,
+    ),
+    ("counters.get_counter", lambda db: counters.get_counter("posts", db=db), False),
+    ("posts.get_posts_page", lambda db: posts.get_posts_page(1, 14, db=db), False),
+    ("posts.get_post_id", lambda db: posts.get_post_id(1, db=db), False),
+    ("posts.get_post_userid", lambda db: posts.get_post_userid(1, db=db), False),
+    (
+        "posts.get_posts_by_ids",
+        lambda db: posts.get_posts_by_ids([1, 2, 3], db=db),
+        False,
+    ),
+    (
+        "submissions.get_submissions",
+        lambda db: submissions.get_submissions(db=db),
+        True,
+    ),
+    (
+        "submissions.get_submissions_by_userid",
+        lambda db: submissions.get_submissions_by_userid(1, db=db),
+        False,
+    ),
+    ("users.get_user_by_id", lambda db: users.get_user_by_id(1, db=db), False),
+    (
+        "users.get_user_by_username",
+        lambda db: users.get_user_by_name("admin", db=db),
+        False,
+    ),
+    (
+        "users.get_users_by_ids",
+        lambda db: users.get_users_by_ids([1, 2, 3], db=db),
+        False,
+    ),
+    # LIKE '%name%' can't use an index; the user list is small
+    (
+        "users.get_user_by_usersearch",
+        lambda db: users.get_user_by_usersearch("a", 1, 14, db=db),
+        True,
+    ),
+]
+
+captured: list[tuple[str, object]] = []
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def capture(conn, cursor, statement, parameters, context, executemany):
+    if statement.lstrip().upper().startswith("SELECT"):
+        captured.append((statement, parameters))
+
+
+def explain(conn, statement: str, parameters):
+    # EXPLAIN goes through the DBAPI cursor so the driver's own paramstyle
+    # and parameters can be reused as-is
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("EXPLAIN " + statement, parameters)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    except Exception as e:
+        print(f"Couldn't EXPLAIN, skipping: {e}")
+        return []
+    finally:
+        cursor.close()
+
+
+def problems(plan: list[dict], full_scan_ok: bool):
+    found = []
+    for row in plan:
+        extra = row.get("Extra") or ""
+        if row.get("type") == "ALL" and not full_scan_ok:
+            found.append(f"full scan of {row.get('table')}")
+        if "Using filesort" in extra:
+            found.append(f"filesort on {row.get('table')}")
+        if "Using temporary" in extra:
+            found.append(f"temporary table for {row.get('table')}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="EXPLAIN every query the services run and flag full scans "
+        "and filesorts. Read only; run it against a database with realistic "
+        "data (the optimizer happily scans tiny tables)."
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    flagged = 0
+    for name, call, full_scan_ok in SCENARIOS:
+        captured.clear()
+        with SessionLocal() as session:
+            try:
+                call(session)
+            except Exception as e:
+                # a missing sample row (id 1...) doesn't matter, the queries ran
+                if args.verbose:
+                    print(f"{name}: {e}")
+        unique = {(s, repr(p)): (s, p) for s, p in captured}
+        with engine.connect() as conn:
+            plans = [(s, explain(conn, s, p)) for s, p in unique.values()]
+
+        for statement, plan in plans:
+            found = problems(plan, full_scan_ok)
+            if found:
+                flagged += 1
+            if found or args.verbose:
+                status = "FLAG" if found else "ok"
+                print(f"[{status}] {name}: {', '.join(found) or 'indexed'}")
+                print("    " + " ".join(statement.split()))
+                if args.verbose:
+                    for row in plan:
+                        print(
+                            f"    {row.get('table')}: type={row.get('type')} "
+                            f"key={row.get('key')} rows={row.get('rows')} "
+                            f"extra={row.get('Extra')}"
+                        )
+
+    print(f"{len(SCENARIOS)} scenarios, {flagged} flagged statements")
+    sys.exit(1 if flagged else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import func, select, update
+
+from common.models import ImageBlob, Niko, Post, Submission, User
+from services._shared import SessionLocal
+from services.blobs import (
+    IMAGE_COLUMNS,
+    IMAGE_DIR,
+    add_blob,
+    blob_name,
+    record_image_changes,
+)
+from services.imaging import ImageDecodeError, normalize_png
+
+BATCH = 100
+
+
+def load(path: str):
+    """Normalized PNG bytes of a legacy file, None if it's gone or unreadable."""
+    try:
+        with open(path, "rb") as f:
+            return normalize_png(f.read())
+    except (FileNotFoundError, ImageDecodeError):
+        return None
+
+
+def legacy_images(session, model, column):
+    """(id, file name) of every row still pointing at a legacy file."""
+    if model is Niko:
+        # niko images only ever lived at niko-{id}.png, the column is new
+        ids = session.scalars(select(Niko.id).where(Niko.image.is_(None))).all()
+        return [
+            (id, f"niko-{id}.png")
+            for id in ids
+            if os.path.exists(os.path.join(IMAGE_DIR, f"niko-{id}.png"))
+        ]
+    return session.execute(
+        select(model.id, column).where(
+            column.is_not(None), column != "", column.not_like("blobs/%")
+        )
+    ).all()
+
+
+def migrate(pool, model, column, keep: bool):
+    with SessionLocal() as session:
+        rows = legacy_images(session, model, column)
+    moved = missing = 0
+    for start in range(0, len(rows), BATCH):
+        batch = rows[start : start + BATCH]
+        paths = [os.path.join(IMAGE_DIR, name) for _, name in batch]
+        pngs = list(pool.map(load, paths))
+        with SessionLocal() as session:
+            ids = []
+            for (id, name), png in zip(batch, pngs):
+                if png is None:
+                    missing += 1
+                    continue
+                # only if nothing changed it since we read it; a reference
+                # taken for nothing is given back by recount()
+                unchanged = column.is_(None) if model is Niko else column == name
+                if session.execute(
+                    update(model)
+                    .where(model.id == id, unchanged)
+                    .values({column.key: add_blob(session, png)})
+                ).rowcount:
+                    ids.append(id)
+            record_image_changes(session, column, ids)
+            session.commit()
+        moved += len(ids)
+        if not keep:
+            for path, png in zip(paths, pngs):
+                if png is not None:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+    return moved, missing
+
+
+def recount():
+    """Set every blob's refs from the rows using it, fixing whatever an
+    interrupted run (or a lost race with the API) left behind."""
+    with SessionLocal() as session:
+        # lock the blobs first: add_blob then waits for us, and the locking
+        # reads below wait for whoever took a reference before we got here
+        blobs = session.scalars(select(ImageBlob).with_for_update()).all()
+        refs = Counter()
+        for column in IMAGE_COLUMNS:
+            refs.update(
+                dict(
+                    session.execute(
+                        select(column, func.count())
+                        .where(column.like("blobs/%"))
+                        .group_by(column)
+                        .with_for_update(read=True)
+                    ).all()
+                )
+            )
+        fixed = 0
+        now = datetime.now()
+        for blob in blobs:
+            count = refs[blob_name(blob.key)]
+            if blob.refs != count:
+                blob.refs = count
+                blob.updated_at = now
+                fixed += 1
+        session.commit()
+        return fixed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Move images stored before the blob store into it. Safe to "
+        "run again (and while the API is up): rows already moved are skipped."
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="processes decoding images (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="don't delete the old files afterwards"
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for model, column in zip((Niko, Post, Submission, User), IMAGE_COLUMNS):
+            moved, missing = migrate(pool, model, column, args.keep)
+            print(f"{model.__tablename__}: {moved} moved, {missing} missing/unreadable")
+    print(f"{recount()} blob reference counts fixed")
+    print(f"Done in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import select
+
+import services.abilities as abilities
+import services.blogs as blogs
+import services.nikos as nikos
+import services.posts as posts
+from common.dto import AbilityResponse, BlogResponse, SortType
+from common.models import Niko, Post
+from services._shared import read_session
+from services.images import IMAGE_DIR
+
+DEFAULT_IMAGE = "images/default.png"
+# what was written last run: path -> content hash, image path -> source stamp
+MANIFEST = "manifest.json"
+
+LAYOUT = """layout of the output directory (stable, safe to put behind a CDN):
+  nikos.json, nikos/{id}.json          every niko, oldest first
+  abilities.json, abilities/{id}.json  every ability
+  blogs.json, blogs/{id}.json          every blog, newest first
+  posts.json, posts/{id}.json          every post, newest first
+  images/nikos/{id}.png                niko images (the default one if missing)
+  images/posts/{id}.png                post images (the default one if missing)
+The image_url of nikos and posts point into images/, after --base-url."""
+
+
+def dumps(data):
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def niko_files(base_url: str):
+    items = []
+    for batch in nikos.stream_nikos(SortType.oldest_added):
+        for niko in batch:
+            item = niko.model_dump(mode="json")
+            item["image_url"] = f"{base_url}images/nikos/{niko.id}.png"
+            items.append(item)
+    return items
+
+
+def post_files(base_url: str):
+    items = []
+    for batch in posts.stream_posts():
+        for post in batch:
+            item = post.model_dump(mode="json")
+            item["image_url"] = f"{base_url}images/posts/{post.id}.png"
+            items.append(item)
+    items.reverse()
+    return items
+
+
+def render(base_url: str):
+    """Every entity of the export, kind -> list of JSON-ready dicts."""
+    return {
+        "nikos": niko_files(base_url),
+        "abilities": [
+            AbilityResponse.model_validate(ability, from_attributes=True).model_dump(
+                mode="json"
+            )
+            for ability in abilities.get_abilities()
+        ],
+        "blogs": [
+            BlogResponse.model_validate(blog, from_attributes=True).model_dump(
+                mode="json"
+            )
+            for blog in blogs.get_blogs()
+        ],
+        "posts": post_files(base_url),
+    }
+
+
+def json_files(entities: dict[str, list[dict]]):
+    """Every JSON file of the export, relative path -> bytes."""
+    files = {}
+    for name, items in entities.items():
+        files[f"{name}.json"] = dumps(items)
+        for item in items:
+            files[f"{name}/{item['id']}.json"] = dumps(item)
+    return files
+
+
+def image_sources(niko_ids: list[int]):
+    """Every exported image, relative path -> source file in IMG_DIR."""
+    sources = {}
+    with read_session() as session:
+        images = dict(
+            session.execute(
+                select(Niko.id, Niko.image).where(Niko.id.in_(niko_ids))
+            ).all()
+        )
+        for id in niko_ids:
+            # not yet moved to the blob store: still at niko-{id}.png
+            path = os.path.join(IMAGE_DIR, images.get(id) or f"niko-{id}.png")
+            sources[f"images/nikos/{id}.png"] = (
+                path if os.path.exists(path) else DEFAULT_IMAGE
+            )
+        for id, image in session.execute(select(Post.id, Post.image)):
+            path = os.path.join(IMAGE_DIR, image) if image else DEFAULT_IMAGE
+            sources[f"images/posts/{id}.png"] = (
+                path if os.path.exists(path) else DEFAULT_IMAGE
+            )
+    return sources
+
+
+def write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def copy_atomic(source: str, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    shutil.copyfile(source, tmp)
+    os.replace(tmp, path)
+
+
+def load_manifest(out: str):
+    try:
+        with open(os.path.join(out, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"files": {}, "images": {}}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the Nikodex to static files a CDN can serve. Only "
+        "rewrites what changed since the last export into the same directory.",
+        epilog=LAYOUT,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("out", help="output directory")
+    parser.add_argument(
+        "--base-url",
+        default="/",
+        help="prefix of the image URLs in the JSON (default: /)",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=8, help="parallel image copies (default: 8)"
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="ignore the last run, rewrite everything"
+    )
+    args = parser.parse_args()
+    base_url = args.base_url if args.base_url.endswith("/") else args.base_url + "/"
+
+    start = time.perf_counter()
+    previous = {"files": {}, "images": {}} if args.full else load_manifest(args.out)
+    manifest = {"files": {}, "images": {}}
+
+    entities = render(base_url)
+    written = 0
+    for path, data in json_files(entities).items():
+        digest = hashlib.sha256(data).hexdigest()
+        manifest["files"][path] = digest
+        target = os.path.join(args.out, path)
+        if previous["files"].get(path) != digest or not os.path.exists(target):
+            write_atomic(target, data)
+            written += 1
+
+    copies = []
+    niko_ids = [niko["id"] for niko in entities["nikos"]]
+    for path, source in image_sources(niko_ids).items():
+        stat = os.stat(source)
+        # cheaper than hashing every image: the source and its size and mtime
+        stamp = [source, stat.st_size, stat.st_mtime_ns]
+        manifest["images"][path] = stamp
+        target = os.path.join(args.out, path)
+        if previous["images"].get(path) != stamp or not os.path.exists(target):
+            copies.append((source, target))
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        # list() so a failed copy raises here
+        list(pool.map(lambda copy: copy_atomic(*copy), copies))
+
+    removed = 0
+    for kind in ("files", "images"):
+        for path in previous[kind].keys() - manifest[kind].keys():
+            try:
+                os.remove(os.path.join(args.out, path))
+                removed += 1
+            except FileNotFoundError:
+                pass
+
+    write_atomic(os.path.join(args.out, MANIFEST), dumps(manifest))
+    print(
+        f"{len(manifest['files'])} files ({written} written), "
+        f"{len(manifest['images'])} images ({len(copies)} copied), "
+        f"{removed} removed in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
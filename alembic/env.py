@@ -1,26 +1,17 @@
-import os
 from logging.config import fileConfig
 
-from dotenv import load_dotenv
 from sqlalchemy import engine_from_config, pool
 
 from alembic import context
 from common.models import Base
-
-load_dotenv()
+from services._shared import build_connection_str
 
 config = context.config
 
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
-connection_str = "mysql+mysqlconnector://{}:{}@{}:{}/{}".format(
-    os.environ["MYSQL_USER"],
-    os.environ["MYSQL_PASS"],
-    os.environ["MYSQL_URI"],
-    os.environ["MYSQL_PORT"],
-    "nikodex",
-)
+connection_str = build_connection_str()
 
 # add your model's MetaData object here
 # for 'autogenerate' support
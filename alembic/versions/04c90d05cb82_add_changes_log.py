@@ -0,0 +1,41 @@
+"""add changes log
+
+Revision ID: 04c90d05cb82
+Revises: 5d1bbb0d6471
+Create Date: 2026-10-17 12:32:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "04c90d05cb82"
+down_revision: Union[str, Sequence[str], None] = "5d1bbb0d6471"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "changes",
+        sa.Column("seq", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("entity", sa.String(length=16), nullable=False),
+        sa.Column("entity_id", sa.Integer(), nullable=False),
+        sa.Column("deleted", sa.Boolean(), nullable=False),
+        sa.Column("changed_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("seq"),
+    )
+    op.execute(
+        "INSERT INTO counters (name, value) VALUES ('changes', 0), ('changes_floor', 0)"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DELETE FROM counters WHERE name IN ('changes', 'changes_floor')")
+    op.drop_table("changes")
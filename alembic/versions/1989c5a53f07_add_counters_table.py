@@ -0,0 +1,39 @@
+"""add counters table
+
+Revision ID: 1989c5a53f07
+Revises: 38d06ba25134
+Create Date: 2026-10-17 12:29:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "1989c5a53f07"
+down_revision: Union[str, Sequence[str], None] = "38d06ba25134"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "counters",
+        sa.Column("name", sa.String(length=64), nullable=False),
+        sa.Column("value", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    op.execute(
+        "INSERT INTO counters (name, value) "
+        "SELECT 'posts', COUNT(*) FROM posts "
+        "UNION ALL SELECT 'users', COUNT(*) FROM users"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("counters")
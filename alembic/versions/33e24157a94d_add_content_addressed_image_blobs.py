@@ -0,0 +1,46 @@
+"""add content-addressed image blobs
+
+Revision ID: 33e24157a94d
+Revises: 04c90d05cb82
+Create Date: 2026-10-17 12:33:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "33e24157a94d"
+down_revision: Union[str, Sequence[str], None] = "04c90d05cb82"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "image_blobs",
+        sa.Column("key", sa.String(length=64), nullable=False),
+        sa.Column("refs", sa.Integer(), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("key"),
+    )
+    op.create_index(
+        "ix_image_blobs_refs_updated_at",
+        "image_blobs",
+        ["refs", "updated_at"],
+        unique=False,
+    )
+    # niko images were stored at niko-{id}.png; _migrate_images.py fills this
+    op.add_column("nikos", sa.Column("image", sa.String(length=1023), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("nikos", "image")
+    op.drop_index("ix_image_blobs_refs_updated_at", table_name="image_blobs")
+    op.drop_table("image_blobs")
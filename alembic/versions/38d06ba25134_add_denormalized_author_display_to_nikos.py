@@ -0,0 +1,48 @@
+"""add denormalized author_display to nikos
+
+Revision ID: 38d06ba25134
+Revises: edba8546d2d3
+Create Date: 2026-10-17 12:28:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "38d06ba25134"
+down_revision: Union[str, Sequence[str], None] = "edba8546d2d3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "nikos",
+        sa.Column(
+            "author_display", sa.String(length=255), nullable=False, server_default=""
+        ),
+    )
+    # same rules the author_name property used to apply at read time
+    op.execute(
+        "UPDATE nikos LEFT JOIN users ON nikos.author_id = users.id "
+        "SET nikos.author_display = CASE "
+        "WHEN nikos.author_id IS NULL THEN nikos.author "
+        "ELSE COALESCE(users.username, 'Could not find author_name..') END"
+    )
+    op.create_index(
+        "ix_nikos_author_display_id",
+        "nikos",
+        ["author_display", "id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_nikos_author_display_id", table_name="nikos")
+    op.drop_column("nikos", "author_display")
@@ -0,0 +1,66 @@
+"""replace notd history with a shuffled rotation
+
+Revision ID: 3d9a9a1b34be
+Revises: 7e60c1e4ca5b
+Create Date: 2026-10-17 12:26:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3d9a9a1b34be"
+down_revision: Union[str, Sequence[str], None] = "7e60c1e4ca5b"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "notd_rotation",
+        sa.Column("position", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("niko_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["niko_id"], ["nikos.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("position"),
+        sa.UniqueConstraint("niko_id"),
+    )
+    op.create_table(
+        "notd_state",
+        sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("position", sa.Integer(), nullable=False),
+        sa.Column("niko_id", sa.Integer(), nullable=True),
+        sa.Column("refresh_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["niko_id"], ["nikos.id"], ondelete="SET NULL"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    # the row advance_notd locks; the first request after this shuffles
+    op.execute(
+        "INSERT INTO notd_state (id, position, niko_id, refresh_at) "
+        "VALUES (1, -1, NULL, NOW())"
+    )
+    op.drop_index(op.f("ix_notd_chosen_at"), table_name="notd")
+    op.drop_table("notd")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_table(
+        "notd",
+        sa.Column("niko_id", sa.Integer(), nullable=False),
+        sa.Column(
+            "chosen_at",
+            sa.TIMESTAMP(),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(["niko_id"], ["nikos.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("niko_id"),
+    )
+    op.create_index(op.f("ix_notd_chosen_at"), "notd", ["chosen_at"], unique=False)
+    op.drop_table("notd_state")
+    op.drop_table("notd_rotation")
@@ -0,0 +1,33 @@
+"""seed table version counters
+
+Revision ID: 5d1bbb0d6471
+Revises: a07e7d306f8f
+Create Date: 2026-10-17 12:31:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5d1bbb0d6471"
+down_revision: Union[str, Sequence[str], None] = "a07e7d306f8f"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(
+        "INSERT INTO counters (name, value) VALUES "
+        "('version:nikos', 1), ('version:posts', 1), ('version:users', 1), "
+        "('version:blogs', 1), ('version:banner', 1)"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DELETE FROM counters WHERE name LIKE 'version:%'")
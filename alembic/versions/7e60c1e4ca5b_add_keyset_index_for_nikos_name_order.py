@@ -0,0 +1,29 @@
+"""add keyset index for nikos name order
+
+Revision ID: 7e60c1e4ca5b
+Revises: a570b239ef6a
+Create Date: 2026-10-17 12:25:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "7e60c1e4ca5b"
+down_revision: Union[str, Sequence[str], None] = "a570b239ef6a"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_nikos_name_id", "nikos", ["name", "id"], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_nikos_name_id", table_name="nikos")
@@ -0,0 +1,30 @@
+"""seed images version counter
+
+Revision ID: 8c4f2e91d7a3
+Revises: 33e24157a94d
+Create Date: 2026-10-17 18:05:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8c4f2e91d7a3"
+down_revision: Union[str, Sequence[str], None] = "33e24157a94d"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # IGNORE: an image write may have created it before this ran
+    op.execute("INSERT IGNORE INTO counters (name, value) VALUES ('version:images', 1)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DELETE FROM counters WHERE name = 'version:images'")
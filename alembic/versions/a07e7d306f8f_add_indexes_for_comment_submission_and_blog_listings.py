@@ -0,0 +1,51 @@
+"""add indexes for comment, submission and blog listings
+
+Revision ID: a07e7d306f8f
+Revises: 1989c5a53f07
+Create Date: 2026-10-17 12:30:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a07e7d306f8f"
+down_revision: Union[str, Sequence[str], None] = "1989c5a53f07"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # the comments indexes take over from the ones MySQL created implicitly
+    # for the post_id/author_id foreign keys
+    op.create_index(
+        "ix_comments_post_id_id", "comments", ["post_id", "id"], unique=False
+    )
+    op.create_index(
+        "ix_comments_author_id_id", "comments", ["author_id", "id"], unique=False
+    )
+    op.create_index(
+        op.f("ix_submissions_submit_date"),
+        "submissions",
+        ["submit_date"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_blogs_post_datetime"), "blogs", ["post_datetime"], unique=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_blogs_post_datetime"), table_name="blogs")
+    op.drop_index(op.f("ix_submissions_submit_date"), table_name="submissions")
+    # the foreign keys still need an index once the composite ones are gone
+    op.create_index("ix_comments_author_id", "comments", ["author_id"], unique=False)
+    op.drop_index("ix_comments_author_id_id", table_name="comments")
+    op.create_index("ix_comments_post_id", "comments", ["post_id"], unique=False)
+    op.drop_index("ix_comments_post_id_id", table_name="comments")
@@ -0,0 +1,43 @@
+"""add image changes log
+
+Revision ID: b2e7a4c9f150
+Revises: 8c4f2e91d7a3
+Create Date: 2026-10-17 18:40:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b2e7a4c9f150"
+down_revision: Union[str, Sequence[str], None] = "8c4f2e91d7a3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "image_changes",
+        sa.Column("seq", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("kind", sa.String(length=16), nullable=False),
+        sa.Column("entity_id", sa.Integer(), nullable=False),
+        sa.Column("changed_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("seq"),
+    )
+    op.create_index(
+        op.f("ix_image_changes_changed_at"),
+        "image_changes",
+        ["changed_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_image_changes_changed_at"), table_name="image_changes")
+    op.drop_table("image_changes")
@@ -0,0 +1,33 @@
+"""add author index for latest niko lookups
+
+Revision ID: edba8546d2d3
+Revises: 3d9a9a1b34be
+Create Date: 2026-10-17 12:27:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "edba8546d2d3"
+down_revision: Union[str, Sequence[str], None] = "3d9a9a1b34be"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # also takes over from the index MySQL created implicitly for the
+    # author_id foreign key, so MAX(id) per author is a single index lookup
+    op.create_index("ix_nikos_author_id_id", "nikos", ["author_id", "id"], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # the foreign key still needs an index once the composite one is gone
+    op.create_index("ix_nikos_author_id", "nikos", ["author_id"], unique=False)
+    op.drop_index("ix_nikos_author_id_id", table_name="nikos")
@@ -37,6 +37,35 @@ class NikoResponse(NikoRequest):
     user: UserResponse | None
 
 
+# an entry of the prebuilt /nikos/snapshot file
+class NikoSnapshotResponse(NikoResponse):
+    image_url: str
+
+
+class NikoSummaryResponse(BaseModel):
+    id: int
+    name: str
+    description: str
+    is_blacklisted: bool
+    author_id: Optional[int] = Field(None)
+    author_name: Optional[str] = Field(None)
+
+
+class NikoBatch(BaseModel):
+    items: List[NikoResponse]
+    missing: List[int]
+
+
+class NikoSuggestion(BaseModel):
+    id: int
+    name: str
+
+
+class NikoCursorPage(BaseModel):
+    items: List[NikoResponse]
+    next_cursor: str | None
+
+
 class BlogRequest(BaseModel):
     title: str
     author: str
@@ -93,6 +122,42 @@ class SortType(Enum):
     oldest_added = "oldest_added"
     name_ascending = "name_ascending"
     name_descending = "name_descending"
+    author = "author"
+
+
+class NikoView(Enum):
+    full = "full"
+    # NikoSummaryResponse: no full_desc, abilities or nested user
+    summary = "summary"
+
+
+class ExportFormat(Enum):
+    ndjson = "ndjson"
+    json = "json"
+
+
+class ChangeEntity(Enum):
+    niko = "niko"
+    ability = "ability"
+    post = "post"
+    comment = "comment"
+    blog = "blog"
+
+
+class ChangeResponse(BaseModel):
+    seq: int
+    entity: ChangeEntity
+    id: int
+    # a tombstone: the entity is gone, drop it
+    deleted: bool
+
+
+class ChangeFeed(BaseModel):
+    changes: List[ChangeResponse]
+    # pass as ?since= next time
+    next: int
+    # the page was full, ask again right away
+    more: bool
 
 
 class SubmitUserRequest(BaseModel):
@@ -128,6 +193,11 @@ class PostResponse(BaseModel):
     user: UserResponse
 
 
+class PostBatch(BaseModel):
+    items: List[PostResponse]
+    missing: List[int]
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -144,6 +214,17 @@ class User(BaseModel):
     account_type: int
 
 
+class UserBatch(BaseModel):
+    items: List[User]
+    missing: List[int]
+
+
+class ImageFormat(Enum):
+    png = "png"
+    webp = "webp"
+    avif = "avif"
+
+
 class ImgReturnType(str, Enum):
     image = "image"
     niko_id = "niko_id"
@@ -12,12 +12,14 @@ from fastapi import (
 )
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
+from sqlalchemy.orm import Session
 
 import services.users as service
 from common import dto, models
 from common.dto import TokenData
 from common.helper2 import account_of_type
 from common.models import AccountType
+from services._shared import DbSession, run_db
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 SECRET_KEY = os.environ["SECRET_KEY"]
@@ -41,8 +43,8 @@ def get_password_hash(plain_pass):
     return pwd_context.hash(plain_pass)
 
 
-def authenticate_user(username: str, password: str):
-    user = service.get_user_by_username(username)
+def authenticate_user(username: str, password: str, db: Session | None = None):
+    user = service.get_user_by_username(username, db=db)
     if not user:
         return None
     if not verify_password(password, user.hashed_pass):
@@ -61,7 +63,9 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-async def get_auth_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+async def get_auth_current_user(
+    token: Annotated[str, Depends(oauth2_scheme)], db: DbSession
+):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -72,7 +76,7 @@ async def get_auth_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
         id = payload.get("sub")
         if id is None:
             raise credentials_exception
-        user = service.get_user_by_id(int(id))
+        user = await run_db(service.get_user_by_id, int(id), db=db)
         if user is None:
             raise credentials_exception
         if account_of_type(user, AccountType.DUMMY):
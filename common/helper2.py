@@ -1,6 +1,114 @@
+import hashlib
+import os
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Depends, HTTPException, Request, Response, status
+from fastapi.responses import FileResponse, StreamingResponse
+
 from common import dto, models
+from common.dto import ExportFormat
 from common.models import AccountType
+from services.versions import versions
 
 
 def account_of_type(user: dto.User | models.User, account_type: AccountType):
     return AccountType(user.account_type) == account_type
+
+
+def stream_export(batches, format: ExportFormat):
+    """Serialize lists of pydantic models as they're produced, one chunk each."""
+    if format == ExportFormat.ndjson:
+        for batch in batches:
+            if batch:
+                yield "".join(item.model_dump_json() + "\n" for item in batch)
+        return
+
+    yield "["
+    first = True
+    for batch in batches:
+        if batch:
+            yield ("" if first else ",") + ",".join(
+                item.model_dump_json() for item in batch
+            )
+            first = False
+    yield "]"
+
+
+def export_response(batches, format: ExportFormat):
+    media_type = (
+        "application/x-ndjson" if format == ExportFormat.ndjson else "application/json"
+    )
+    return StreamingResponse(stream_export(batches, format), media_type=media_type)
+
+
+def make_etag(request: Request, names: tuple[str, ...]):
+    """Strong ETag for the versions of `names`, distinct per path and query."""
+    current = versions.get_many(names)
+    key = ",".join(f"{name}:{current[name]}" for name in names)
+    key += f"|{request.url.path}?{sorted(request.query_params.multi_items())}"
+    return '"' + hashlib.sha1(key.encode()).hexdigest()[:20] + '"'
+
+
+def etag_matches(request: Request, etag: str):
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags or "*" in tags
+
+
+def versioned(*names: str):
+    """Route dependency answering 304 when the client's ETag is still current,
+    before the route opens a query or serializes anything. `names` are the
+    versions (services.versions) the response is built from. The versions
+    come from the primary, so the route must read it too (PrimaryDbSession)."""
+
+    def check(request: Request, response: Response):
+        etag = make_etag(request, names)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request, etag):
+            raise HTTPException(
+                status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+            )
+        response.headers.update(headers)
+
+    return Depends(check)
+
+
+# for URLs naming their content (a hash), which never change
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def not_modified_since(request: Request, stat: os.stat_result):
+    if_modified_since = request.headers.get("if-modified-since")
+    if not if_modified_since or request.headers.get("if-none-match"):
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return int(stat.st_mtime) <= since
+
+
+def file_response(
+    request: Request,
+    path: str,
+    media_type: str,
+    stat: os.stat_result | None = None,
+    etag: str | None = None,
+    immutable: bool = False,
+    headers: dict[str, str] | None = None,
+):
+    """A file with validators, answering 304 to a client already holding it.
+    FileResponse itself answers Range (and If-Range) requests with a 206."""
+    stat = stat or os.stat(path)
+    etag = etag or f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        **(headers or {}),
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": IMMUTABLE if immutable else "no-cache",
+    }
+    if etag_matches(request, etag) or not_modified_since(request, stat):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat)
@@ -3,17 +3,16 @@ from enum import Enum
 from typing import List
 
 from sqlalchemy import (
-    TIMESTAMP,
     BigInteger,
     Boolean,
     DateTime,
     ForeignKey,
+    Index,
     String,
     Text,
 )
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy.sql import func
 from sqlalchemy.sql.schema import CheckConstraint
 from sqlalchemy.sql.sqltypes import Integer
 
@@ -38,6 +37,12 @@ class Niko(Base):
     author: Mapped[str] = mapped_column(String(255))
     full_desc: Mapped[str] = mapped_column(String(1023))
     is_blacklisted: Mapped[bool] = mapped_column(default=False)
+    # the author's username, or `author` for nikos without an account. kept
+    # in sync by the niko services and on user rename, so it can be sorted
+    # and filtered on without joining users
+    author_display: Mapped[str] = mapped_column(String(255), default="")
+    # path under IMG_DIR (see services/blobs.py); None for the default image
+    image: Mapped[str | None] = mapped_column(String(1023), nullable=True)
     author_id: Mapped[int | None] = mapped_column(
         ForeignKey("users.id", ondelete="CASCADE"), nullable=True
     )
@@ -46,15 +51,15 @@ class Niko(Base):
     )
     user: Mapped["User"] = relationship(back_populates="nikos", passive_deletes=True)
 
+    __table_args__ = (
+        Index("ix_nikos_name_id", "name", "id"),
+        Index("ix_nikos_author_id_id", "author_id", "id"),
+        Index("ix_nikos_author_display_id", "author_display", "id"),
+    )
+
     @hybrid_property
     def author_name(self):
-        if self.author_id is None:
-            return self.author
-        else:
-            if self.user is None:
-                return "Could not find author_name.."
-            else:
-                return self.user.username
+        return self.author_display
 
     def __init__(self, id, name, description, full_desc, image):
         self.id = id
@@ -70,14 +75,74 @@ class Niko(Base):
         self.abilities = lis
 
 
-class Notd(Base):
-    __tablename__ = "notd"
+class NotdRotation(Base):
+    """One shuffled pass over every niko; the NoTD walks it by position."""
+
+    __tablename__ = "notd_rotation"
+    position: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
     niko_id: Mapped[int] = mapped_column(
-        ForeignKey("nikos.id", ondelete="CASCADE"), primary_key=True
+        ForeignKey("nikos.id", ondelete="CASCADE"), unique=True
+    )
+
+
+class NotdState(Base):
+    """Single row (id=1) holding the current NoTD and when it changes."""
+
+    __tablename__ = "notd_state"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    position: Mapped[int] = mapped_column(Integer(), default=-1)
+    niko_id: Mapped[int | None] = mapped_column(
+        ForeignKey("nikos.id", ondelete="SET NULL"), nullable=True
+    )
+    refresh_at: Mapped[datetime] = mapped_column(DateTime())
+
+
+class Counter(Base):
+    """Row counts kept up to date by the services (see services/counters.py)."""
+
+    __tablename__ = "counters"
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    value: Mapped[int] = mapped_column(BigInteger(), default=0)
+
+
+class ImageBlob(Base):
+    """A stored image and how many rows use it (see services/blobs.py)."""
+
+    __tablename__ = "image_blobs"
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    refs: Mapped[int] = mapped_column(default=0)
+    size: Mapped[int] = mapped_column(default=0)
+    # last time refs changed; unused blobs are only collected after a while
+    updated_at: Mapped[datetime] = mapped_column(DateTime())
+
+    __table_args__ = (Index("ix_image_blobs_refs_updated_at", "refs", "updated_at"),)
+
+
+class ImageChange(Base):
+    """One write to an image column, for every worker to drop the path it
+    cached (see services/image_paths.py)."""
+
+    __tablename__ = "image_changes"
+    seq: Mapped[int] = mapped_column(
+        BigInteger(), primary_key=True, autoincrement=False
     )
-    chosen_at: Mapped[datetime] = mapped_column(
-        TIMESTAMP, server_default=func.now(), server_onupdate=func.now(), index=True
+    # table of the row: nikos, posts, submissions or users
+    kind: Mapped[str] = mapped_column(String(16))
+    entity_id: Mapped[int] = mapped_column()
+    changed_at: Mapped[datetime] = mapped_column(DateTime(), index=True)
+
+
+class Change(Base):
+    """One write to a synced entity, for GET /changes (see services/changes.py)."""
+
+    __tablename__ = "changes"
+    seq: Mapped[int] = mapped_column(
+        BigInteger(), primary_key=True, autoincrement=False
     )
+    entity: Mapped[str] = mapped_column(String(16))
+    entity_id: Mapped[int] = mapped_column()
+    deleted: Mapped[bool] = mapped_column(Boolean(), default=False)
+    changed_at: Mapped[datetime] = mapped_column(DateTime())
 
 
 class Ability(Base):
@@ -107,7 +172,7 @@ class Blog(Base):
     title: Mapped[str] = mapped_column(String(255))
     author: Mapped[str] = mapped_column(String(255))
     content: Mapped[str] = mapped_column(Text())
-    post_datetime: Mapped[datetime] = mapped_column(DateTime())
+    post_datetime: Mapped[datetime] = mapped_column(DateTime(), index=True)
 
 
 class User(Base):
@@ -158,7 +223,7 @@ class Submission(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
-    submit_date: Mapped[datetime] = mapped_column(DateTime())
+    submit_date: Mapped[datetime] = mapped_column(DateTime(), index=True)
     name: Mapped[str] = mapped_column(String(255))
     description: Mapped[str] = mapped_column(String(255))
     full_desc: Mapped[str] = mapped_column(String(1023))
@@ -191,6 +256,12 @@ class Comment(Base):
     post: Mapped["Post"] = relationship(back_populates="comments", passive_deletes=True)
     user: Mapped["User"] = relationship(back_populates="comments", passive_deletes=True)
 
+    # threads and user histories list comments newest (highest id) first
+    __table_args__ = (
+        Index("ix_comments_post_id_id", "post_id", "id"),
+        Index("ix_comments_author_id_id", "author_id", "id"),
+    )
+
 
 class PostNikoAgenda(Base):
     __tablename__ = "postniko_agenda"
@@ -10,29 +10,31 @@ from fastapi import (
 import services.abilities as service
 from common.dto import AbilityRequest, AbilityResponse, User
 from common.helper import get_auth_current_user
+from services._shared import DbSession, run_db
 
 router = APIRouter(prefix="/abilities", tags=["abilities"])
 
 
 @router.get("", response_model=List[AbilityResponse])
-def get_abilities():
-    return service.get_abilities()
+async def get_abilities(db: DbSession):
+    return await run_db(service.get_abilities, db=db)
 
 
 @router.get("/", response_model=AbilityResponse)
-def get_ability_by_id(id=1):
-    res = service.get_ability_by_id(id)
+async def get_ability_by_id(db: DbSession, id=1):
+    res = await run_db(service.get_ability_by_id, id, db=db)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found.")
     return res
 
 
 @router.post("")
-def post_ability(
+async def post_ability(
     ability: AbilityRequest,
     current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
-    res = service.insert_ability(ability, current_user.id)
+    res = await run_db(service.insert_ability, ability, current_user.id, db=db)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found.")
     if res["err"]:
@@ -41,12 +43,13 @@ def post_ability(
 
 
 @router.put("")
-def update_ability(
+async def update_ability(
     id: int,
     ability: AbilityRequest,
     current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
-    res = service.update_ability(id, ability, current_user.id)
+    res = await run_db(service.update_ability, id, ability, current_user.id, db=db)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found.")
     if res["err"]:
@@ -55,10 +58,12 @@ def update_ability(
 
 
 @router.delete("")
-def delete_ability(
-    id: int, current_user: Annotated[User, Depends(get_auth_current_user)]
+async def delete_ability(
+    id: int,
+    current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
-    res = service.delete_ability(id, current_user.id)
+    res = await run_db(service.delete_ability, id, current_user.id, db=db)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found.")
     if type(res) is dict:
@@ -0,0 +1,60 @@
+from typing import Annotated
+
+from fastapi import (
+    APIRouter,
+    Depends,
+)
+
+from common.dto import User
+from common.helper import AccountType, auth_err, get_auth_current_user
+from common.helper2 import account_of_type
+from services._shared import pool_stats, run_db
+from services.catalog import catalog
+from services.counters import reconcile_counters
+from services.image_paths import image_paths
+from services.imaging import image_pool
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+@router.get("/db_pool")
+def get_db_pool_stats(current_user: Annotated[User, Depends(get_auth_current_user)]):
+    if not account_of_type(current_user, AccountType.ADMIN):
+        raise auth_err
+    return pool_stats()
+
+
+@router.get("/catalog_cache")
+def get_catalog_cache_stats(
+    current_user: Annotated[User, Depends(get_auth_current_user)],
+):
+    if not account_of_type(current_user, AccountType.ADMIN):
+        raise auth_err
+    return catalog.stats()
+
+
+@router.get("/image_pool")
+def get_image_pool_stats(
+    current_user: Annotated[User, Depends(get_auth_current_user)],
+):
+    if not account_of_type(current_user, AccountType.ADMIN):
+        raise auth_err
+    return image_pool.stats()
+
+
+@router.get("/image_paths")
+def get_image_path_cache_stats(
+    current_user: Annotated[User, Depends(get_auth_current_user)],
+):
+    if not account_of_type(current_user, AccountType.ADMIN):
+        raise auth_err
+    return image_paths.stats()
+
+
+@router.post("/counters/reconcile")
+async def post_reconcile_counters(
+    current_user: Annotated[User, Depends(get_auth_current_user)],
+):
+    if not account_of_type(current_user, AccountType.ADMIN):
+        raise auth_err
+    return {"drift": await run_db(reconcile_counters)}
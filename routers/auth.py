@@ -17,6 +17,7 @@ from common.helper import (
 )
 from common.helper2 import account_of_type
 from common.models import AccountType
+from services._shared import DbSession, run_db
 
 router = APIRouter(prefix="/token", tags=["auth"])
 
@@ -24,8 +25,11 @@ router = APIRouter(prefix="/token", tags=["auth"])
 @router.post("")
 async def login_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+    db: DbSession,
 ) -> Token:
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await run_db(
+        authenticate_user, form_data.username, form_data.password, db=db
+    )
     if user is None or account_of_type(user, AccountType.DUMMY):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -10,23 +10,26 @@ from starlette.status import HTTP_404_NOT_FOUND
 import services.banner as service
 from common.dto import BannerRequest, BannerResponse, User
 from common.helper import AccountType, auth_err, get_auth_current_user
-from common.helper2 import account_of_type
+from common.helper2 import account_of_type, versioned
+from services._shared import DbSession, PrimaryDbSession, run_db
 
 router = APIRouter(prefix="/banner", tags=["banner"])
 
 
-@router.get("", response_model=BannerResponse)
-def get_banner():
-    res = service.get_banner()
+@router.get("", response_model=BannerResponse, dependencies=[versioned("banner")])
+async def get_banner(db: PrimaryDbSession):
+    res = await run_db(service.get_banner, db=db)
     if res is None:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Banner not found!")
     return res
 
 
 @router.post("")
-def post_banner(
-    banner: BannerRequest, current_user: Annotated[User, Depends(get_auth_current_user)]
+async def post_banner(
+    banner: BannerRequest,
+    current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
     if not account_of_type(current_user, AccountType.ADMIN):
         raise auth_err
-    return service.set_banner(banner)
+    return await run_db(service.set_banner, banner, db=db)
@@ -0,0 +1,40 @@
+import re
+
+from fastapi import APIRouter, HTTPException, Request, status
+
+import services.images as service
+from common.dto import ImageFormat
+from common.helper2 import file_response
+
+router = APIRouter(prefix="/blobs", tags=["images"])
+
+KEY = re.compile(r"[0-9a-f]{64}")
+
+
+# the image columns hold blobs/ab/cd/<key>.png: that path is the URL. Its
+# content never changes, so clients and CDNs may keep it forever. w and format
+# work like on GET /image
+@router.get("/{a}/{b}/{key}.png")
+def get_blob(
+    a: str,
+    b: str,
+    key: str,
+    request: Request,
+    w: int | None = None,
+    format: ImageFormat | None = None,
+):
+    if not KEY.fullmatch(key) or (a, b) != (key[:2], key[2:4]):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found.")
+    try:
+        path, media_type = service.get_blob(
+            key, w, format, request.headers.get("accept", "")
+        )
+    except service.ImageError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    # one strong tag per representation
+    width = service.pick_width(w) or 0
+    etag = f'"{key}-{width}-{media_type.split("/")[1]}"'
+    headers = {"Vary": "Accept"} if format is None else None
+    return file_response(
+        request, path, media_type, etag=etag, immutable=True, headers=headers
+    )
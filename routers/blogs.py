@@ -10,58 +10,66 @@ from fastapi import (
 import services.blogs as service
 from common.dto import BlogRequest, BlogResponse, User
 from common.helper import AccountType, auth_err, get_auth_current_user
-from common.helper2 import account_of_type
+from common.helper2 import account_of_type, versioned
+from services._shared import DbSession, PrimaryDbSession, run_db
 
 router = APIRouter(prefix="/blogs", tags=["blogs"])
 
 
-@router.get("", response_model=List[BlogResponse])
-def get_all_blogs():
-    return service.get_blogs()
+@router.get("", response_model=List[BlogResponse], dependencies=[versioned("blogs")])
+async def get_all_blogs(db: PrimaryDbSession):
+    return await run_db(service.get_blogs, db=db)
 
 
 @router.get("/", response_model=BlogResponse)
-def get_blog_by_id(id: int):
-    res = service.get_blog_by_id(id)
+async def get_blog_by_id(id: int, db: DbSession):
+    res = await run_db(service.get_blog_by_id, id, db=db)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found.")
     return res
 
 
 @router.post("")
-def post_blog(
-    blog: BlogRequest, current_user: Annotated[User, Depends(get_auth_current_user)]
+async def post_blog(
+    blog: BlogRequest,
+    current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
     if not account_of_type(current_user, AccountType.ADMIN):
         raise auth_err
 
-    res = service.post_blog(blog)
+    res = await run_db(service.post_blog, blog, db=db)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found.")
     return res
 
 
 @router.put("")
-def update_blog(
+async def update_blog(
     id: int,
     blog: BlogRequest,
     current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
     if not account_of_type(current_user, AccountType.ADMIN):
         raise auth_err
 
-    res = service.update_blog(id, blog)
+    res = await run_db(service.update_blog, id, blog, db=db)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found.")
     return res
 
 
 @router.delete("")
-def delete_blog(id: int, current_user: Annotated[User, Depends(get_auth_current_user)]):
+async def delete_blog(
+    id: int,
+    current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
+):
     if not account_of_type(current_user, AccountType.ADMIN):
         raise auth_err
 
-    res = service.delete_blog(id)
+    res = await run_db(service.delete_blog, id, db=db)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found.")
     return res
@@ -10,15 +10,18 @@ from fastapi import (
 import services.users as service
 from common.dto import SubmitUserRequest, SubmitUserResponse
 from common.helper import get_shared_token
+from services._shared import DbSession, run_db
 
 router = APIRouter(prefix="/discord_bot", tags=["bot"])
 
 
 @router.get("/submit_user", response_model=SubmitUserResponse)
-def get_log_user(
-    user_id: str, authorization: Annotated[None, Depends(get_shared_token)]
+async def get_log_user(
+    user_id: str,
+    authorization: Annotated[None, Depends(get_shared_token)],
+    db: DbSession,
 ):
-    res = service.get_submit_user(user_id)
+    res = await run_db(service.get_submit_user, user_id, db=db)
     if res is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Cannot find submit user!"
@@ -27,10 +30,11 @@ def get_log_user(
 
 
 @router.post("/submit_user")
-def log_user(
+async def log_user(
     user_id: str,
     submit_user: SubmitUserRequest,
     authorization: Annotated[None, Depends(get_shared_token)],
+    db: DbSession,
 ):
-    res = service.post_submit_user(user_id, submit_user)
+    res = await run_db(service.post_submit_user, user_id, submit_user, db=db)
     return res
@@ -0,0 +1,30 @@
+from fastapi import (
+    APIRouter,
+    HTTPException,
+    status,
+)
+
+import services.changes as service
+from common.dto import ChangeFeed
+from services._shared import DbSession, run_db
+
+router = APIRouter(prefix="/changes", tags=["changes"])
+
+
+# delta sync: start from the `next` of a full fetch (or 0) and keep passing
+# back the `next` you get. Fetch the changed entities with the /batch endpoints
+@router.get("", response_model=ChangeFeed)
+async def get_changes(db: DbSession, since: int = 0, limit: int = 500):
+    if since < 0 or limit < 1 or limit > service.MAX_CHANGES_PAGE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="since must be >= 0 and limit between 1 and "
+            f"{service.MAX_CHANGES_PAGE}.",
+        )
+    res = await run_db(service.get_changes, since, limit, db=db)
+    if res is None:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Changes this old were compacted away, fetch everything again.",
+        )
+    return res
@@ -11,28 +11,30 @@ import services.comments as service
 from common.dto import CommentRequest, CommentResponse
 from common.helper import get_auth_current_user
 from common.models import User
+from services._shared import DbSession, run_db
 
 router = APIRouter(prefix="/comments", tags=["comments", "posts"])
 
 
 @router.get("/post_id", response_model=List[CommentResponse])
-def get_all_comments_by_post_id(post_id: int):
-    res = service.get_all_comments_by_post_id(post_id)
+async def get_all_comments_by_post_id(post_id: int, db: DbSession):
+    res = await run_db(service.get_all_comments_by_post_id, post_id, db=db)
     return res
 
 
 @router.get("/user_id", response_model=List[CommentResponse])
-def get_all_comments_by_user_id(user_id: int):
-    res = service.get_all_comments_by_user_id(user_id)
+async def get_all_comments_by_user_id(user_id: int, db: DbSession):
+    res = await run_db(service.get_all_comments_by_user_id, user_id, db=db)
     return res
 
 
 @router.delete("")
-def delete_comment_on_post(
+async def delete_comment_on_post(
     comment_id: int,
     current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
-    res = service.delete_comment_on_post(current_user, comment_id)
+    res = await run_db(service.delete_comment_on_post, current_user, comment_id, db=db)
     if res:
         return {"msg": "Deleted comment."}
     else:
@@ -43,8 +45,11 @@ def delete_comment_on_post(
 async def create_comment_on_post(
     commentModel: CommentRequest,
     current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
-    res = await service.create_comment_on_post(current_user.id, commentModel)
+    res = await run_db(
+        service.create_comment_on_post, current_user.id, commentModel, db=db
+    )
 
     if not res["success"]:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=res["msg"])
@@ -4,14 +4,17 @@ from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Request,
     Response,
     UploadFile,
     status,
 )
 
 import services.images as service
-from common.dto import User
+from common.dto import ImageFormat, User
 from common.helper import get_auth_current_user
+from common.helper2 import file_response
+from services._shared import DbSession, run_db
 
 router = APIRouter(prefix="/image", tags=["images"])
 
@@ -21,9 +24,10 @@ async def upload_image(
     id: int,
     file: UploadFile,
     current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
     try:
-        await service.upload_image(id=id, file=file)
+        await service.upload_image(id=id, file=file, db=db)
     except service.ImageError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -37,9 +41,10 @@ async def put_image(
     id: int,
     file: UploadFile,
     current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
     try:
-        await service.edit_image(id=id, file=file)
+        await service.edit_image(id=id, file=file, db=db)
     except service.ImageError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -49,11 +54,13 @@ async def put_image(
 
 
 @router.delete("")
-def delete_image(
-    id: int, current_user: Annotated[User, Depends(get_auth_current_user)]
+async def delete_image(
+    id: int,
+    current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
     try:
-        service.delete_image(id=id)
+        await run_db(service.delete_image, id=id, db=db)
     except service.ImageError as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -62,10 +69,21 @@ def delete_image(
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
+# w: width in pixels, rounded up to one of IMAGE_WIDTHS (the original size when
+# left out). format: png, webp or avif, else the best one the Accept header takes
 @router.get("")
-def get_image(id: int):
+def get_image(
+    id: int,
+    request: Request,
+    w: int | None = None,
+    format: ImageFormat | None = None,
+):
     try:
-        res = service.get_image(id)
+        path, media_type, stat = service.get_image(
+            id, w, format, request.headers.get("accept", "")
+        )
     except service.ImageError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
-    return res
+    # the same URL gives another format to another Accept header
+    headers = {"Vary": "Accept"} if format is None else None
+    return file_response(request, path, media_type, stat=stat, headers=headers)
@@ -1,99 +1,253 @@
-from datetime import timezone
+from datetime import datetime, timezone
+from email.utils import format_datetime
 from typing import Annotated, List
 
 from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Request,
     Response,
     status,
 )
+from fastapi.responses import FileResponse
 
 import services.nikos as service
-from common.dto import NikoRequest, NikoResponse, SortType, User
+from common.dto import (
+    ExportFormat,
+    NikoBatch,
+    NikoCursorPage,
+    NikoRequest,
+    NikoResponse,
+    NikoSuggestion,
+    NikoSummaryResponse,
+    NikoView,
+    SortType,
+    User,
+)
 from common.helper import AccountType, auth_err, get_auth_current_user
-from common.helper2 import account_of_type
+from common.helper2 import account_of_type, etag_matches, export_response, versioned
+from services._shared import DbSession, PrimaryDbSession, parse_batch_ids, run_db
+from services.catalog import catalog
+from services.search import catalog_search
+from services.snapshot import nikos_snapshot
 
 router = APIRouter(prefix="/nikos", tags=["nikos"])
 
 
-@router.get("", response_model=List[NikoResponse])
-def get_all_nikos(sort_by: SortType = SortType.oldest_added):
-    return service.get_all(sort_by)
+@router.get(
+    "",
+    response_model=List[NikoResponse] | List[NikoSummaryResponse],
+    dependencies=[versioned("nikos")],
+)
+def get_all_nikos(
+    sort_by: SortType = SortType.oldest_added, view: NikoView = NikoView.full
+):
+    res = catalog.all(sort_by)
+    if view == NikoView.summary:
+        return catalog.summarize(res)
+    return res
+
 
+# the whole catalog prebuilt and precompressed on disk, for first page loads
+@router.get("/snapshot")
+def get_nikos_snapshot(request: Request):
+    path, encoding, hash = nikos_snapshot.pick(
+        request.headers.get("accept-encoding", "")
+    )
+    # one strong tag per representation
+    etag = f'"{hash}"' if encoding == "identity" else f'"{hash}-{encoding}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    # FileResponse hands the file to the server (sendfile when it supports it)
+    return FileResponse(path, media_type="application/json", headers=headers)
+
+
+# the whole table without holding it in memory, for dumps and mirrors
+@router.get("/export")
+def export_nikos(
+    format: ExportFormat = ExportFormat.ndjson,
+    sort_by: SortType = SortType.oldest_added,
+):
+    return export_response(service.stream_nikos(sort_by), format)
 
-@router.get("/random", response_model=NikoResponse)
-def get_random_nikos():
-    return service.get_random_niko()
+
+@router.get("/random", response_model=NikoResponse | List[NikoResponse])
+def get_random_nikos(n: int | None = None, exclude_blacklisted: bool = False):
+    if n is not None and (n < 1 or n > 100):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="n must be between 1 and 100.",
+        )
+
+    res = catalog.sample(n or 1, exclude_blacklisted)
+    if n is not None:
+        return res
+    if len(res) == 0:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return res[0]
 
 
 @router.get("/notd", response_model=NikoResponse)
-def get_notd(response: Response):
-    notd = service.get_notd()
+async def get_notd(response: Response, db: PrimaryDbSession):
+    notd = await run_db(service.get_notd, db=db)
     if notd is None:
         raise HTTPException(status_code=status.HTTP_418_IM_A_TEAPOT)
     data, refresh = notd
-    response.headers["X-RefreshAt"] = refresh.astimezone(timezone.utc).isoformat()
+    refresh_utc = refresh.astimezone(timezone.utc)
+    max_age = max(int((refresh_utc - datetime.now(timezone.utc)).total_seconds()), 0)
+    response.headers["X-RefreshAt"] = refresh_utc.isoformat()
+    response.headers["Cache-Control"] = f"public, max-age={max_age}"
+    response.headers["Expires"] = format_datetime(refresh_utc, usegmt=True)
     return data
 
 
-@router.get("/name", response_model=List[NikoResponse])
-def get_niko_by_name(name="Niko"):
-    return service.get_by_name(name)
+@router.get("/name", response_model=List[NikoResponse] | List[NikoSummaryResponse])
+def get_niko_by_name(
+    response: Response,
+    name="Niko",
+    page: int | None = None,
+    count: int = 14,
+    view: NikoView = NikoView.full,
+):
+    """Nikos matching `name` in their name, descriptions, abilities or author,
+    most relevant first, then those only containing it in their name. Without
+    `page`, every match is returned. X-Search-Truncated: true when the last
+    word is a prefix of too many words to try them all."""
+    index = catalog_search.current()
+    if page is None:
+        res, truncated = index.search(name)
+    elif page < 1 or count < 1 or count > 100:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="page must be at least 1 and count between 1 and 100.",
+        )
+    else:
+        res, truncated = index.search(name, (page - 1) * count, count)
+    if truncated:
+        response.headers["X-Search-Truncated"] = "true"
+
+    if view == NikoView.summary:
+        return catalog.summarize(res)
+    return res
+
+
+@router.get("/name/suggest", response_model=List[NikoSuggestion])
+def suggest_niko_names(q: str, limit: int = 8):
+    if limit < 1 or limit > 50:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="limit must be between 1 and 50.",
+        )
+    return catalog_search.current().suggest(q, limit)
 
 
-@router.get("/page", response_model=List[NikoResponse])
-def get_nikos_page(page=1, count=14, sort_by: SortType = SortType.oldest_added):
-    res = service.get_nikos_page(page, count, sort_by)
+@router.get("/page", response_model=List[NikoResponse] | List[NikoSummaryResponse])
+async def get_nikos_page(
+    db: DbSession,
+    page=1,
+    count=14,
+    sort_by: SortType = SortType.oldest_added,
+    view: NikoView = NikoView.full,
+    author: str | None = None,
+):
+    read = (
+        service.get_nikos_summary_page
+        if view == NikoView.summary
+        else service.get_nikos_page
+    )
+    res = await run_db(read, page, count, sort_by, author, db=db)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
     return res
 
 
+@router.get("/page/cursor", response_model=NikoCursorPage)
+async def get_nikos_cursor_page(
+    db: DbSession,
+    cursor: str | None = None,
+    count: int = 14,
+    sort_by: SortType = SortType.oldest_added,
+    author: str | None = None,
+):
+    if count < 1 or count > 100:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="count must be between 1 and 100.",
+        )
+    try:
+        return await run_db(
+            service.get_nikos_keyset_page, count, sort_by, cursor, author, db=db
+        )
+    except service.InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
 @router.get("/", response_model=NikoResponse)
-def get_niko_by_id(id=1):
-    res = service.get_niko_by_id(id)
+def get_niko_by_id(id: int = 1):
+    res = catalog.get(id)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
     return res
 
 
-@router.get("/user", response_model=List[NikoResponse])
-def get_niko_by_userid(id: int):
-    res = service.get_niko_by_userid(id)
-    if res is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+@router.get("/batch", response_model=NikoBatch)
+def get_nikos_by_ids(ids: str):
+    try:
+        ids = parse_batch_ids(ids)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return catalog.get_many(ids)
+
+
+@router.get(
+    "/user",
+    response_model=List[NikoResponse] | List[NikoSummaryResponse] | List[int],
+)
+def get_niko_by_userid(id: int, ids_only: bool = False, view: NikoView = NikoView.full):
+    res = catalog.by_author(id)
+    if ids_only:
+        return [niko.id for niko in res]
+    if view == NikoView.summary:
+        return catalog.summarize(res)
     return res
 
 
+# read from the primary, the bot calls this right after submitting
 @router.get("/user/latestid")
-def get_latest_niko_of_user(user_id: int):
-    res = service.get_niko_by_userid(user_id)
+async def get_latest_niko_of_user(user_id: int, db: PrimaryDbSession):
+    res = await run_db(service.get_latest_niko_id_of_user, user_id, db=db)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
-    return res[-1].id
+    return res
 
 
 @router.post("")
 async def post_niko(
-    niko: NikoRequest, current_user: Annotated[User, Depends(get_auth_current_user)]
+    niko: NikoRequest,
+    current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
     if not account_of_type(current_user, AccountType.ADMIN):
         raise auth_err
 
-    res = service.insert_niko(niko)
+    res = await run_db(service.insert_niko, niko, db=db)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found.")
     return res
 
 
 @router.put("")
-def update_niko(
+async def update_niko(
     id: int,
     niko: NikoRequest,
     current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
-    res = service.update_niko(id, niko, current_user.id)
+    res = await run_db(service.update_niko, id, niko, current_user.id, db=db)
     print(res)
     if res["err"]:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=res["msg"])
@@ -101,9 +255,17 @@ def update_niko(
 
 
 @router.delete("")
-def delete_niko(id: int, current_user: Annotated[User, Depends(get_auth_current_user)]):
-    res = service.delete_niko(
-        current_user.id, id, account_of_type(current_user, AccountType.ADMIN)
+async def delete_niko(
+    id: int,
+    current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
+):
+    res = await run_db(
+        service.delete_niko,
+        current_user.id,
+        id,
+        account_of_type(current_user, AccountType.ADMIN),
+        db=db,
     )
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found.")
@@ -113,4 +275,4 @@ def delete_niko(id: int, current_user: Annotated[User, Depends(get_auth_current_
 
 @router.get("/count")
 def get_niko_count():
-    return service.get_nikos_count()
+    return catalog.count()
@@ -4,67 +4,94 @@ from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Request,
     UploadFile,
     status,
 )
 
 import services.posts as service
-from common.dto import PostRequestForm, PostResponse, User
+from common.dto import ExportFormat, PostBatch, PostRequestForm, PostResponse, User
 from common.helper import AccountType, get_auth_current_user
-from common.helper2 import account_of_type
+from common.helper2 import (
+    account_of_type,
+    export_response,
+    file_response,
+    versioned,
+)
+from services._shared import DbSession, PrimaryDbSession, parse_batch_ids, run_db
 
 router = APIRouter(prefix="/posts", tags=["posts"])
 
 
 @router.get("", response_model=List[PostResponse])
-def get_posts():
-    res = service.get_posts()
+async def get_posts(db: DbSession):
+    res = await run_db(service.get_posts, db=db)
     return res
 
 
+@router.get("/export")
+def export_posts(format: ExportFormat = ExportFormat.ndjson):
+    return export_response(service.stream_posts(), format)
+
+
 @router.get("/count")
-def get_posts_count():
-    res = service.get_posts_count()
+async def get_posts_count(db: DbSession):
+    res = await run_db(service.get_posts_count, db=db)
     return res
 
 
-@router.get("/page", response_model=List[PostResponse])
-def get_posts_page(page: int, count: int):
-    res = service.get_posts_page(page, count)
+@router.get(
+    "/page",
+    response_model=List[PostResponse],
+    dependencies=[versioned("posts", "users")],
+)
+async def get_posts_page(page: int, count: int, db: PrimaryDbSession):
+    res = await run_db(service.get_posts_page, page, count, db=db)
     return res
 
 
 @router.get("/", response_model=PostResponse)
-def get_post_by_id(id: int):
-    res = service.get_post_id(id)
+async def get_post_by_id(id: int, db: DbSession):
+    res = await run_db(service.get_post_id, id, db=db)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found.")
     return res
 
 
+@router.get("/batch", response_model=PostBatch)
+async def get_posts_by_ids(ids: str, db: DbSession):
+    try:
+        ids = parse_batch_ids(ids)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return await run_db(service.get_posts_by_ids, ids, db=db)
+
+
 @router.get("/user", response_model=List[PostResponse])
-def get_posts_by_userid(user_id: int):
-    res = service.get_post_userid(user_id)
+async def get_posts_by_userid(user_id: int, db: DbSession):
+    res = await run_db(service.get_post_userid, user_id, db=db)
     return res
 
 
 @router.get("/image")
-def get_post_image(id: int):
+def get_post_image(id: int, request: Request):
     res = service.get_post_image(id)
     if res is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Image file not found!"
         )
-    return res
+    path, stat = res
+    return file_response(request, path, "image/png", stat=stat)
 
 
 @router.post("")
 async def post_post(
     file: UploadFile,
     current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
     req: PostRequestForm = Depends(),
 ):
-    res = await service.insert_post(current_user.id, req, file)
+    res = await service.insert_post(current_user.id, req, file, db=db)
     print(res)
     if res["err"]:
         raise HTTPException(
@@ -75,15 +102,19 @@ async def post_post(
 
 
 @router.delete("")
-def delete_post(id: int, current_user: Annotated[User, Depends(get_auth_current_user)]):
-    res = service.get_post_id(id)
+async def delete_post(
+    id: int,
+    current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
+):
+    res = await run_db(service.get_post_id, id, db=db)
     if not res:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found.")
     elif res.user.id != current_user.id and not account_of_type(
         current_user, AccountType.ADMIN
     ):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden.")
-    response_deletion = service.delete_post(res.id)
+    response_deletion = await run_db(service.delete_post, res.id, db=db)
     if response_deletion:
         return response_deletion
     else:
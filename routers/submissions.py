@@ -4,6 +4,7 @@ from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Request,
     UploadFile,
     status,
 )
@@ -11,20 +12,21 @@ from fastapi import (
 import services.submissions as service
 from common.dto import SubmissionResponse, SubmitForm, User
 from common.helper import AccountType, auth_err, get_auth_current_user
-from common.helper2 import account_of_type
+from common.helper2 import account_of_type, file_response
+from services._shared import DbSession, run_db
 
 router = APIRouter(prefix="/submissions", tags=["submissions"])
 
 
 @router.get("", response_model=List[SubmissionResponse])
-def get_submissions():
-    res = service.get_submissions()
+async def get_submissions(db: DbSession):
+    res = await run_db(service.get_submissions, db=db)
     return res
 
 
 @router.get("/", response_model=SubmissionResponse)
-def get_submission_by_id(id: int):
-    res = service.get_submission_by_id(id)
+async def get_submission_by_id(id: int, db: DbSession):
+    res = await run_db(service.get_submission_by_id, id, db=db)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found.")
     return res
@@ -35,28 +37,30 @@ def get_submission_by_id(id: int):
     response_model=List[SubmissionResponse],
     tags=["submissions"],
 )
-def get_submission_by_userid(user_id: int):
-    res = service.get_submissions_by_userid(user_id)
+async def get_submission_by_userid(user_id: int, db: DbSession):
+    res = await run_db(service.get_submissions_by_userid, user_id, db=db)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found.")
     return res
 
 
 @router.get("/image")
-def get_submission_image(id: int):
+def get_submission_image(id: int, request: Request):
     res = service.get_submission_image(id)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found.")
-    return res
+    path, stat = res
+    return file_response(request, path, "image/png", stat=stat)
 
 
 @router.post("")
 async def post_submission(
     file: UploadFile,
     current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
     submission: SubmitForm = Depends(),
 ):
-    res = await service.insert_submission(submission, current_user.id, file)
+    res = await service.insert_submission(submission, current_user.id, file, db=db)
     if res:
         return {"msg": "Inserted submission"}
     else:
@@ -68,9 +72,11 @@ async def post_submission(
 
 @router.delete("")
 async def delete_submission(
-    id: int, current_user: Annotated[User, Depends(get_auth_current_user)]
+    id: int,
+    current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
     if not account_of_type(current_user, AccountType.ADMIN):
         raise auth_err
-    service.delete_submission(id)
+    await run_db(service.delete_submission, id, db=db)
     return {"msg": "Deleted submission"}
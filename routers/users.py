@@ -6,22 +6,24 @@ from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Request,
     Response,
     status,
 )
 from fastapi.datastructures import UploadFile
 
 import services.users as service
-from common.dto import User, UserChangeRequest
+from common.dto import User, UserBatch, UserChangeRequest
 from common.helper import AccountType, get_auth_current_user
-from common.helper2 import account_of_type
+from common.helper2 import account_of_type, file_response
+from services._shared import DbSession, parse_batch_ids, run_db
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 
 @router.post("")
-async def post_user(user: UserChangeRequest):
-    res = service.insert_user(user, AccountType.NORMAL)
+async def post_user(user: UserChangeRequest, db: DbSession):
+    res = await run_db(service.insert_user, user, AccountType.NORMAL, db=db)
     if res:
         return {"msg": "Successfully created user."}
     else:
@@ -31,8 +33,8 @@ async def post_user(user: UserChangeRequest):
 
 
 @router.get("/name", response_model=User)
-def get_user_by_name(username: str):
-    res = service.get_user_by_name(username)
+async def get_user_by_name(username: str, db: DbSession):
+    res = await run_db(service.get_user_by_name, username, db=db)
     if res is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -41,17 +43,28 @@ def get_user_by_name(username: str):
     return res
 
 
+@router.get("/batch", response_model=UserBatch)
+async def get_users_by_ids(ids: str, db: DbSession):
+    try:
+        ids = parse_batch_ids(ids)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return await run_db(service.get_users_by_ids, ids, db=db)
+
+
 @router.get("/", response_model=User)
-def get_user_by_id(id: int):
-    res = service.get_user_by_id(id)
+async def get_user_by_id(id: int, db: DbSession):
+    res = await run_db(service.get_user_by_id, id, db=db)
     if res is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found.")
     return res
 
 
 @router.get("/usersearch", response_model=List[User])
-def get_users_by_namesearch(username: str, page: int = 1, count: int = 14):
-    res = service.get_user_by_usersearch(username, page, count)
+async def get_users_by_namesearch(
+    username: str, db: DbSession, page: int = 1, count: int = 14
+):
+    res = await run_db(service.get_user_by_usersearch, username, page, count, db=db)
     if res is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="No users found."
@@ -60,14 +73,15 @@ def get_users_by_namesearch(username: str, page: int = 1, count: int = 14):
 
 
 @router.get("/profile_picture")
-def get_profile_picture(id: int):
+def get_profile_picture(id: int, request: Request):
     res = service.get_user_profile_picture(id)
     if not res:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Profile Picture doesn't exist.",
         )
-    return res
+    path, stat = res
+    return file_response(request, path, "image/png", stat=stat)
 
 
 @router.put("/profile_picture")
@@ -75,6 +89,7 @@ async def put_profile_picture(
     file: UploadFile,
     user_id: int,
     current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
     print(current_user.id)
     print(user_id)
@@ -84,20 +99,22 @@ async def put_profile_picture(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Forbidden.",
             )
-    res = await service.update_profile_picture(user_id, file)
+    res = await service.update_profile_picture(user_id, file, db=db)
     return res
 
 
 @router.delete("/profile_picture")
 async def delete_profile_picture(
-    user_id: int, current_user: Annotated[User, Depends(get_auth_current_user)]
+    user_id: int,
+    current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
     if not account_of_type(current_user, AccountType.ADMIN):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Forbidden.",
         )
-    res = service.delete_profile_picture(user_id)
+    res = await run_db(service.delete_profile_picture, user_id, db=db)
     if res:
         return {"msg": "Deleted successfully."}
     else:
@@ -108,8 +125,8 @@ async def delete_profile_picture(
 
 
 @router.get("/count")
-def get_user_count():
-    return service.get_user_count()
+async def get_user_count(db: DbSession):
+    return await run_db(service.get_user_count, db=db)
 
 
 @router.get("/me", response_model=User)
@@ -118,7 +135,11 @@ def get_user_me(current_user: Annotated[User, Depends(get_auth_current_user)]):
 
 
 @router.delete("")
-def delete_user(id: int, current_user: Annotated[User, Depends(get_auth_current_user)]):
+async def delete_user(
+    id: int,
+    current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
+):
     if not account_of_type(current_user, AccountType.ADMIN) or (
         current_user.id != id and not account_of_type(current_user, AccountType.ADMIN)
     ):
@@ -126,7 +147,7 @@ def delete_user(id: int, current_user: Annotated[User, Depends(get_auth_current_
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Forbidden.",
         )
-    res = service.delete_user(id)
+    res = await run_db(service.delete_user, id, db=db)
     if res:
         return {"msg": "Deleted user."}
     else:
@@ -136,9 +157,10 @@ def delete_user(id: int, current_user: Annotated[User, Depends(get_auth_current_
 
 
 @router.put("/me")
-def change_user(
+async def change_user(
     new_user: UserChangeRequest,
     current_user: Annotated[User, Depends(get_auth_current_user)],
+    db: DbSession,
 ):
     username_pattern = r"^[A-Za-z0-9_]{1,32}$"
     if len(new_user.new_username.strip()) > 0 and not bool(
@@ -161,7 +183,7 @@ def change_user(
             detail="Description too long (max 512 characters)!",
         )
 
-    res = service.update_user(current_user.username, req=new_user)
+    res = await run_db(service.update_user, current_user.username, req=new_user, db=db)
     if res:
         return Response(status_code=status.HTTP_204_NO_CONTENT)
     else:
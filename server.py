@@ -1,16 +1,21 @@
+import asyncio
 import os
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 
 from routers import (
     abilities,
+    admin,
     auth,
     banner,
+    blobs,
     blogs,
     bot,
+    changes,
     comments,
     images,
     nikos,
@@ -18,11 +23,68 @@ from routers import (
     submissions,
     users,
 )
+from services._shared import READ_METHODS, replica_engine, stick_response
+from services.blobs import BLOB_GC_INTERVAL, collect_blobs, compact_image_changes
+from services.changes import CHANGES_COMPACT_INTERVAL, compact_changes
+from services.counters import COUNTER_RECONCILE_INTERVAL, reconcile_counters
+from services.image_paths import IMAGE_PATH_POLL_INTERVAL, image_paths
+from services.imaging import ImagePoolBusy, image_pool
+from services.snapshot import nikos_snapshot
+
+
+async def reconcile_counters_forever():
+    while True:
+        await asyncio.sleep(COUNTER_RECONCILE_INTERVAL)
+        try:
+            drift = await run_in_threadpool(reconcile_counters)
+            if drift:
+                print(f"Counters were off and have been fixed: {drift}")
+        except Exception as e:
+            print(f"Counter reconciliation failed: {e}")
+
+
+async def compact_changes_forever():
+    while True:
+        await asyncio.sleep(CHANGES_COMPACT_INTERVAL)
+        try:
+            await run_in_threadpool(compact_changes)
+            await run_in_threadpool(compact_image_changes)
+        except Exception as e:
+            print(f"Change log compaction failed: {e}")
+
+
+async def poll_image_paths_forever():
+    while True:
+        await asyncio.sleep(IMAGE_PATH_POLL_INTERVAL)
+        try:
+            await run_in_threadpool(image_paths.poll)
+        except Exception as e:
+            print(f"Reading image changes failed: {e}")
+
+
+async def collect_blobs_forever():
+    while True:
+        await asyncio.sleep(BLOB_GC_INTERVAL)
+        try:
+            await run_in_threadpool(collect_blobs)
+        except Exception as e:
+            print(f"Image blob collection failed: {e}")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    reconciler = asyncio.create_task(reconcile_counters_forever())
+    compactor = asyncio.create_task(compact_changes_forever())
+    collector = asyncio.create_task(collect_blobs_forever())
+    image_poller = asyncio.create_task(poll_image_paths_forever())
+    # writes made while we were down (or by another deployment) aren't in it
+    nikos_snapshot.schedule()
     yield
+    reconciler.cancel()
+    compactor.cancel()
+    collector.cancel()
+    image_poller.cancel()
+    image_pool.shutdown()
 
 
 origins = os.environ["FASTAPI_ALLOWED_ORIGIN"].split(",")
@@ -32,23 +94,53 @@ app = FastAPI(title="NikodexV2 API", lifespan=lifespan)
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
+    # a 304 (see common.helper2.versioned) must not carry a body
+    if exc.status_code == status.HTTP_304_NOT_MODIFIED:
+        return Response(status_code=exc.status_code, headers=exc.headers)
     return JSONResponse(
         status_code=exc.status_code, content={"error": exc.detail}, headers=exc.headers
     )
 
 
+@app.exception_handler(ImagePoolBusy)
+async def image_pool_busy_handler(request: Request, exc: ImagePoolBusy):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"error": str(exc)},
+        headers={"Retry-After": "5"},
+    )
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Search-Truncated"],
 )
+
+
+@app.middleware("http")
+async def stick_writers_to_primary(request: Request, call_next):
+    response = await call_next(request)
+    if (
+        replica_engine is not None
+        and request.method not in READ_METHODS
+        and response.status_code < 400
+    ):
+        stick_response(response)
+    return response
+
+
 app.include_router(abilities.router)
+app.include_router(admin.router)
 app.include_router(auth.router)
 app.include_router(banner.router)
+app.include_router(blobs.router)
 app.include_router(blogs.router)
 app.include_router(bot.router)
+app.include_router(changes.router)
 app.include_router(images.router)
 app.include_router(nikos.router)
 app.include_router(posts.router)
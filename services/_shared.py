@@ -1,30 +1,347 @@
+import hashlib
 import os
+import threading
+import time
+from contextlib import asynccontextmanager
 from types import TracebackType
-from typing import Optional, Type
+from typing import Annotated, Optional, Type
 
 from dotenv import load_dotenv
+from fastapi import Depends, Request, Response
 from sqlalchemy import (
     create_engine,
+    event,
+    text,
 )
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
 
 load_dotenv()
 
-connection_str = "mysql+mysqlconnector://{}:{}@{}:{}/{}".format(
-    os.environ["MYSQL_USER"],
-    os.environ["MYSQL_PASS"],
-    os.environ["MYSQL_URI"],
-    os.environ["MYSQL_PORT"],
-    "nikodex",
-)
 
-engine = create_engine(connection_str, echo=True)
+def env_flag(name: str, default: bool = False):
+    value = os.environ.get(name, "").strip().lower()
+    if value == "":
+        return default
+    return value in ("1", "true", "yes")
+
+
+def env_int(name: str, default: int):
+    value = os.environ.get(name, "").strip()
+    return int(value) if value else default
+
+
+# rollout flag for the async engine. while it's off, every service call keeps
+# going through the blocking engine (in a worker thread when called via run_db)
+USE_ASYNC_DB = env_flag("USE_ASYNC_DB")
+
+
+def build_connection_str(
+    driver: str = "mysqlconnector", host: str | None = None, port: str | None = None
+):
+    return "mysql+{}://{}:{}@{}:{}/{}".format(
+        driver,
+        os.environ["MYSQL_USER"],
+        os.environ["MYSQL_PASS"],
+        host or os.environ["MYSQL_URI"],
+        port or os.environ["MYSQL_PORT"],
+        "nikodex",
+    )
+
+
+class TimedPoolMixin:
+    """Records how long callers wait to check a connection out of the pool."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self._timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+
+    def wait_stats(self):
+        with self._stats_lock:
+            return {
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "wait_avg_ms": (
+                    self._wait_total / self._checkouts * 1000 if self._checkouts else 0
+                ),
+                "wait_max_ms": self._wait_max * 1000,
+            }
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+engines = {}
+
+
+def create_db_engine(name: str, url: str | None = None, is_async: bool = False):
+    """Build an engine with the pool settings from the environment.
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds), DB_POOL_RECYCLE
+    (seconds), DB_POOL_PRE_PING and DB_ECHO tune every engine built here.
+    """
+    options = dict(
+        echo=env_flag("DB_ECHO"),
+        pool_size=env_int("DB_POOL_SIZE", 5),
+        max_overflow=env_int("DB_MAX_OVERFLOW", 10),
+        pool_timeout=env_int("DB_POOL_TIMEOUT", 30),
+        pool_recycle=env_int("DB_POOL_RECYCLE", 3600),
+        pool_pre_ping=env_flag("DB_POOL_PRE_PING", True),
+    )
+    if is_async:
+        db_engine = create_async_engine(
+            url or build_connection_str("aiomysql"),
+            poolclass=TimedAsyncQueuePool,
+            **options,
+        )
+    else:
+        db_engine = create_engine(
+            url or build_connection_str(), poolclass=TimedQueuePool, **options
+        )
+    engines[name] = db_engine
+    return db_engine
+
+
+def pool_stats():
+    stats = {}
+    for name, db_engine in engines.items():
+        pool = db_engine.pool
+        stats[name] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            **(pool.wait_stats() if isinstance(pool, TimedPoolMixin) else {}),
+        }
+    return stats
+
+
+connection_str = build_connection_str()
+
+engine = create_db_engine("primary", connection_str)
 SessionLocal = sessionmaker(bind=engine, autoflush=False)
 
+async_engine = None
+AsyncSessionLocal = None
+if USE_ASYNC_DB:
+    async_engine = create_db_engine("primary_async", is_async=True)
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine, autoflush=False, expire_on_commit=False
+    )
+
+# optional read replica. GET requests read from it (see get_db) unless it's
+# unhealthy or the caller wrote something in the last REPLICA_STICKY_SECONDS
+REPLICA_URI = os.environ.get("MYSQL_REPLICA_URI", "").strip()
+REPLICA_PORT = os.environ.get("MYSQL_REPLICA_PORT", "").strip() or None
+REPLICA_STICKY_SECONDS = env_int("REPLICA_STICKY_SECONDS", 10)
+REPLICA_HEALTH_INTERVAL = env_int("REPLICA_HEALTH_INTERVAL", 15)
+READ_METHODS = ("GET", "HEAD")
+
+replica_engine = None
+ReplicaSessionLocal = None
+async_replica_engine = None
+AsyncReplicaSessionLocal = None
+if REPLICA_URI:
+    replica_engine = create_db_engine(
+        "replica", build_connection_str(host=REPLICA_URI, port=REPLICA_PORT)
+    )
+    ReplicaSessionLocal = sessionmaker(bind=replica_engine, autoflush=False)
+    if USE_ASYNC_DB:
+        async_replica_engine = create_db_engine(
+            "replica_async",
+            build_connection_str("aiomysql", host=REPLICA_URI, port=REPLICA_PORT),
+            is_async=True,
+        )
+        AsyncReplicaSessionLocal = async_sessionmaker(
+            bind=async_replica_engine, autoflush=False, expire_on_commit=False
+        )
+
+
+class ReplicaRouter:
+    """Tracks replica health and which callers must keep reading the primary.
+
+    Who wrote recently is only known to the worker that took the write; the
+    STICKY_COOKIE set on the response carries it to the others.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.healthy = True
+        self.checked_at = 0.0
+        self.sticky_until: dict[str, float] = {}
+
+    def probe_due(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.checked_at < REPLICA_HEALTH_INTERVAL:
+                return False
+            self.checked_at = now
+            return True
+
+    def mark(self, healthy: bool):
+        with self.lock:
+            if self.healthy != healthy:
+                print(f"Read replica is now {'healthy' if healthy else 'unhealthy'}")
+            self.healthy = healthy
+            self.checked_at = time.monotonic()
+
+    def stick(self, key: str):
+        with self.lock:
+            now = time.monotonic()
+            if len(self.sticky_until) > 4096:
+                self.sticky_until = {
+                    k: until for k, until in self.sticky_until.items() if until > now
+                }
+            self.sticky_until[key] = now + REPLICA_STICKY_SECONDS
+
+    def is_sticky(self, key: str):
+        with self.lock:
+            return self.sticky_until.get(key, 0.0) > time.monotonic()
+
+
+replica_router = ReplicaRouter()
+
+
+def _mark_replica_disconnect(context):
+    if context.is_disconnect:
+        replica_router.mark(False)
+
+
+if replica_engine is not None:
+    event.listen(replica_engine, "handle_error", _mark_replica_disconnect)
+if async_replica_engine is not None:
+    event.listen(
+        async_replica_engine.sync_engine, "handle_error", _mark_replica_disconnect
+    )
+
+
+def probe_replica():
+    try:
+        with replica_engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        replica_router.mark(True)
+    except Exception as e:
+        print(e)
+        replica_router.mark(False)
+
+
+async def probe_replica_async():
+    try:
+        async with async_replica_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        replica_router.mark(True)
+    except Exception as e:
+        print(e)
+        replica_router.mark(False)
+
+
+# set on the response to a write, so the client's next reads skip the replica
+# on whichever worker serves them. Holds the unix time it expires at
+STICKY_COOKIE = "read_primary_until"
+
+
+def stick_response(response: Response):
+    until = time.time() + REPLICA_STICKY_SECONDS
+    response.set_cookie(
+        STICKY_COOKIE,
+        f"{until:.0f}",
+        max_age=REPLICA_STICKY_SECONDS,
+        httponly=True,
+        samesite="lax",
+    )
+
+
+def has_sticky_cookie(request: Request):
+    try:
+        until = float(request.cookies.get(STICKY_COOKIE, 0))
+    except ValueError:
+        return False
+    now = time.time()
+    # a forged far-future value doesn't pin a client to the primary
+    return now < until <= now + REPLICA_STICKY_SECONDS + 1
+
+
+def sticky_key(request: Request):
+    # the bearer token identifies the user without another DB lookup
+    authorization = request.headers.get("authorization")
+    if not authorization:
+        return None
+    return hashlib.sha256(authorization.encode()).hexdigest()
+
+
+async def should_use_replica(request: Request):
+    if replica_engine is None or request.method not in READ_METHODS:
+        return False
+    if has_sticky_cookie(request):
+        return False
+    key = sticky_key(request)
+    if key is not None and replica_router.is_sticky(key):
+        return False
+    if replica_router.probe_due():
+        if USE_ASYNC_DB:
+            await probe_replica_async()
+        else:
+            await run_in_threadpool(probe_replica)
+    return replica_router.healthy
+
+
+# rows fetched per query when streaming a whole table out (see read_session)
+EXPORT_BATCH_SIZE = env_int("EXPORT_BATCH_SIZE", 500)
+
+
+def read_session():
+    """New session for reads that outlive the request, like streamed exports.
+
+    It's on the replica when one is configured and healthy. The caller closes
+    it (use it as a context manager).
+    """
+    if ReplicaSessionLocal is not None and replica_router.healthy:
+        return ReplicaSessionLocal()
+    return SessionLocal()
+
 
 class SessionManager:
+    """Hands out `session` when one is given (the request-scoped session from
+    get_db), otherwise opens a fresh one and closes it on the way out."""
+
+    def __init__(self, session: Session | None = None):
+        self.owned = session is None
+        self.session = session
+
     def __enter__(self):
-        self.session = SessionLocal()
+        if self.owned:
+            self.session = SessionLocal()
         return self.session
 
     def __exit__(
@@ -33,9 +350,145 @@ class SessionManager:
         exc_value: Optional[BaseException],
         traceback: Optional[TracebackType],
     ):
-        if exc_type:
-            print(exc_value)
-            self.session.rollback()
-            return False
+        try:
+            if exc_type:
+                print(exc_value)
+                self.session.rollback()
+        finally:
+            if self.owned:
+                self.session.close()
+        return False
+
+
+class AsyncSessionManager:
+    def __init__(self, session: AsyncSession | None = None):
+        self.owned = session is None
+        self.session = session
+
+    async def __aenter__(self):
+        if self.owned:
+            if AsyncSessionLocal is None:
+                raise RuntimeError(
+                    "The async engine is disabled (USE_ASYNC_DB is off)."
+                )
+            self.session = AsyncSessionLocal()
+        return self.session
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ):
+        try:
+            if exc_type:
+                print(exc_value)
+                await self.session.rollback()
+        finally:
+            if self.owned:
+                await self.session.close()
+        return False
+
+
+@asynccontextmanager
+async def request_session(replica: bool = False):
+    if USE_ASYNC_DB:
+        session = (AsyncReplicaSessionLocal if replica else AsyncSessionLocal)()
+        try:
+            yield session
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+        return
+
+    session = (ReplicaSessionLocal if replica else SessionLocal)()
+    try:
+        yield session
+    except Exception:
+        await run_in_threadpool(session.rollback)
+        raise
+    finally:
+        await run_in_threadpool(session.close)
+
+
+async def get_db(request: Request):
+    """FastAPI dependency yielding the one session shared by a whole request.
+
+    FastAPI caches it per request, so the auth dependency and every service
+    call made by the route reuse the same connection and transaction. GET
+    requests are served from the read replica when one is configured.
+    """
+    async with request_session(await should_use_replica(request)) as session:
+        yield session
+
+    if request.method not in READ_METHODS and (key := sticky_key(request)):
+        replica_router.stick(key)
+
+
+async def get_primary_db():
+    """Like get_db, but never uses the replica: for GETs that write, and for
+    versioned ones (the versions are read from the primary, a lagging replica
+    would put a stale body under a current ETag)."""
+    async with request_session() as session:
+        yield session
+
+
+DbSession = Annotated[Session | AsyncSession, Depends(get_db)]
+PrimaryDbSession = Annotated[Session | AsyncSession, Depends(get_primary_db)]
+
+
+# most ids one batch endpoint call may ask for
+MAX_BATCH_IDS = 100
+
+
+def parse_batch_ids(ids: str):
+    """Comma separated ids -> unique ints in request order. ValueError on junk."""
+    try:
+        parsed = list(dict.fromkeys(int(id) for id in ids.split(",") if id.strip()))
+    except ValueError:
+        raise ValueError("ids must be a comma separated list of integers.")
+    if len(parsed) == 0 or len(parsed) > MAX_BATCH_IDS:
+        raise ValueError(f"Give between 1 and {MAX_BATCH_IDS} ids.")
+    return parsed
+
+
+def batch_result(rows, ids: list[int]):
+    """Order rows like `ids` and list the ids nothing was found for."""
+    by_id = {row.id: row for row in rows}
+    return {
+        "items": [by_id[id] for id in ids if id in by_id],
+        "missing": [id for id in ids if id not in by_id],
+    }
+
+
+def async_variant(sync_fn):
+    """Register the decorated coroutine as the async engine version of `sync_fn`."""
+
+    def decorator(async_fn):
+        sync_fn.async_variant = async_fn
+        return async_fn
+
+    return decorator
+
+
+async def run_db(fn, *args, db: Session | AsyncSession | None = None, **kwargs):
+    """Call a service function without blocking the event loop.
+
+    Uses the registered async variant when USE_ASYNC_DB is on, otherwise runs
+    the blocking version in the threadpool. When `db` is an AsyncSession and
+    `fn` has no async variant yet, the blocking version runs on it through
+    `run_sync`, so unmigrated services still share the request's session.
+    """
+    async_fn = getattr(fn, "async_variant", None)
+    if db is None:
+        if USE_ASYNC_DB and async_fn is not None:
+            return await async_fn(*args, **kwargs)
+        return await run_in_threadpool(fn, *args, **kwargs)
 
-        self.session.close()
+    if isinstance(db, AsyncSession):
+        if async_fn is not None:
+            return await async_fn(*args, db=db, **kwargs)
+        return await db.run_sync(lambda session: fn(*args, db=session, **kwargs))
+    return await run_in_threadpool(fn, *args, db=db, **kwargs)
@@ -2,30 +2,35 @@ from sqlalchemy import (
     select,
 )
 from sqlalchemy.dialects.mysql import insert
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import Session, selectinload
 
 from common.dto import (
     AbilityRequest,
+    ChangeEntity,
 )
 from common.helper2 import account_of_type
 from common.models import Ability, AccountType, Niko, User
 from services._shared import SessionManager
+from services.catalog import catalog
+from services.changes import record_change
+from services.snapshot import nikos_snapshot
+from services.versions import bump_version
 
 
-def get_abilities():
-    with SessionManager() as session:
+def get_abilities(db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = select(Ability)
         return session.scalars(stmt).fetchall()
 
 
-def get_ability_by_id(id: int):
-    with SessionManager() as session:
+def get_ability_by_id(id: int, db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = select(Ability).where(Ability.id == id)
         return session.scalars(stmt).one()
 
 
-def insert_ability(req: AbilityRequest, user_id: int):
-    with SessionManager() as session:
+def insert_ability(req: AbilityRequest, user_id: int, db: Session | None = None):
+    with SessionManager(db) as session:
         niko_entity = session.execute(
             select(Niko).where(Niko.id == req.niko_id).options(selectinload(Niko.user))
         ).scalar_one_or_none()
@@ -47,15 +52,22 @@ def insert_ability(req: AbilityRequest, user_id: int):
 
         if allowed:
             stmt = insert(Ability).values(name=req.name, niko_id=req.niko_id)
-            session.execute(stmt)
+            result = session.execute(stmt)
+            bump_version(session, "nikos")
+            record_change(session, ChangeEntity.ability, result.inserted_primary_key[0])
+            record_change(session, ChangeEntity.niko, req.niko_id)
             session.commit()
+            catalog.invalidate()
+            nikos_snapshot.schedule()
             return {"msg": "Inserted Ability.", "err": False}
         else:
             return {"msg": "Unauthorized.", "err": False}
 
 
-def update_ability(id: int, req: AbilityRequest, user_id: int):
-    with SessionManager() as session:
+def update_ability(
+    id: int, req: AbilityRequest, user_id: int, db: Session | None = None
+):
+    with SessionManager(db) as session:
         user_entity = session.execute(
             select(User).where(User.id == user_id)
         ).scalar_one_or_none()
@@ -79,16 +91,23 @@ def update_ability(id: int, req: AbilityRequest, user_id: int):
                     allowed = True
 
         if allowed:
+            old_niko_id = entity.niko_id
             entity.name = req.name
             entity.niko_id = req.niko_id
+            bump_version(session, "nikos")
+            record_change(session, ChangeEntity.ability, id)
+            for niko_id in sorted({old_niko_id, req.niko_id}):
+                record_change(session, ChangeEntity.niko, niko_id)
             session.commit()
+            catalog.invalidate()
+            nikos_snapshot.schedule()
             return {"msg": "Updated Ability.", "err": False}
         else:
             return {"msg": "Unauthorized", "err": True}
 
 
-def delete_ability(id: int, user_id: int):
-    with SessionManager() as session:
+def delete_ability(id: int, user_id: int, db: Session | None = None):
+    with SessionManager(db) as session:
         entity = session.get(Ability, id)
         if entity is None:
             return None
@@ -121,7 +140,12 @@ def delete_ability(id: int, user_id: int):
 
         if allowed:
             session.delete(entity)
+            bump_version(session, "nikos")
+            record_change(session, ChangeEntity.ability, id, deleted=True)
+            record_change(session, ChangeEntity.niko, niko_entity.id)
             session.commit()
+            catalog.invalidate()
+            nikos_snapshot.schedule()
             return entity
         else:
             return {"msg": "Unauthorized.", "err": True}
@@ -3,16 +3,18 @@ import uuid
 from sqlalchemy import (
     select,
 )
+from sqlalchemy.orm import Session
 
 from common.dto import (
     BannerRequest,
 )
 from common.models import Banner
 from services._shared import SessionManager
+from services.versions import bump_version
 
 
-def get_banner():
-    with SessionManager() as session:
+def get_banner(db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = select(Banner)
         res = session.scalars(stmt).first()
         if res is None:
@@ -27,8 +29,8 @@ def get_banner():
         return res
 
 
-def set_banner(req: BannerRequest):
-    with SessionManager() as session:
+def set_banner(req: BannerRequest, db: Session | None = None):
+    with SessionManager(db) as session:
         session.merge(
             Banner(
                 id=1,
@@ -39,5 +41,6 @@ def set_banner(req: BannerRequest):
                 banner_identifier=str(uuid.uuid4()),
             )
         )
+        bump_version(session, "banner")
         session.commit()
         return {"msg": "Banner posted."}
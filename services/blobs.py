@@ -0,0 +1,201 @@
+import glob
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import InstrumentedAttribute, Session, SessionTransaction
+
+from common.models import Counter, ImageBlob, ImageChange, Niko, Post, Submission, User
+from services._shared import SessionManager, env_int
+from services.versions import VERSION_PREFIX, bump_version
+
+IMAGE_DIR = os.environ["IMG_DIR"]
+os.makedirs(IMAGE_DIR, exist_ok=True)
+# every stored image once, named after the hash of its normalized PNG bytes and
+# sharded by hash prefix: blobs/ab/cd/abcd....png
+BLOB_DIR = os.path.join(IMAGE_DIR, "blobs")
+# resized/re-encoded copies, made on first request (see services/images.py)
+VARIANT_DIR = os.path.join(IMAGE_DIR, "variants")
+os.makedirs(VARIANT_DIR, exist_ok=True)
+
+# seconds an unused blob is kept before it's deleted, so an upload racing
+# with the last reference going away can still revive it
+BLOB_GC_GRACE = env_int("BLOB_GC_GRACE", 3600)
+# seconds between two collections (see collect_blobs)
+BLOB_GC_INTERVAL = env_int("BLOB_GC_INTERVAL", 3600)
+# seconds image_changes are kept. A worker that couldn't read them for half
+# as long forgets every image path it cached
+IMAGE_CHANGES_RETENTION = env_int("IMAGE_CHANGES_RETENTION", 3600)
+
+# the columns holding image paths under IMAGE_DIR. Values not under blobs/
+# are files from before the blob store, not reference counted
+IMAGE_COLUMNS = (Niko.image, Post.image, Submission.image, User.profile_picture)
+
+
+def blob_name(key: str):
+    """Path of a blob under IMAGE_DIR, as stored in the image columns."""
+    return f"blobs/{key[:2]}/{key[2:4]}/{key}.png"
+
+
+def blob_key(name: str | None):
+    """The key of a stored image path, None for legacy files."""
+    if not name or not name.startswith("blobs/"):
+        return None
+    return os.path.basename(name).removesuffix(".png")
+
+
+def write_blob(name: str, png: bytes):
+    path = os.path.join(IMAGE_DIR, name)
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(png)
+    os.replace(tmp, path)
+
+
+def add_blob(session: Session, png: bytes):
+    """Take a reference to the blob of `png` (a normalized PNG) in the
+    caller's transaction, storing it if it's new. Returns its path."""
+    key = hashlib.sha256(png).hexdigest()
+    now = datetime.now()
+    try:
+        with session.begin_nested():
+            session.add(ImageBlob(key=key, refs=1, size=len(png), updated_at=now))
+    except IntegrityError:
+        session.execute(
+            update(ImageBlob)
+            .where(ImageBlob.key == key)
+            .values(refs=ImageBlob.refs + 1, updated_at=now)
+        )
+    # the blob row is locked until commit, so collect_blobs can't delete the
+    # file between here and then
+    name = blob_name(key)
+    write_blob(name, png)
+    return name
+
+
+def drop_blob(session: Session, name: str | None):
+    """Release a reference taken by add_blob. Files from before the blob
+    store belong to a single row and are deleted once the caller commits."""
+    if not name:
+        return
+    key = blob_key(name)
+    if key is None:
+        session.info.setdefault("dropped_files", []).append(name)
+        return
+    session.execute(
+        update(ImageBlob)
+        .where(ImageBlob.key == key)
+        .values(refs=ImageBlob.refs - 1, updated_at=datetime.now())
+    )
+
+
+@event.listens_for(Session, "after_commit")
+def _remove_dropped_files(session: Session):
+    for name in session.info.pop("dropped_files", []):
+        try:
+            os.remove(os.path.join(IMAGE_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _keep_dropped_files(session: Session, transaction: SessionTransaction):
+    # rolled back: the rows still point at them
+    if transaction.parent is None:
+        session.info.pop("dropped_files", None)
+
+
+def record_image_changes(
+    session: Session, column: InstrumentedAttribute, ids: list[int]
+):
+    """Log writes to `column` of the rows `ids` in the caller's transaction.
+    The images version numbers them and stays locked until the commit, so
+    they commit in order and a worker reading the log never skips one."""
+    if not ids:
+        return
+    bump_version(session, "images", len(ids))
+    last = session.scalar(
+        select(Counter.value).where(Counter.name == VERSION_PREFIX + "images")
+    )
+    kind = column.class_.__tablename__
+    now = datetime.now()
+    session.add_all(
+        ImageChange(
+            seq=last - len(ids) + i + 1, kind=kind, entity_id=id, changed_at=now
+        )
+        for i, id in enumerate(ids)
+    )
+    session.info.setdefault("image_changes", []).extend((kind, id) for id in ids)
+
+
+def record_image_change(session: Session, column: InstrumentedAttribute, id: int):
+    record_image_changes(session, column, [id])
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _forget_image_changes(session: Session, transaction: SessionTransaction):
+    # the after_commit listener of services/image_paths.py took them if it
+    # committed
+    if transaction.parent is None:
+        session.info.pop("image_changes", None)
+
+
+def compact_image_changes(db: Session | None = None):
+    """Drop image_changes older than IMAGE_CHANGES_RETENTION seconds."""
+    cutoff = datetime.now() - timedelta(seconds=IMAGE_CHANGES_RETENTION)
+    with SessionManager(db) as session:
+        dropped = session.execute(
+            delete(ImageChange).where(ImageChange.changed_at < cutoff)
+        ).rowcount
+        session.commit()
+        return dropped
+
+
+def drop_user_blobs(session: Session, user: User):
+    """Release the images of a user about to be deleted, with those of the
+    nikos, posts and submissions the delete cascades to."""
+    for column, owner in (
+        (Niko.image, Niko.author_id),
+        (Post.image, Post.user_id),
+        (Submission.image, Submission.user_id),
+    ):
+        rows = session.execute(
+            select(column.class_.id, column).where(owner == user.id)
+        ).all()
+        for _, name in rows:
+            drop_blob(session, name)
+        record_image_changes(session, column, [id for id, _ in rows])
+    drop_blob(session, user.profile_picture)
+    record_image_change(session, User.profile_picture, user.id)
+
+
+def delete_blob_files(key: str):
+    paths = [os.path.join(IMAGE_DIR, blob_name(key))]
+    paths += glob.glob(os.path.join(VARIANT_DIR, blob_name(key)[:-4] + "-*"))
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def collect_blobs(db: Session | None = None):
+    """Delete blobs nothing has referenced for BLOB_GC_GRACE seconds, with
+    their variants. Returns how many were deleted."""
+    cutoff = datetime.now() - timedelta(seconds=BLOB_GC_GRACE)
+    with SessionManager(db) as session:
+        blobs = session.scalars(
+            select(ImageBlob)
+            .where(ImageBlob.refs <= 0, ImageBlob.updated_at < cutoff)
+            .with_for_update(skip_locked=True)
+        ).all()
+        for blob in blobs:
+            delete_blob_files(blob.key)
+            session.delete(blob)
+        session.commit()
+        return len(blobs)
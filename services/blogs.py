@@ -5,57 +5,67 @@ from sqlalchemy import (
     select,
 )
 from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.orm import Session
 
 from common.dto import (
     BlogRequest,
+    ChangeEntity,
 )
 from common.models import Blog
 from services._shared import SessionManager
+from services.changes import record_change
+from services.versions import bump_version
 
 
-def get_blogs():
-    with SessionManager() as session:
+def get_blogs(db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = select(Blog).order_by(desc(Blog.post_datetime))
         return session.scalars(stmt).fetchall()
 
 
-def get_blog_by_id(id: int):
-    with SessionManager() as session:
+def get_blog_by_id(id: int, db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = select(Blog).where(Blog.id == id).limit(1)
         return session.scalars(stmt).one()
 
 
-def post_blog(req: BlogRequest):
-    with SessionManager() as session:
+def post_blog(req: BlogRequest, db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = insert(Blog).values(
             title=req.title,
             content=req.content,
             author=req.author,
             post_datetime=datetime.now(),
         )
-        session.execute(stmt)
+        result = session.execute(stmt)
+        bump_version(session, "blogs")
+        record_change(session, ChangeEntity.blog, result.inserted_primary_key[0])
         session.commit()
         return {"msg": "Posted Blog."}
 
 
-def update_blog(id: int, req: BlogRequest):
-    with SessionManager() as session:
+def update_blog(id: int, req: BlogRequest, db: Session | None = None):
+    with SessionManager(db) as session:
         entity = session.execute(select(Blog).where(Blog.id == id)).scalar_one_or_none()
         if entity is None:
             return None
         entity.title = req.title
         entity.content = req.content
         entity.author = req.author
+        bump_version(session, "blogs")
+        record_change(session, ChangeEntity.blog, id)
         session.commit()
         return {"msg": "Updated Blog."}
 
 
-def delete_blog(id: int):
-    with SessionManager() as session:
+def delete_blog(id: int, db: Session | None = None):
+    with SessionManager(db) as session:
         entity = session.execute(select(Blog).where(Blog.id == id)).scalar_one()
         if entity is None:
             return None
         else:
             session.delete(entity)
+            bump_version(session, "blogs")
+            record_change(session, ChangeEntity.blog, id, deleted=True)
             session.commit()
             return entity
@@ -0,0 +1,215 @@
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import asc, desc, select
+from sqlalchemy.orm import selectinload
+
+from common.dto import NikoResponse, NikoSummaryResponse, SortType
+from common.models import Niko
+from services._shared import SessionManager, env_int
+from services.versions import versions
+
+# writes through the services bump the nikos version, which every worker checks
+# (see services.versions); this only bounds how long writes made around them hide
+CATALOG_CACHE_TTL = env_int("CATALOG_CACHE_TTL", 60)
+
+# (sort column, descending) for every SortType. Niko.id always breaks ties so
+# the order is total, which is what lets keyset pagination resume from a row.
+NIKO_SORT_KEYS = {
+    SortType.recently_added: (Niko.id, True),
+    SortType.oldest_added: (Niko.id, False),
+    SortType.name_ascending: (Niko.name, False),
+    SortType.name_descending: (Niko.name, True),
+    SortType.author: (Niko.author_display, False),
+}
+
+
+def niko_order_by(sort_by: SortType):
+    column, descending = NIKO_SORT_KEYS[sort_by]
+    direction = desc if descending else asc
+    if column is Niko.id:
+        return [direction(Niko.id)]
+    return [direction(column), direction(Niko.id)]
+
+
+@dataclass(frozen=True)
+class CatalogState:
+    by_id: dict[int, NikoResponse]
+    orders: dict[SortType, list[NikoResponse]]
+    by_author: dict[int, list[NikoResponse]]
+    summaries: dict[int, NikoSummaryResponse]
+    # id arrays to sample /nikos/random from
+    ids: tuple[int, ...]
+    listed_ids: tuple[int, ...]
+
+
+def niko_summary(niko: NikoResponse):
+    return NikoSummaryResponse(
+        id=niko.id,
+        name=niko.name,
+        description=niko.description,
+        is_blacklisted=niko.is_blacklisted,
+        author_id=niko.author_id,
+        author_name=niko.author_name,
+    )
+
+
+def build_catalog_state(
+    nikos: list[NikoResponse], name_ids: list[int], author_ids: list[int]
+):
+    """`name_ids` and `author_ids` are the ids in the name_ascending and author
+    orders, as the DB sorts them: its collation, not Python's, orders names
+    on /nikos/page and its cursors."""
+    oldest = sorted(nikos, key=lambda niko: niko.id)
+    by_id = {niko.id: niko for niko in oldest}
+    by_name = [by_id[id] for id in name_ids if id in by_id]
+    by_author_name = [by_id[id] for id in author_ids if id in by_id]
+
+    by_author: dict[int, list[NikoResponse]] = {}
+    for niko in oldest:
+        if niko.author_id is not None:
+            by_author.setdefault(niko.author_id, []).append(niko)
+
+    return CatalogState(
+        by_id=by_id,
+        orders={
+            SortType.oldest_added: oldest,
+            SortType.recently_added: oldest[::-1],
+            SortType.name_ascending: by_name,
+            # (name, id) descending, as niko_order_by has it
+            SortType.name_descending: by_name[::-1],
+            SortType.author: by_author_name,
+        },
+        by_author=by_author,
+        summaries={niko.id: niko_summary(niko) for niko in oldest},
+        ids=tuple(niko.id for niko in oldest),
+        listed_ids=tuple(niko.id for niko in oldest if not niko.is_blacklisted),
+    )
+
+
+class NikoCatalog:
+    """Memory-resident copy of every Niko, ready to serve as NikoResponse.
+
+    The niko and ability services call invalidate() after each commit; the
+    next read rebuilds the whole catalog with one query. Other workers notice
+    the write through the nikos version.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.state: CatalogState | None = None
+        self.loaded_at = 0.0
+        self.version = None
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.invalidations = 0
+
+    def _is_fresh(self, version: int):
+        return (
+            self.state is not None
+            and self.version == version
+            and time.monotonic() - self.loaded_at < self.ttl
+        )
+
+    def _load(self):
+        with SessionManager() as session:
+            stmt = (
+                select(Niko)
+                .options(selectinload(Niko.abilities), selectinload(Niko.user))
+                .order_by(Niko.id)
+            )
+            nikos = [
+                NikoResponse.model_validate(niko, from_attributes=True)
+                for niko in session.scalars(stmt)
+            ]
+            name_ids = session.scalars(
+                select(Niko.id).order_by(*niko_order_by(SortType.name_ascending))
+            ).all()
+            author_ids = session.scalars(
+                select(Niko.id).order_by(*niko_order_by(SortType.author))
+            ).all()
+        return build_catalog_state(nikos, name_ids, author_ids)
+
+    def snapshot(self) -> CatalogState:
+        # read before loading, so a write during the load only bumps it further
+        version = versions.get("nikos")
+        with self.lock:
+            if self._is_fresh(version):
+                self.hits += 1
+                return self.state
+            self.misses += 1
+
+        with self.load_lock:
+            with self.lock:
+                # someone else reloaded while we were waiting
+                if self._is_fresh(version):
+                    return self.state
+                generation = self.generation
+
+            state = self._load()
+            with self.lock:
+                self.loads += 1
+                # a write during the load may not be in `state`, don't keep it
+                if generation == self.generation:
+                    self.state = state
+                    self.loaded_at = time.monotonic()
+                    self.version = version
+            return state
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.state = None
+            self.invalidations += 1
+
+    def all(self, sort_by: SortType):
+        return self.snapshot().orders[sort_by]
+
+    def get(self, id: int):
+        return self.snapshot().by_id.get(id)
+
+    def by_author(self, user_id: int):
+        return self.snapshot().by_author.get(user_id, [])
+
+    def get_many(self, ids: list[int]):
+        by_id = self.snapshot().by_id
+        return {
+            "items": [by_id[id] for id in ids if id in by_id],
+            "missing": [id for id in ids if id not in by_id],
+        }
+
+    def summarize(self, nikos: list[NikoResponse]):
+        summaries = self.snapshot().summaries
+        return [summaries.get(niko.id) or niko_summary(niko) for niko in nikos]
+
+    def sample(self, n: int, exclude_blacklisted: bool = False):
+        """Up to `n` distinct random nikos."""
+        state = self.snapshot()
+        ids = state.listed_ids if exclude_blacklisted else state.ids
+        return [state.by_id[id] for id in random.sample(ids, min(n, len(ids)))]
+
+    def count(self):
+        return len(self.snapshot().by_id)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.state.by_id) if self.state else None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "loads": self.loads,
+                "invalidations": self.invalidations,
+                "ttl": self.ttl,
+                "version": self.version,
+            }
+
+
+catalog = NikoCatalog(CATALOG_CACHE_TTL)
@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from common.dto import ChangeEntity
+from common.models import Ability, Change, Comment, Counter, Niko, Post
+from services._shared import (
+    AsyncSessionManager,
+    SessionManager,
+    async_variant,
+    env_int,
+)
+
+# changes older than this are dropped; clients further behind resync in full
+CHANGES_RETENTION_DAYS = env_int("CHANGES_RETENTION_DAYS", 30)
+# seconds between two compactions (see compact_changes)
+CHANGES_COMPACT_INTERVAL = env_int("CHANGES_COMPACT_INTERVAL", 3600)
+MAX_CHANGES_PAGE = 1000
+
+# counters rows: the last seq handed out, and the last seq compacted away
+SEQ_COUNTER = "changes"
+FLOOR_COUNTER = "changes_floor"
+
+
+def record_changes(
+    session: Session, entity: ChangeEntity, ids: list[int], deleted: bool = False
+):
+    """Log writes to `ids` in the caller's transaction. Call it last before
+    the commit: the seq row stays locked until then, which is what makes
+    seqs commit in order (a reader can never skip over a late commit)."""
+    if not ids:
+        return
+    session.execute(
+        update(Counter)
+        .where(Counter.name == SEQ_COUNTER)
+        .values(value=Counter.value + len(ids))
+    )
+    last = session.scalar(select(Counter.value).where(Counter.name == SEQ_COUNTER))
+    if last is None:
+        session.add(Counter(name=SEQ_COUNTER, value=len(ids)))
+        session.flush()
+        last = len(ids)
+    now = datetime.now()
+    session.add_all(
+        Change(
+            seq=last - len(ids) + i + 1,
+            entity=entity.value,
+            entity_id=id,
+            deleted=deleted,
+            changed_at=now,
+        )
+        for i, id in enumerate(ids)
+    )
+
+
+def record_change(
+    session: Session, entity: ChangeEntity, id: int, deleted: bool = False
+):
+    record_changes(session, entity, [id], deleted)
+
+
+def record_niko_deleted(session: Session, niko_ids: list[int]):
+    """Tombstones for nikos about to be deleted and their cascaded abilities."""
+    abilities = session.scalars(
+        select(Ability.id).where(Ability.niko_id.in_(niko_ids))
+    ).all()
+    record_changes(session, ChangeEntity.ability, list(abilities), deleted=True)
+    record_changes(session, ChangeEntity.niko, niko_ids, deleted=True)
+
+
+def record_post_deleted(session: Session, post_ids: list[int]):
+    """Tombstones for posts about to be deleted and their cascaded comments."""
+    comments = session.scalars(
+        select(Comment.id).where(Comment.post_id.in_(post_ids))
+    ).all()
+    record_changes(session, ChangeEntity.comment, list(comments), deleted=True)
+    record_changes(session, ChangeEntity.post, post_ids, deleted=True)
+
+
+def record_user_deleted(session: Session, user_id: int):
+    """Tombstones for everything deleting a user cascades to."""
+    nikos = session.scalars(select(Niko.id).where(Niko.author_id == user_id)).all()
+    posts = session.scalars(select(Post.id).where(Post.user_id == user_id)).all()
+    # comments on their posts go with the posts
+    comments = session.scalars(
+        select(Comment.id).where(
+            Comment.author_id == user_id, Comment.post_id.not_in(posts)
+        )
+    ).all()
+    record_changes(session, ChangeEntity.comment, list(comments), deleted=True)
+    record_post_deleted(session, list(posts))
+    record_niko_deleted(session, list(nikos))
+
+
+def record_user_renamed(session: Session, user_id: int):
+    """Everything showing the username changed."""
+    for entity, model, column in (
+        (ChangeEntity.niko, Niko, Niko.author_id),
+        (ChangeEntity.post, Post, Post.user_id),
+        (ChangeEntity.comment, Comment, Comment.author_id),
+    ):
+        ids = session.scalars(select(model.id).where(column == user_id)).all()
+        record_changes(session, entity, list(ids))
+
+
+def changes_stmt(since: int, limit: int):
+    return select(Change).where(Change.seq > since).order_by(Change.seq).limit(limit)
+
+
+def changes_page(rows: list[Change], since: int, limit: int):
+    # only the latest write to each entity matters to a client
+    latest = {(row.entity, row.entity_id): row for row in rows}
+    return {
+        "changes": [
+            {
+                "seq": row.seq,
+                "entity": row.entity,
+                "id": row.entity_id,
+                "deleted": row.deleted,
+            }
+            for row in sorted(latest.values(), key=lambda row: row.seq)
+        ],
+        "next": rows[-1].seq if rows else since,
+        "more": len(rows) == limit,
+    }
+
+
+def get_changes(since: int, limit: int, db: Session | None = None):
+    """Changes after `since`, or None when some were already compacted away."""
+    with SessionManager(db) as session:
+        floor = session.scalar(
+            select(Counter.value).where(Counter.name == FLOOR_COUNTER)
+        )
+        if since < (floor or 0):
+            return None
+        rows = session.scalars(changes_stmt(since, limit)).all()
+        return changes_page(rows, since, limit)
+
+
+@async_variant(get_changes)
+async def get_changes_async(since: int, limit: int, db: AsyncSession | None = None):
+    async with AsyncSessionManager(db) as session:
+        floor = await session.scalar(
+            select(Counter.value).where(Counter.name == FLOOR_COUNTER)
+        )
+        if since < (floor or 0):
+            return None
+        rows = (await session.scalars(changes_stmt(since, limit))).all()
+        return changes_page(rows, since, limit)
+
+
+def compact_changes(db: Session | None = None):
+    """Drop changes older than CHANGES_RETENTION_DAYS and raise the floor below
+    which /changes answers 410. Returns how many were dropped."""
+    cutoff = datetime.now() - timedelta(days=CHANGES_RETENTION_DAYS)
+    with SessionManager(db) as session:
+        floor = session.scalar(
+            select(func.max(Change.seq)).where(Change.changed_at < cutoff)
+        )
+        if floor is None:
+            return 0
+        # floor and deletion commit together, readers see both or neither
+        counter = session.get(Counter, FLOOR_COUNTER, with_for_update=True)
+        if counter is None:
+            session.add(Counter(name=FLOOR_COUNTER, value=floor))
+        else:
+            counter.value = max(counter.value, floor)
+        dropped = session.execute(delete(Change).where(Change.seq <= floor)).rowcount
+        session.commit()
+        return dropped
@@ -5,19 +5,21 @@ from datetime import datetime
 
 from dotenv import load_dotenv
 from sqlalchemy import desc, insert, select
-from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 
-from common.dto import CommentRequest, PostRequest
+from common.dto import ChangeEntity, CommentRequest, PostRequest
 from common.helper2 import account_of_type
 from common.models import AccountType, Comment, Post, User
-from services._shared import SessionManager
+from services._shared import AsyncSessionManager, SessionManager, async_variant
+from services.changes import record_change
 
 load_dotenv()
 COMMENT_RATE_LIMIT = int(os.environ["COMMENT_RATE_LIMIT"])
 
 
-def get_all_comments_by_user_id(user_id: int):
-    with SessionManager() as session:
+def get_all_comments_by_user_id(user_id: int, db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = (
             select(Comment)
             .where(Comment.author_id == user_id)
@@ -27,8 +29,22 @@ def get_all_comments_by_user_id(user_id: int):
         return session.execute(stmt).scalars().fetchall()
 
 
-def get_all_comments_by_post_id(post_id: int):
-    with SessionManager() as session:
+@async_variant(get_all_comments_by_user_id)
+async def get_all_comments_by_user_id_async(
+    user_id: int, db: AsyncSession | None = None
+):
+    async with AsyncSessionManager(db) as session:
+        stmt = (
+            select(Comment)
+            .where(Comment.author_id == user_id)
+            .options(selectinload(Comment.user))
+        )
+        stmt = stmt.order_by(desc(Comment.id))
+        return (await session.execute(stmt)).scalars().fetchall()
+
+
+def get_all_comments_by_post_id(post_id: int, db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = (
             select(Comment)
             .where(Comment.post_id == post_id)
@@ -38,8 +54,22 @@ def get_all_comments_by_post_id(post_id: int):
         return session.execute(stmt).scalars().fetchall()
 
 
-def delete_comment_on_post(user: User, comment_id: int):
-    with SessionManager() as session:
+@async_variant(get_all_comments_by_post_id)
+async def get_all_comments_by_post_id_async(
+    post_id: int, db: AsyncSession | None = None
+):
+    async with AsyncSessionManager(db) as session:
+        stmt = (
+            select(Comment)
+            .where(Comment.post_id == post_id)
+            .options(selectinload(Comment.user))
+        )
+        stmt = stmt.order_by(desc(Comment.id))
+        return (await session.execute(stmt)).scalars().fetchall()
+
+
+def delete_comment_on_post(user: User, comment_id: int, db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = session.execute(
             select(Comment).where(Comment.id == comment_id)
         ).scalar_one_or_none()
@@ -51,13 +81,25 @@ def delete_comment_on_post(user: User, comment_id: int):
             return {"status_code": 401, "message": "Forbidden"}
 
         session.delete(stmt)
+        record_change(session, ChangeEntity.comment, comment_id, deleted=True)
         session.commit()
 
         return True
 
 
-async def create_comment_on_post(user_id: int, requestedRequest: CommentRequest):
-    with SessionManager() as session:
+def comment_rate_limit_msg(user: User):
+    if user.last_comment_at and not account_of_type(user, AccountType.ADMIN):
+        total_seconds = (datetime.now() - user.last_comment_at).total_seconds()
+        total_minutes = total_seconds / 60
+        if total_minutes < COMMENT_RATE_LIMIT:
+            return f"You have {math.floor(COMMENT_RATE_LIMIT - total_minutes)} minutes and {math.ceil((COMMENT_RATE_LIMIT * 60 - total_seconds) % 60)} seconds left before you can comment."
+    return None
+
+
+def create_comment_on_post(
+    user_id: int, requestedRequest: CommentRequest, db: Session | None = None
+):
+    with SessionManager(db) as session:
         post_check = session.execute(
             select(Post).where(Post.id == requestedRequest.post_id)
         ).scalar_one_or_none()
@@ -69,18 +111,8 @@ async def create_comment_on_post(user_id: int, requestedRequest: CommentRequest)
         if not user_last_comment_check or not post_check:
             return {"msg": "User or Comment doesn't exist.", "success": False}
 
-        if user_last_comment_check.last_comment_at and not account_of_type(
-            user_last_comment_check, AccountType.ADMIN
-        ):
-            total_seconds = (
-                datetime.now() - user_last_comment_check.last_comment_at
-            ).total_seconds()
-            total_minutes = total_seconds / 60
-            if total_minutes < COMMENT_RATE_LIMIT:
-                return {
-                    "msg": f"You have {math.floor(COMMENT_RATE_LIMIT - total_minutes)} minutes and {math.ceil((COMMENT_RATE_LIMIT * 60 - total_seconds) % 60)} seconds left before you can comment.",
-                    "success": False,
-                }
+        if msg := comment_rate_limit_msg(user_last_comment_check):
+            return {"msg": msg, "success": False}
 
         user_last_comment_check.last_comment_at = datetime.now()
 
@@ -93,7 +125,49 @@ async def create_comment_on_post(user_id: int, requestedRequest: CommentRequest)
             post_date=datetime.now(),
             content=requestedRequest.content,
         )
-        session.execute(stmt)
+        result = session.execute(stmt)
+        record_change(session, ChangeEntity.comment, result.inserted_primary_key[0])
         session.commit()
 
         return {"msg": "Inserted comment.", "success": True}
+
+
+@async_variant(create_comment_on_post)
+async def create_comment_on_post_async(
+    user_id: int, requestedRequest: CommentRequest, db: AsyncSession | None = None
+):
+    async with AsyncSessionManager(db) as session:
+        post_check = (
+            await session.execute(
+                select(Post).where(Post.id == requestedRequest.post_id)
+            )
+        ).scalar_one_or_none()
+
+        user_last_comment_check = (
+            await session.execute(select(User).where(User.id == user_id))
+        ).scalar_one_or_none()
+
+        if not user_last_comment_check or not post_check:
+            return {"msg": "User or Comment doesn't exist.", "success": False}
+
+        if msg := comment_rate_limit_msg(user_last_comment_check):
+            return {"msg": msg, "success": False}
+
+        user_last_comment_check.last_comment_at = datetime.now()
+
+        if len(requestedRequest.content) > 300:
+            return {"msg": "Comment too long.", "success": False}
+
+        stmt = insert(Comment).values(
+            author_id=user_id,
+            post_id=requestedRequest.post_id,
+            post_date=datetime.now(),
+            content=requestedRequest.content,
+        )
+        result = await session.execute(stmt)
+        await session.run_sync(
+            record_change, ChangeEntity.comment, result.inserted_primary_key[0]
+        )
+        await session.commit()
+
+        return {"msg": "Inserted comment.", "success": True}
@@ -0,0 +1,76 @@
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from common.models import Counter, Post, User
+from services._shared import (
+    AsyncSessionManager,
+    SessionManager,
+    async_variant,
+    env_int,
+)
+
+# seconds between two reconciliations (see reconcile_counters)
+COUNTER_RECONCILE_INTERVAL = env_int("COUNTER_RECONCILE_INTERVAL", 3600)
+
+# counter name -> the model whose rows it counts. nikos aren't here, the
+# catalog already serves /nikos/count from memory
+COUNTED = {
+    "posts": Post,
+    "users": User,
+}
+
+
+def bump_counter(session: Session, name: str, delta: int):
+    """Add `delta` to a counter in the caller's transaction. Call it before
+    the commit of the insert/delete it accounts for."""
+    session.execute(
+        update(Counter).where(Counter.name == name).values(value=Counter.value + delta)
+    )
+
+
+def forget_user(session: Session, user: User):
+    """Account for a user about to be deleted, with the posts that go with
+    it (the posts.user_id foreign key cascades)."""
+    posts = session.scalar(select(func.count(Post.id)).where(Post.user_id == user.id))
+    bump_counter(session, "posts", -posts)
+    bump_counter(session, "users", -1)
+
+
+def get_counter(name: str, db: Session | None = None):
+    with SessionManager(db) as session:
+        value = session.scalar(select(Counter.value).where(Counter.name == name))
+        if value is None:
+            # never reconciled yet, count for real
+            value = session.scalar(select(func.count()).select_from(COUNTED[name]))
+        return value
+
+
+@async_variant(get_counter)
+async def get_counter_async(name: str, db: AsyncSession | None = None):
+    async with AsyncSessionManager(db) as session:
+        value = await session.scalar(select(Counter.value).where(Counter.name == name))
+        if value is None:
+            value = await session.scalar(
+                select(func.count()).select_from(COUNTED[name])
+            )
+        return value
+
+
+def reconcile_counters(db: Session | None = None):
+    """Recompute every counter with COUNT(*). Returns the drift found, which
+    should stay empty unless something wrote around the services."""
+    drift = {}
+    with SessionManager(db) as session:
+        for name, model in COUNTED.items():
+            # lock first: writers bump the row before committing, so once we
+            # hold it every committed row is in the count and no bump is lost
+            counter = session.get(Counter, name, with_for_update=True)
+            exact = session.scalar(select(func.count()).select_from(model))
+            if counter is None:
+                session.add(Counter(name=name, value=exact))
+            elif counter.value != exact:
+                drift[name] = exact - counter.value
+                counter.value = exact
+            session.commit()
+    return drift
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from common.models import Counter, ImageChange, Niko, Post, Submission, User
+from services._shared import SessionManager, env_int
+from services.blobs import IMAGE_CHANGES_RETENTION, IMAGE_DIR
+from services.versions import VERSION_PREFIX
+
+# ids whose image path each worker remembers
+IMAGE_PATH_CACHE_SIZE = env_int("IMAGE_PATH_CACHE_SIZE", 100_000)
+# seconds between two reads of image_changes; how late other workers notice
+# an image write
+IMAGE_PATH_POLL_INTERVAL = env_int("IMAGE_PATH_POLL_INTERVAL", 2)
+
+DEFAULT_IMAGE = "images/default.png"
+DEFAULT_PFP = "images/default_pfp.png"
+
+# kind -> (image column, image shown when there's none)
+KINDS = {
+    "nikos": (Niko.image, DEFAULT_IMAGE),
+    "posts": (Post.image, DEFAULT_IMAGE),
+    "submissions": (Submission.image, DEFAULT_IMAGE),
+    "users": (User.profile_picture, DEFAULT_PFP),
+}
+
+
+class ImagePaths:
+    """id -> image file of nikos, posts, submissions and users, so serving an
+    image doesn't take a query.
+
+    Every write to an image column is logged in image_changes (see
+    services/blobs.py record_image_changes). The worker making it drops the
+    ids once it commits, the others when poll() reads them.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.lock = threading.Lock()
+        self.paths: OrderedDict[tuple[str, int], str] = OrderedDict()
+        # last image_changes seq read, None until the first poll()
+        self.seq: int | None = None
+        self.polled_at = 0.0
+        # bumped by every drop, so a path loaded across one isn't cached
+        self.drops = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self, kind: str, id: int):
+        column, default = KINDS[kind]
+        with SessionManager() as session:
+            row = session.execute(
+                select(column).where(column.class_.id == id)
+            ).one_or_none()
+        if row is None:
+            return None
+        # nikos from before the blob store have their image at niko-{id}.png
+        name = row[0] or (f"niko-{id}.png" if kind == "nikos" else None)
+        if name:
+            path = os.path.join(IMAGE_DIR, name)
+            if os.path.exists(path):
+                return path
+        return default
+
+    def get(self, kind: str, id: int):
+        """(path, stat) of the image, None if there's no such row."""
+        if self.seq is None:
+            self.poll()
+        key = (kind, id)
+        with self.lock:
+            drops = self.drops
+            path = self.paths.get(key)
+            if path is not None:
+                self.paths.move_to_end(key)
+                self.hits += 1
+        if path is not None:
+            try:
+                return path, os.stat(path)
+            except FileNotFoundError:
+                # a legacy file deleted by a write this worker hasn't seen yet
+                pass
+
+        path = self._load(kind, id)
+        if path is None:
+            return None
+        with self.lock:
+            self.misses += 1
+            # dropped while we read it, what we got may be the old one
+            if self.drops == drops:
+                self.paths[key] = path
+                self.paths.move_to_end(key)
+                while len(self.paths) > self.size:
+                    self.paths.popitem(last=False)
+        return path, os.stat(path)
+
+    def forget(self, keys):
+        with self.lock:
+            self.drops += 1
+            for key in keys:
+                self.paths.pop(key, None)
+
+    def poll(self):
+        """Drop the ids image_changes logged since the last poll."""
+        with SessionManager() as session:
+            if self.seq is None:
+                rows = []
+                seq = session.scalar(
+                    select(Counter.value).where(
+                        Counter.name == VERSION_PREFIX + "images"
+                    )
+                )
+            else:
+                rows = session.execute(
+                    select(ImageChange.seq, ImageChange.kind, ImageChange.entity_id)
+                    .where(ImageChange.seq > self.seq)
+                    .order_by(ImageChange.seq)
+                ).all()
+                seq = rows[-1].seq if rows else self.seq
+        now = time.monotonic()
+        with self.lock:
+            if now - self.polled_at > IMAGE_CHANGES_RETENTION / 2:
+                # some may have been compacted away since we last read them
+                self.paths.clear()
+                self.drops += 1
+            if rows:
+                self.drops += 1
+            for _, kind, id in rows:
+                self.paths.pop((kind, id), None)
+            self.seq = max(self.seq or 0, seq or 0)
+            self.polled_at = now
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.paths),
+                "limit": self.size,
+                "seq": self.seq,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+image_paths = ImagePaths(IMAGE_PATH_CACHE_SIZE)
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_changed_images(session: Session):
+    # this worker serves its own writes right away
+    changes = session.info.pop("image_changes", None)
+    if changes:
+        image_paths.forget(changes)
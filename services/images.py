@@ -1,19 +1,47 @@
-import io
+import glob
 import os
 
 from fastapi import UploadFile
-from fastapi.responses import FileResponse
-from PIL import Image, ImageFile
+from PIL import ImageFile, features
 from sqlalchemy import (
     select,
 )
+from sqlalchemy.orm import Session
 
+from common.dto import ImageFormat
 from common.models import Niko
-from services._shared import SessionManager
+from services._shared import SessionManager, run_db
+from services.blobs import (
+    IMAGE_DIR,
+    VARIANT_DIR,
+    add_blob,
+    blob_name,
+    drop_blob,
+    record_image_change,
+)
+from services.image_paths import DEFAULT_IMAGE, image_paths
+from services.imaging import (
+    ImageDecodeError,
+    image_pool,
+    normalize_png,
+    save_resized,
+)
 
-IMAGE_DIR = os.environ["IMG_DIR"]
 MAX_IMG_SIZE = 2 * 1024 * 1024  # 2MB
-os.makedirs(IMAGE_DIR, exist_ok=True)
+# widths a variant can have; a requested width is rounded up to one of these
+IMAGE_WIDTHS = sorted(
+    int(width) for width in os.environ.get("IMAGE_WIDTHS", "64,128,256,512").split(",")
+)
+# format -> (media type, save options), best first for Accept negotiation
+IMAGE_FORMATS = {
+    ImageFormat.avif: ("image/avif", {"quality": 60}),
+    ImageFormat.webp: ("image/webp", {"quality": 80, "method": 4}),
+    ImageFormat.png: ("image/png", {"optimize": True}),
+}
+for format in (ImageFormat.avif, ImageFormat.webp):
+    if not features.check(format.value):
+        # this Pillow build can't write it
+        del IMAGE_FORMATS[format]
 
 
 class ImageError(Exception):
@@ -27,80 +55,185 @@ def image_check(file: UploadFile):
         raise ImageError("Image size exceeds limit")
 
 
-async def upload_image(id: int, file: UploadFile):
-    with SessionManager() as session:
-        entity = session.execute(select(Niko).where(Niko.id == id)).scalar_one_or_none()
-        image_check(file)
-        if entity is None:
-            raise ImageError("Image not found")
+def niko_exists(id: int, db: Session | None = None):
+    with SessionManager(db) as session:
+        entity = session.execute(select(Niko.id).where(Niko.id == id)).one_or_none()
+        return entity is not None
 
-        data = await file.read()
-        try:
-            image = Image.open(io.BytesIO(data))
-        except Exception:
-            raise ImageError("Invalid image format")
 
-        image = image.convert("RGBA")
-        path = os.path.join(IMAGE_DIR, f"niko-{id}.png")
-        image.save(path, format="PNG")
+def replace_niko_image(session: Session, id: int, png: bytes | None):
+    """Point a niko at the blob of `png`, or back at the default image, in the
+    caller's transaction. Call delete_variants(id) once it's committed."""
+    entity = session.get(Niko, id, with_for_update=True)
+    if entity is None:
+        raise ImageError("Image not found")
 
-        await file.close()
+    # nikos from before the blob store have their image at niko-{id}.png
+    old = entity.image or f"niko-{id}.png"
+    entity.image = add_blob(session, png) if png is not None else None
+    drop_blob(session, old)
+    record_image_change(session, Niko.image, id)
+
+
+def set_niko_image(id: int, png: bytes | None, db: Session | None = None):
+    with SessionManager(db) as session:
+        replace_niko_image(session, id, png)
         session.commit()
+    delete_variants(id)
+    return True
 
-        return True
 
+async def upload_image(id: int, file: UploadFile, db: Session | None = None):
+    exists = await run_db(niko_exists, id, db=db)
+    image_check(file)
+    if not exists:
+        raise ImageError("Image not found")
 
-async def edit_image(id: int, file: UploadFile):
-    with SessionManager() as session:
-        entity = session.execute(select(Niko).where(Niko.id == id)).scalar_one_or_none()
-        if entity is None:
-            raise ImageError("Image not found")
-        image_check(file)
+    data = await file.read()
+    try:
+        png = await image_pool.run_async(normalize_png, data)
+    except ImageDecodeError:
+        raise ImageError("Invalid image format")
+    await run_db(set_niko_image, id, png, db=db)
 
-        file_path = os.path.join(IMAGE_DIR, f"niko-{id}.png")
+    await file.close()
 
-        try:
-            os.remove(file_path)
-        except FileNotFoundError:
-            pass
+    return True
 
-        data = await file.read()
-        try:
-            image = Image.open(io.BytesIO(data))
-        except Exception:
-            raise ImageError("Invalid image format")
 
-        image = image.convert("RGBA")
-        image.save(file_path, format="PNG")
+async def edit_image(id: int, file: UploadFile, db: Session | None = None):
+    if not await run_db(niko_exists, id, db=db):
+        raise ImageError("Image not found")
+    image_check(file)
 
-        await file.close()
-        session.commit()
+    data = await file.read()
+    try:
+        png = await image_pool.run_async(normalize_png, data)
+    except ImageDecodeError:
+        raise ImageError("Invalid image format")
+    await run_db(set_niko_image, id, png, db=db)
+
+    await file.close()
 
-        return True
+    return True
 
 
-def delete_image(id: int):
-    with SessionManager() as session:
-        entity = session.execute(select(Niko).where(Niko.id == id)).scalar_one_or_none()
-        if entity is None:
-            raise ImageError("Image not found")
+def delete_image(id: int, db: Session | None = None):
+    return set_niko_image(id, None, db=db)
 
+
+def delete_variants(id: int):
+    # variants of blobs never go stale, only those of niko-{id}.png do
+    for path in glob.glob(os.path.join(VARIANT_DIR, f"niko-{id}-*")):
         try:
-            os.remove(os.path.join(IMAGE_DIR, f"niko-{id}.png"))
+            os.remove(path)
         except FileNotFoundError:
             pass
 
-        session.commit()
-        return True
-
-
-def get_image(id: int):
-    with SessionManager() as session:
-        entity = session.execute(select(Niko).where(Niko.id == id)).scalar_one_or_none()
-        if entity is None:
-            raise ImageError("Image not found")
 
-        path = os.path.join(IMAGE_DIR, f"niko-{id}.png")
-        if not os.path.exists(path):
-            path = os.path.join("images/default.png")
-        return FileResponse(path, media_type="image/png")
+def accept_qualities(accept: str):
+    """Media type -> q of each entry of an Accept header."""
+    qualities = {}
+    for part in accept.split(","):
+        media_type, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[media_type.strip().lower()] = q
+    return qualities
+
+
+def pick_format(format: ImageFormat | None, accept: str):
+    """The asked format, else the one the Accept header rates highest (the
+    best on a tie), else png. Only formats it names count: image/* and */*
+    don't promise a client can decode avif."""
+    if format is not None:
+        if format not in IMAGE_FORMATS:
+            raise ImageError(f"{format.value} isn't supported by this server")
+        return format
+    qualities = accept_qualities(accept)
+    picked, picked_q = ImageFormat.png, 0.0
+    for candidate, (media_type, _) in IMAGE_FORMATS.items():
+        q = qualities.get(media_type, 0.0)
+        if q > picked_q:
+            picked, picked_q = candidate, q
+    return picked
+
+
+def pick_width(width: int | None):
+    """Round up to a configured width; None (the original size) above them."""
+    if width is None or width < 1:
+        return None
+    for candidate in IMAGE_WIDTHS:
+        if width <= candidate:
+            return candidate
+    return None
+
+
+def image_variant(name: str, source: str, width: int | None, format: ImageFormat):
+    """Path of `source` at `width` in `format`, made now if missing or older
+    than the source."""
+    if width is None and format == ImageFormat.png:
+        return source
+    path = os.path.join(VARIANT_DIR, f"{name}-w{width or 0}.{format.value}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        fresh = os.stat(path).st_mtime_ns >= os.stat(source).st_mtime_ns
+    except FileNotFoundError:
+        fresh = False
+    if not fresh:
+        image_pool.run(
+            save_resized,
+            source,
+            path,
+            width,
+            format.value.upper(),
+            IMAGE_FORMATS[format][1],
+        )
+    return path
+
+
+def get_image(
+    id: int,
+    width: int | None = None,
+    format: ImageFormat | None = None,
+    accept: str = "",
+):
+    """(path, media type, stat) of a niko's image at `width` in `format`.
+    Needs no query while the niko's image path is cached."""
+    found = image_paths.get("nikos", id)
+    if found is None:
+        raise ImageError("Image not found")
+    source, stat = found
+
+    if source == DEFAULT_IMAGE:
+        name = "default"
+    else:
+        name = os.path.relpath(source, IMAGE_DIR).removesuffix(".png")
+    picked = pick_format(format, accept)
+    path = image_variant(name, source, pick_width(width), picked)
+    if path != source:
+        stat = os.stat(path)
+    return path, IMAGE_FORMATS[picked][0], stat
+
+
+def get_blob(
+    key: str,
+    width: int | None = None,
+    format: ImageFormat | None = None,
+    accept: str = "",
+):
+    """(path, media type) of a blob at `width` in `format`. The path is
+    derived from the key, no query at all."""
+    name = blob_name(key)
+    source = os.path.join(IMAGE_DIR, name)
+    if not os.path.exists(source):
+        raise ImageError("Image not found")
+    picked = pick_format(format, accept)
+    path = image_variant(name.removesuffix(".png"), source, pick_width(width), picked)
+    return path, IMAGE_FORMATS[picked][0]
@@ -0,0 +1,229 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from services._shared import env_int
+
+# processes decoding/encoding images, shared by every upload and variant
+IMAGE_WORKERS = env_int("IMAGE_WORKERS", min(os.cpu_count() or 1, 4))
+# jobs running or queued at once; past that callers wait IMAGE_QUEUE_TIMEOUT
+# seconds for a slot, then get ImagePoolBusy (a 503)
+IMAGE_QUEUE_LIMIT = env_int("IMAGE_QUEUE_LIMIT", IMAGE_WORKERS * 4)
+IMAGE_QUEUE_TIMEOUT = env_int("IMAGE_QUEUE_TIMEOUT", 10)
+
+
+class ImageDecodeError(Exception):
+    """The bytes aren't an image Pillow can read."""
+
+
+class ImagePoolBusy(Exception):
+    pass
+
+
+# the jobs. They run in another process: plain arguments, no sessions
+
+
+def normalize_png(data: bytes):
+    """Decode any image and re-encode it as an RGBA PNG, the bytes the blob
+    store hashes: the same picture uploaded twice gives the same bytes."""
+    try:
+        image = Image.open(io.BytesIO(data)).convert("RGBA")
+    except Exception as e:
+        raise ImageDecodeError(str(e))
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    return out.getvalue()
+
+
+def save_resized(source: str, path: str, width: int | None, format: str, options):
+    """Store `source` scaled down to `width` (kept if None) in `format`."""
+    image = Image.open(source)
+    if width is not None and image.width > width:
+        height = max(round(image.height * width / image.width), 1)
+        image = image.resize((width, height), Image.Resampling.LANCZOS)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    image.save(tmp, format=format, **options)
+    os.replace(tmp, path)
+
+
+class Slots:
+    """A counting semaphore both threads and coroutines can wait on, first
+    come first served. A released slot goes straight to the next waiter."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.lock = threading.Lock()
+        # threading.Event for threads, (loop, future) for coroutines
+        self.waiters: deque = deque()
+
+    def _take(self, waiter):
+        with self.lock:
+            if self.used < self.limit and not self.waiters:
+                self.used += 1
+                return True
+            self.waiters.append(waiter)
+            return False
+
+    def _withdraw(self, waiter):
+        """False when a slot was handed over just before we gave up."""
+        with self.lock:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+                return True
+            return False
+
+    def acquire(self, timeout: float):
+        waiter = threading.Event()
+        if self._take(waiter) or waiter.wait(timeout):
+            return True
+        if self._withdraw(waiter):
+            return False
+        return True
+
+    async def acquire_async(self, timeout: float):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        if self._take(waiter):
+            return True
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            if self._withdraw(waiter):
+                return False
+            return True
+        except asyncio.CancelledError:
+            if not self._withdraw(waiter):
+                # handed a slot while being cancelled: pass it on
+                self.release()
+            raise
+
+    def release(self):
+        with self.lock:
+            if not self.waiters:
+                self.used -= 1
+                return
+            waiter = self.waiters.popleft()
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+        else:
+            loop, future = waiter
+            loop.call_soon_threadsafe(_grant, future)
+
+
+def _grant(future: asyncio.Future):
+    if not future.done():
+        future.set_result(True)
+
+
+class ImagePool:
+    """A process pool with a cap on jobs in flight, timing each kind of job."""
+
+    def __init__(self, workers: int, limit: int, timeout: int):
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = Slots(limit)
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.executor: ProcessPoolExecutor | None = None
+        self.in_flight = 0
+        self.rejected = 0
+        self.jobs: dict[str, dict] = {}
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                # spawn: forking a process that runs threads can deadlock
+                self.executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self.executor
+
+    def _acquired(self, acquired: bool):
+        with self.lock:
+            if not acquired:
+                self.rejected += 1
+                raise ImagePoolBusy("Too many images being processed, retry later.")
+            self.in_flight += 1
+
+    def _done(self, job, waited: float, took: float, failed: bool):
+        self.slots.release()
+        with self.lock:
+            self.in_flight -= 1
+            stats = self.jobs.setdefault(
+                job.__name__,
+                {
+                    "count": 0,
+                    "errors": 0,
+                    "wait_ms": 0.0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                },
+            )
+            stats["count"] += 1
+            stats["errors"] += failed
+            stats["wait_ms"] += waited * 1000
+            stats["total_ms"] += took * 1000
+            stats["max_ms"] = max(stats["max_ms"], took * 1000)
+
+    def run(self, job, *args):
+        """Run `job(*args)` in the pool from a worker thread."""
+        start = time.perf_counter()
+        self._acquired(self.slots.acquire(self.timeout))
+        waited = time.perf_counter() - start
+        failed = True
+        try:
+            result = self._executor().submit(job, *args).result()
+            failed = False
+            return result
+        finally:
+            self._done(job, waited, time.perf_counter() - start - waited, failed)
+
+    async def run_async(self, job, *args):
+        """Run `job(*args)` in the pool without blocking the event loop."""
+        start = time.perf_counter()
+        # waiting costs no thread, and a cancelled wait gives its slot back
+        self._acquired(await self.slots.acquire_async(self.timeout))
+        waited = time.perf_counter() - start
+        failed = True
+        try:
+            result = await asyncio.wrap_future(self._executor().submit(job, *args))
+            failed = False
+            return result
+        finally:
+            self._done(job, waited, time.perf_counter() - start - waited, failed)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "rejected": self.rejected,
+                "jobs": {
+                    name: {
+                        **stats,
+                        "wait_avg_ms": stats["wait_ms"] / stats["count"],
+                        "avg_ms": stats["total_ms"] / stats["count"],
+                    }
+                    for name, stats in self.jobs.items()
+                },
+            }
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+                self.executor = None
+
+
+image_pool = ImagePool(IMAGE_WORKERS, IMAGE_QUEUE_LIMIT, IMAGE_QUEUE_TIMEOUT)
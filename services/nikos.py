@@ -1,169 +1,522 @@
+import asyncio
+import base64
+import json
+import random
+import threading
 from datetime import datetime, timedelta
 
 from sqlalchemy import (
-    asc,
+    and_,
     delete,
-    desc,
-    exists,
     func,
+    or_,
     select,
 )
 from sqlalchemy.dialects.mysql import insert
-from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+from starlette.concurrency import run_in_threadpool
 
 from common.dto import (
+    ChangeEntity,
     NikoRequest,
+    NikoResponse,
+    NikoSummaryResponse,
     SortType,
 )
 from common.helper2 import account_of_type
-from common.models import AccountType, Niko, Notd, User
-from services._shared import SessionManager
-from services.images import delete_image
+from common.models import Ability, AccountType, Niko, NotdRotation, NotdState, User
+from services._shared import (
+    EXPORT_BATCH_SIZE,
+    AsyncSessionManager,
+    SessionManager,
+    async_variant,
+    env_flag,
+    read_session,
+)
+from services.catalog import NIKO_SORT_KEYS, catalog, niko_order_by
+from services.changes import record_change, record_niko_deleted
+from services.images import delete_variants, replace_niko_image
+from services.snapshot import nikos_snapshot
+from services.versions import bump_version
 
+# read niko pages with one JSON-aggregating query instead of three ORM ones
+NIKO_JSON_READS = env_flag("NIKO_JSON_READS")
 
-def get_nikos_wrapper(sort_by: SortType):
-    stmt = select(Niko).options(selectinload(Niko.abilities), selectinload(Niko.user))
 
-    if sort_by == SortType.name_ascending:
-        stmt = stmt.order_by(asc(Niko.name))
-    elif sort_by == SortType.name_descending:
-        stmt = stmt.order_by(desc(Niko.name))
-    elif sort_by == SortType.recently_added:
-        stmt = stmt.order_by(desc(Niko.id))
+def where_author(stmt, author: str | None):
+    return stmt if author is None else stmt.where(Niko.author_display == author)
+
 
-    return stmt
+def get_author_display(session: Session, author_id: int | None, author: str):
+    """Value for Niko.author_display (None if the author id doesn't exist)."""
+    if author_id is None:
+        return author
+    return session.scalar(select(User.username).where(User.id == author_id))
 
 
-def get_all(sort_by: SortType):
-    with SessionManager() as session:
-        stmt = get_nikos_wrapper(sort_by)
+def get_nikos_wrapper(sort_by: SortType):
+    stmt = select(Niko).options(selectinload(Niko.abilities), selectinload(Niko.user))
+    return stmt.order_by(*niko_order_by(sort_by))
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_niko_cursor(sort_by: SortType, niko: Niko):
+    column, _ = NIKO_SORT_KEYS[sort_by]
+    payload = [sort_by.value, getattr(niko, column.key), niko.id]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_niko_cursor(sort_by: SortType, cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, key, last_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Malformed cursor")
+    if sort_value != sort_by.value or not isinstance(last_id, int):
+        raise InvalidCursor("Cursor does not match sort_by")
+    return key, last_id
+
+
+def get_nikos_keyset_stmt(
+    count: int, sort_by: SortType, cursor: str | None, author: str | None = None
+):
+    # fetch one extra row to know whether there's a next page
+    stmt = where_author(get_nikos_wrapper(sort_by), author).limit(count + 1)
+    if cursor is None:
+        return stmt
+
+    column, descending = NIKO_SORT_KEYS[sort_by]
+    key, last_id = decode_niko_cursor(sort_by, cursor)
+    if column is Niko.id:
+        return stmt.where(Niko.id < last_id if descending else Niko.id > last_id)
+    if descending:
+        after = or_(column < key, and_(column == key, Niko.id < last_id))
+    else:
+        after = or_(column > key, and_(column == key, Niko.id > last_id))
+    return stmt.where(after)
+
+
+def keyset_page(rows, count: int, sort_by: SortType):
+    items = rows[:count]
+    next_cursor = None
+    if len(rows) > count:
+        next_cursor = encode_niko_cursor(sort_by, items[-1])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def get_nikos_page_stmt(page: int, count: int, sort_by: SortType, author: str | None):
+    return (
+        where_author(get_nikos_wrapper(sort_by), author)
+        .offset(int(count) * (int(page) - 1))
+        .limit(int(count))
+    )
+
+
+def get_nikos_page_orm(
+    page: int,
+    count: int,
+    sort_by: SortType,
+    author: str | None = None,
+    db: Session | None = None,
+):
+    """get_nikos_page through the ORM, whatever NIKO_JSON_READS says."""
+    with SessionManager(db) as session:
+        if int(page) < 1:
+            return None
+        stmt = get_nikos_page_stmt(page, count, sort_by, author)
         return session.scalars(stmt).fetchall()
 
 
-def get_nikos_page(page: int, count: int, sort_by: SortType):
-    with SessionManager() as session:
+def get_nikos_page(
+    page: int,
+    count: int,
+    sort_by: SortType,
+    author: str | None = None,
+    db: Session | None = None,
+):
+    if NIKO_JSON_READS:
+        return get_nikos_json_page(page, count, sort_by, author, db=db)
+    return get_nikos_page_orm(page, count, sort_by, author, db=db)
+
+
+@async_variant(get_nikos_page)
+async def get_nikos_page_async(
+    page: int,
+    count: int,
+    sort_by: SortType,
+    author: str | None = None,
+    db: AsyncSession | None = None,
+):
+    if NIKO_JSON_READS:
+        return await get_nikos_json_page_async(page, count, sort_by, author, db=db)
+    async with AsyncSessionManager(db) as session:
+        if int(page) < 1:
+            return None
+        stmt = get_nikos_page_stmt(page, count, sort_by, author)
+        return (await session.scalars(stmt)).fetchall()
+
+
+def get_nikos_summary_stmt(sort_by: SortType):
+    # columns only: no abilities query and no ORM objects to build
+    return select(
+        Niko.id,
+        Niko.name,
+        Niko.description,
+        Niko.is_blacklisted,
+        Niko.author_id,
+        Niko.author_display,
+    ).order_by(*niko_order_by(sort_by))
+
+
+def niko_summary_from_row(row):
+    return NikoSummaryResponse(
+        id=row.id,
+        name=row.name,
+        description=row.description,
+        is_blacklisted=row.is_blacklisted,
+        author_id=row.author_id,
+        author_name=row.author_display,
+    )
+
+
+def get_nikos_summary_page(
+    page: int,
+    count: int,
+    sort_by: SortType,
+    author: str | None = None,
+    db: Session | None = None,
+):
+    with SessionManager(db) as session:
         if int(page) < 1:
             return None
         stmt = (
-            get_nikos_wrapper(sort_by)
+            where_author(get_nikos_summary_stmt(sort_by), author)
             .offset(int(count) * (int(page) - 1))
             .limit(int(count))
         )
-        return session.scalars(stmt).fetchall()
-
-
-def get_random_niko():
-    with SessionManager() as session:
-        st_random = select(Niko.id).order_by(func.random()).limit(1).subquery()
+        return [niko_summary_from_row(row) for row in session.execute(stmt)]
+
+
+@async_variant(get_nikos_summary_page)
+async def get_nikos_summary_page_async(
+    page: int,
+    count: int,
+    sort_by: SortType,
+    author: str | None = None,
+    db: AsyncSession | None = None,
+):
+    async with AsyncSessionManager(db) as session:
+        if int(page) < 1:
+            return None
         stmt = (
-            select(Niko)
-            .options(selectinload(Niko.abilities), selectinload(Niko.user))
-            .join(st_random, Niko.id == st_random.c.id)
+            where_author(get_nikos_summary_stmt(sort_by), author)
+            .offset(int(count) * (int(page) - 1))
+            .limit(int(count))
+        )
+        return [niko_summary_from_row(row) for row in await session.execute(stmt)]
+
+
+def get_nikos_json_stmt(sort_by: SortType):
+    """Nikos with their abilities as one Core query.
+
+    Each row carries its abilities as a JSON array built by a correlated
+    subquery (using the abilities.niko_id foreign key index), so a page is a
+    single round trip and rows map straight to NikoResponse dicts.
+    """
+    abilities = (
+        select(
+            func.json_arrayagg(
+                func.json_object(
+                    "id", Ability.id, "name", Ability.name, "niko_id", Ability.niko_id
+                )
+            )
         )
-        return session.scalars(stmt).one()
+        .where(Ability.niko_id == Niko.id)
+        .scalar_subquery()
+    )
+    return select(
+        Niko.id,
+        Niko.name,
+        Niko.description,
+        Niko.full_desc,
+        Niko.is_blacklisted,
+        Niko.author_id,
+        Niko.author_display,
+        abilities.label("abilities"),
+    ).order_by(*niko_order_by(sort_by))
+
+
+def niko_from_json_row(row):
+    summary = niko_summary_from_row(row)
+    abilities = row.abilities
+    if isinstance(abilities, (str, bytes)):
+        abilities = json.loads(abilities)
+    return {
+        **summary.model_dump(),
+        "full_desc": row.full_desc,
+        "abilities": abilities or [],
+        # author_display is the author's username whenever author_id is set
+        "user": (
+            None
+            if row.author_id is None
+            else {"id": row.author_id, "username": row.author_display}
+        ),
+    }
+
+
+def get_nikos_json_page(
+    page: int,
+    count: int,
+    sort_by: SortType,
+    author: str | None = None,
+    db: Session | None = None,
+):
+    with SessionManager(db) as session:
+        if int(page) < 1:
+            return None
+        stmt = (
+            where_author(get_nikos_json_stmt(sort_by), author)
+            .offset(int(count) * (int(page) - 1))
+            .limit(int(count))
+        )
+        return [niko_from_json_row(row) for row in session.execute(stmt)]
+
+
+@async_variant(get_nikos_json_page)
+async def get_nikos_json_page_async(
+    page: int,
+    count: int,
+    sort_by: SortType,
+    author: str | None = None,
+    db: AsyncSession | None = None,
+):
+    async with AsyncSessionManager(db) as session:
+        if int(page) < 1:
+            return None
+        stmt = (
+            where_author(get_nikos_json_stmt(sort_by), author)
+            .offset(int(count) * (int(page) - 1))
+            .limit(int(count))
+        )
+        return [niko_from_json_row(row) for row in await session.execute(stmt)]
+
+
+def get_nikos_keyset_page(
+    count: int,
+    sort_by: SortType,
+    cursor: str | None,
+    author: str | None = None,
+    db: Session | None = None,
+):
+    with SessionManager(db) as session:
+        stmt = get_nikos_keyset_stmt(count, sort_by, cursor, author)
+        return keyset_page(session.scalars(stmt).fetchall(), count, sort_by)
+
+
+@async_variant(get_nikos_keyset_page)
+async def get_nikos_keyset_page_async(
+    count: int,
+    sort_by: SortType,
+    cursor: str | None,
+    author: str | None = None,
+    db: AsyncSession | None = None,
+):
+    async with AsyncSessionManager(db) as session:
+        stmt = get_nikos_keyset_stmt(count, sort_by, cursor, author)
+        return keyset_page((await session.scalars(stmt)).fetchall(), count, sort_by)
+
+
+def stream_nikos(sort_by: SortType):
+    """Every niko as NikoResponse, one list per EXPORT_BATCH_SIZE rows.
+
+    Walks the table with the keyset cursor instead of a server-side cursor:
+    mysql-connector buffers whole results, and selectinload couldn't query
+    while an unbuffered result is still open anyway. Only one batch is ever
+    in memory, and the session's snapshot keeps the export consistent.
+    """
+    with read_session() as session:
+        cursor = None
+        while True:
+            page = get_nikos_keyset_page(EXPORT_BATCH_SIZE, sort_by, cursor, db=session)
+            yield [
+                NikoResponse.model_validate(niko, from_attributes=True)
+                for niko in page["items"]
+            ]
+            session.expunge_all()
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return
+
+
+class NotdCache:
+    """The current NoTD id and refresh time, kept until the refresh is due."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # for get_notd_async, which runs on the event loop
+        self.async_lock = asyncio.Lock()
+        self.niko_id: int | None = None
+        self.refresh_ts: datetime | None = None
+
+    def current(self):
+        if self.refresh_ts is None or datetime.now() >= self.refresh_ts:
+            return None
+        niko = catalog.get(self.niko_id)
+        if niko is None:
+            return None
+        return niko, self.refresh_ts
 
 
-def get_notd():
-    with SessionManager() as session:
-        cnt_stmt = select(func.count()).select_from(Niko)
-        cnt = session.scalar(cnt_stmt)
-        if cnt is None or cnt <= 0:
-            return None
+notd_cache = NotdCache()
 
-        now_ts = datetime.now()
-        latest_chosen_notd_stmt = select(Notd).order_by(desc(Notd.chosen_at)).limit(1)
-        latest_chosen_notd = session.scalars(latest_chosen_notd_stmt).all()
-        if len(latest_chosen_notd) > 0:
-            latest_chosen_ts = latest_chosen_notd[0].chosen_at
-            refresh_ts = datetime(
-                latest_chosen_ts.year, latest_chosen_ts.month, latest_chosen_ts.day
-            ) + timedelta(days=1)
-
-            # not time to refresh yet
-            if now_ts < refresh_ts:
-                return (get_niko_by_id(id=latest_chosen_notd[0].niko_id), refresh_ts)
-
-        # either db is empty, or it's time to refresh
-        new_notd: Niko | None = None
-        while True:  #! quite dangerous...
-            new_notd_stmt = (
-                select(Niko)
-                .where(~exists().where(Notd.niko_id == Niko.id))
-                .order_by(func.random())
-                .limit(1)
-            )
-            new_notd_list = session.scalars(new_notd_stmt).all()
-            if len(new_notd_list) <= 0:
-                wipe_notd_stmt = delete(Notd).where(Notd.niko_id > -1)
-                session.execute(wipe_notd_stmt)
-                session.commit()
-            else:
-                new_notd = new_notd_list[0]
-                break
 
-        new_notd_insert_stmt = insert(Notd).values(niko_id=new_notd.id)
-        session.execute(new_notd_insert_stmt)
+def next_notd_refresh(now_ts: datetime):
+    return datetime(now_ts.year, now_ts.month, now_ts.day) + timedelta(days=1)
+
+
+def shuffle_notd_rotation(session: Session, last_id: int | None):
+    ids = list(session.scalars(select(Niko.id)))
+    random.shuffle(ids)
+    # don't start the new pass with the niko that ended the last one
+    if len(ids) > 1 and ids[0] == last_id:
+        ids[0], ids[-1] = ids[-1], ids[0]
+    session.execute(delete(NotdRotation))
+    if ids:
+        session.execute(
+            insert(NotdRotation),
+            [{"position": pos, "niko_id": id} for pos, id in enumerate(ids)],
+        )
+    return NotdRotation(position=0, niko_id=ids[0]) if ids else None
+
+
+def advance_notd(session: Session):
+    """Move the NoTD to the next rotation entry if its day is over.
+
+    The notd_state row is locked for the whole step, so when several workers
+    get here at midnight only the first one advances and the rest read its
+    pick. Nikos added mid-rotation join at the next reshuffle.
+    """
+    now_ts = datetime.now()
+    state = session.scalars(
+        select(NotdState).where(NotdState.id == 1).with_for_update()
+    ).one_or_none()
+    if state is None:
+        state = NotdState(id=1, position=-1, refresh_at=now_ts)
+        session.add(state)
+        session.flush()
+
+    if now_ts < state.refresh_at and state.niko_id is not None:
         session.commit()
+        return state.niko_id, state.refresh_at
+
+    entry = session.scalars(
+        select(NotdRotation)
+        .where(NotdRotation.position > state.position)
+        .order_by(NotdRotation.position)
+        .limit(1)
+    ).one_or_none()
+    if entry is None:
+        entry = shuffle_notd_rotation(session, state.niko_id)
+        if entry is None:
+            session.commit()
+            return None
 
-        refresh_ts = datetime(now_ts.year, now_ts.month, now_ts.day) + timedelta(days=1)
-        return (get_niko_by_id(id=new_notd.id), refresh_ts)
+    state.position = entry.position
+    state.niko_id = entry.niko_id
+    state.refresh_at = next_notd_refresh(now_ts)
+    session.commit()
+    return state.niko_id, state.refresh_at
 
 
-def get_by_name(name: str):
-    with SessionManager() as session:
-        stmt = (
-            select(Niko)
-            .options(selectinload(Niko.abilities), selectinload(Niko.user))
-            .where(Niko.name.like("%" + name + "%"))
-        )
-        return session.scalars(stmt).fetchall()
+def get_notd(db: Session | None = None):
+    if current := notd_cache.current():
+        return current
 
+    with notd_cache.lock:
+        # another thread may have advanced while we waited
+        if current := notd_cache.current():
+            return current
 
-def get_niko_by_id(id: int):
-    with SessionManager() as session:
-        stmt = (
-            select(Niko)
-            .options(selectinload(Niko.abilities), selectinload(Niko.user))
-            .where(Niko.id == id)
-        )
-        res = session.scalars(stmt).one_or_none()
-        return res
+        with SessionManager(db) as session:
+            advanced = advance_notd(session)
+        return set_notd(advanced)
 
 
-def get_niko_by_userid(user_id: int):
-    with SessionManager() as session:
-        stmt = (
-            select(Niko)
-            .options(selectinload(Niko.abilities), selectinload(Niko.user))
-            .where(Niko.author_id == user_id)
+def set_notd(advanced: tuple[int, datetime] | None):
+    if advanced is None:
+        return None
+
+    notd_cache.niko_id, notd_cache.refresh_ts = advanced
+    niko = catalog.get(notd_cache.niko_id)
+    if niko is None:
+        # picked a niko this worker's catalog hasn't seen yet
+        catalog.invalidate()
+        niko = catalog.get(notd_cache.niko_id)
+    return (niko, notd_cache.refresh_ts) if niko is not None else None
+
+
+@async_variant(get_notd)
+async def get_notd_async(db: AsyncSession | None = None):
+    # the catalog loads with blocking queries under threading locks, which
+    # must never be taken on the event loop: it goes through the threadpool
+    if current := await run_in_threadpool(notd_cache.current):
+        return current
+
+    async with notd_cache.async_lock:
+        if current := await run_in_threadpool(notd_cache.current):
+            return current
+
+        async with AsyncSessionManager(db) as session:
+            advanced = await session.run_sync(advance_notd)
+        return await run_in_threadpool(set_notd, advanced)
+
+
+def get_latest_niko_id_of_user(user_id: int, db: Session | None = None):
+    with SessionManager(db) as session:
+        return session.scalar(
+            select(func.max(Niko.id)).where(Niko.author_id == user_id)
         )
-        return session.scalars(stmt).fetchall()
 
 
-def get_nikos_count():
-    with SessionManager() as session:
-        return session.query(func.count(Niko.id)).one()[0]
+@async_variant(get_latest_niko_id_of_user)
+async def get_latest_niko_id_of_user_async(
+    user_id: int, db: AsyncSession | None = None
+):
+    async with AsyncSessionManager(db) as session:
+        return await session.scalar(
+            select(func.max(Niko.id)).where(Niko.author_id == user_id)
+        )
 
 
-def insert_niko(req: NikoRequest):
-    with SessionManager() as session:
+def insert_niko(req: NikoRequest, db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = insert(Niko).values(
             name=req.name,
             description=req.description,
             doc="",
             author="",
+            author_display=get_author_display(session, req.author_id, "") or "",
             full_desc=req.full_desc,
             author_id=req.author_id,
             is_blacklisted=req.is_blacklisted,
         )
 
-        session.execute(stmt)
+        result = session.execute(stmt)
+        bump_version(session, "nikos")
+        record_change(session, ChangeEntity.niko, result.inserted_primary_key[0])
         session.commit()
+        catalog.invalidate()
+        nikos_snapshot.schedule()
         return {"msg": "Inserted Niko."}
 
 
-def update_niko(id: int, req: NikoRequest, user_id: int):
-    with SessionManager() as session:
+def update_niko(id: int, req: NikoRequest, user_id: int, db: Session | None = None):
+    with SessionManager(db) as session:
         user_entity = session.execute(
             select(User).where(User.id == user_id)
         ).scalar_one_or_none()
@@ -200,19 +553,25 @@ def update_niko(id: int, req: NikoRequest, user_id: int):
                     return {"msg": "Specified author ID does not exist.", "err": True}
                 entity.author_id = req.author_id
                 entity.author = ""
+                entity.author_display = specified_author.username
             elif entity.author_id is not None:
                 entity.author_id = None
                 entity.author = req.author_name or ""
+                entity.author_display = entity.author
             else:
                 return {"msg": "Author ID or name must be specified.", "err": True}
+            bump_version(session, "nikos")
+            record_change(session, ChangeEntity.niko, id)
             session.commit()
+            catalog.invalidate()
+            nikos_snapshot.schedule()
             return {"msg": "Updated Niko.", "err": False}
         else:
             return {"msg": "Unauthorized", "err": True}
 
 
-def delete_niko(user_id: int, id: int, override: bool):
-    with SessionManager() as session:
+def delete_niko(user_id: int, id: int, override: bool, db: Session | None = None):
+    with SessionManager(db) as session:
         if not override:
             entity = session.execute(
                 select(Niko)
@@ -225,15 +584,13 @@ def delete_niko(user_id: int, id: int, override: bool):
         if entity is None:
             return None
 
-        # Check if it exists in the Notd.
-        if notd_result := session.execute(
-            select(Notd).where(Notd.niko_id == id)
-        ).scalar_one_or_none():
-            session.delete(notd_result)
-        session.commit()
-
-        delete_image(id)
+        replace_niko_image(session, id, None)
+        bump_version(session, "nikos")
+        record_niko_deleted(session, [id])
         session.delete(entity)
         session.commit()
+        delete_variants(id)
+        catalog.invalidate()
+        nikos_snapshot.schedule()
 
         return entity
@@ -1,36 +1,85 @@
-import io
-import os
-import uuid
 from datetime import datetime
 
 from fastapi import UploadFile
-from fastapi.responses import FileResponse
-from PIL import Image
-from sqlalchemy import desc, func, select
+from sqlalchemy import desc, select
 from sqlalchemy.dialects.mysql import insert
-from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 
 from common.dto import (
+    ChangeEntity,
     PostRequestForm,
+    PostResponse,
 )
 from common.models import Post
-from services._shared import SessionManager
-from services.images import IMAGE_DIR, MAX_IMG_SIZE
+from services._shared import (
+    EXPORT_BATCH_SIZE,
+    AsyncSessionManager,
+    SessionManager,
+    async_variant,
+    batch_result,
+    read_session,
+    run_db,
+)
+from services.blobs import add_blob, drop_blob, record_image_change
+from services.changes import record_change, record_post_deleted
+from services.counters import bump_counter, get_counter, get_counter_async
+from services.image_paths import image_paths
+from services.images import MAX_IMG_SIZE
+from services.imaging import ImageDecodeError, image_pool, normalize_png
+from services.versions import bump_version
 
 
-def get_posts():
-    with SessionManager() as session:
+def get_posts(db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = select(Post).options(selectinload(Post.user))
         return session.scalars(stmt).fetchall()
 
 
-def get_posts_count():
-    with SessionManager() as session:
-        return session.query(func.count(Post.id)).one()[0]
+@async_variant(get_posts)
+async def get_posts_async(db: AsyncSession | None = None):
+    async with AsyncSessionManager(db) as session:
+        stmt = select(Post).options(selectinload(Post.user))
+        return (await session.scalars(stmt)).fetchall()
+
+
+def stream_posts():
+    """Every post as PostResponse, one list per EXPORT_BATCH_SIZE rows, paged
+    by id (see stream_nikos)."""
+    with read_session() as session:
+        last_id = 0
+        while True:
+            stmt = (
+                select(Post)
+                .options(selectinload(Post.user))
+                .where(Post.id > last_id)
+                .order_by(Post.id)
+                .limit(EXPORT_BATCH_SIZE)
+            )
+            posts = session.scalars(stmt).fetchall()
+            if len(posts) == 0:
+                return
+            last_id = posts[-1].id
+            yield [
+                PostResponse.model_validate(post, from_attributes=True)
+                for post in posts
+            ]
+            session.expunge_all()
+            if len(posts) < EXPORT_BATCH_SIZE:
+                return
+
+
+def get_posts_count(db: Session | None = None):
+    return get_counter("posts", db=db)
 
 
-def get_posts_page(page: int, count: int):
-    with SessionManager() as session:
+@async_variant(get_posts_count)
+async def get_posts_count_async(db: AsyncSession | None = None):
+    return await get_counter_async("posts", db=db)
+
+
+def get_posts_page(page: int, count: int, db: Session | None = None):
+    with SessionManager(db) as session:
         if int(page) < 1:
             return None
         stmt = (
@@ -43,81 +92,116 @@ def get_posts_page(page: int, count: int):
         return session.scalars(stmt).fetchall()
 
 
-def get_post_userid(user_id: int):
-    with SessionManager() as session:
+@async_variant(get_posts_page)
+async def get_posts_page_async(page: int, count: int, db: AsyncSession | None = None):
+    async with AsyncSessionManager(db) as session:
+        if int(page) < 1:
+            return None
+        stmt = (
+            select(Post)
+            .options(selectinload(Post.user))
+            .order_by(desc(Post.id))
+            .offset(int(count) * (int(page) - 1))
+            .limit(int(count))
+        )
+        return (await session.scalars(stmt)).fetchall()
+
+
+def get_post_userid(user_id: int, db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = (
             select(Post).where(Post.user_id == user_id).options(selectinload(Post.user))
         )
         return session.scalars(stmt).fetchall()
 
 
-def get_post_id(id: int):
-    with SessionManager() as session:
+@async_variant(get_post_userid)
+async def get_post_userid_async(user_id: int, db: AsyncSession | None = None):
+    async with AsyncSessionManager(db) as session:
+        stmt = (
+            select(Post).where(Post.user_id == user_id).options(selectinload(Post.user))
+        )
+        return (await session.scalars(stmt)).fetchall()
+
+
+def get_post_id(id: int, db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = select(Post).where(Post.id == id).options(selectinload(Post.user))
         return session.scalars(stmt).one_or_none()
 
 
-def get_post_image(id: int):
-    with SessionManager() as session:
-        entity = session.execute(
-            select(Post).where(Post.id == id).options(selectinload(Post.user))
-        ).scalar_one_or_none()
-        if entity is None:
-            return None
-        if len(entity.image) == 0:
-            return FileResponse(
-                os.path.join("images/default.png"), media_type="image/png"
-            )
+@async_variant(get_post_id)
+async def get_post_id_async(id: int, db: AsyncSession | None = None):
+    async with AsyncSessionManager(db) as session:
+        stmt = select(Post).where(Post.id == id).options(selectinload(Post.user))
+        return (await session.scalars(stmt)).one_or_none()
+
+
+def get_posts_by_ids(ids: list[int], db: Session | None = None):
+    with SessionManager(db) as session:
+        stmt = select(Post).where(Post.id.in_(ids)).options(selectinload(Post.user))
+        return batch_result(session.scalars(stmt).fetchall(), ids)
 
-        path = os.path.join(IMAGE_DIR, f"{entity.image}")
-        if not os.path.exists(path):
-            path = os.path.join("images/default.png")
-        return FileResponse(path, media_type="image/png")
 
+@async_variant(get_posts_by_ids)
+async def get_posts_by_ids_async(ids: list[int], db: AsyncSession | None = None):
+    async with AsyncSessionManager(db) as session:
+        stmt = select(Post).where(Post.id.in_(ids)).options(selectinload(Post.user))
+        return batch_result((await session.scalars(stmt)).fetchall(), ids)
 
-def delete_post(id: int):
-    with SessionManager() as session:
+
+def get_post_image(id: int):
+    """(path, stat) of a post's image, None if there's no such post."""
+    return image_paths.get("posts", id)
+
+
+def delete_post(id: int, db: Session | None = None):
+    with SessionManager(db) as session:
         entity = session.get(Post, id)
         if entity is None:
             return None
         else:
-            path = os.path.join(IMAGE_DIR, f"{entity.image}")
-            try:
-                if os.path.exists(path):
-                    os.remove(path)
-            except:
-                print("Couldn't remove image... Skipping")
+            drop_blob(session, entity.image)
+            bump_counter(session, "posts", -1)
+            bump_version(session, "posts")
+            record_image_change(session, Post.image, id)
+            record_post_deleted(session, [id])
             session.delete(entity)
             session.commit()
             return entity
 
 
-async def insert_post(user_id: int, req: PostRequestForm, file: UploadFile):
-    with SessionManager() as session:
-        if not file.content_type or not file.content_type.startswith("image/"):
-            return {"msg": "Not a valid file!", "err": True}
-        if not file.size or file.size > MAX_IMG_SIZE:
-            return {"msg": "File too large!", "err": True}
-        data = await file.read()
-        try:
-            image = Image.open(io.BytesIO(data))
-        except Exception:
-            return {"msg": "Failed to open image!", "err": True}
-
-        id_str = str(uuid.uuid4())
-        image = image.convert("RGBA")
-        path = os.path.join(IMAGE_DIR, f"{id_str}.png")
-
-        image.save(path, format="PNG")
-
+def insert_post_row(
+    user_id: int, req: PostRequestForm, png: bytes, db: Session | None = None
+):
+    with SessionManager(db) as session:
         stmt = insert(Post).values(
             user_id=user_id,
             title=req.title,
             post_datetime=datetime.now(),
             content=req.content,
-            image=f"{id_str}.png",
+            image=add_blob(session, png),
         )
 
-        session.execute(stmt)
+        result = session.execute(stmt)
+        bump_counter(session, "posts", 1)
+        bump_version(session, "posts")
+        record_change(session, ChangeEntity.post, result.inserted_primary_key[0])
         session.commit()
         return {"msg": "Inserted Post.", "err": False}
+
+
+async def insert_post(
+    user_id: int, req: PostRequestForm, file: UploadFile, db: Session | None = None
+):
+    if not file.content_type or not file.content_type.startswith("image/"):
+        return {"msg": "Not a valid file!", "err": True}
+    if not file.size or file.size > MAX_IMG_SIZE:
+        return {"msg": "File too large!", "err": True}
+    data = await file.read()
+    try:
+        png = await image_pool.run_async(normalize_png, data)
+    except ImageDecodeError:
+        return {"msg": "Failed to open image!", "err": True}
+
+    return await run_db(insert_post_row, user_id, req, png, db=db)
@@ -0,0 +1,226 @@
+import math
+import re
+import threading
+from bisect import bisect_left, bisect_right
+from heapq import nlargest
+
+from common.dto import NikoResponse, SortType
+from services.catalog import CatalogState, catalog
+
+# how much one occurrence of a term counts, per field
+FIELD_WEIGHTS = {
+    "name": 5.0,
+    "abilities": 2.0,
+    "author": 2.0,
+    "description": 1.5,
+    "full_desc": 1.0,
+}
+# prefix matches rank below whole-word matches of the same term
+PREFIX_PENALTY = 0.6
+# upper bound on the terms one prefix expands to, so "a" stays cheap. Past
+# it a search is flagged truncated: nikos matching only through the other
+# terms may be missing
+MAX_PREFIX_TERMS = 256
+# term frequency saturation, as in BM25
+TF_SATURATION = 1.2
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str | None):
+    return TOKEN_RE.findall(text.casefold()) if text else []
+
+
+def niko_fields(niko: NikoResponse):
+    return {
+        "name": niko.name,
+        "abilities": " ".join(ability.name for ability in niko.abilities),
+        "author": niko.author_name or (niko.user.username if niko.user else None),
+        "description": niko.description,
+        "full_desc": niko.full_desc,
+    }
+
+
+class SearchIndex:
+    """Inverted index over the niko catalog with weighted, saturated tf-idf."""
+
+    def __init__(self, nikos: list[NikoResponse]):
+        self.nikos = {niko.id: niko for niko in nikos}
+        self.order = [niko.id for niko in nikos]
+
+        weights: dict[str, dict[int, float]] = {}
+        for niko in nikos:
+            doc: dict[str, float] = {}
+            for field, text in niko_fields(niko).items():
+                weight = FIELD_WEIGHTS[field]
+                for term in tokenize(text):
+                    doc[term] = doc.get(term, 0.0) + weight
+            for term, weight in doc.items():
+                postings = weights.get(term)
+                if postings is None:
+                    weights[term] = {niko.id: weight}
+                else:
+                    postings[niko.id] = weight
+
+        total = max(len(nikos), 1)
+        self.postings: dict[str, dict[int, float]] = {}
+        for term, postings in weights.items():
+            idf = math.log(1 + total / len(postings))
+            self.postings[term] = {
+                id: idf * weight / (weight + TF_SATURATION)
+                for id, weight in postings.items()
+            }
+        self.terms = sorted(self.postings)
+
+        # every name on one line each, for substring matches in one find() pass
+        names = [niko.name.casefold().replace("\n", " ") for niko in nikos]
+        self.names = "\n".join(names)
+        self.name_starts = []
+        start = 0
+        for name in names:
+            self.name_starts.append(start)
+            start += len(name) + 1
+
+    def expand(self, prefix: str):
+        """Terms starting with `prefix`, and whether there were more."""
+        start = bisect_left(self.terms, prefix)
+        matches = []
+        for term in self.terms[start : start + MAX_PREFIX_TERMS]:
+            if not term.startswith(prefix):
+                return matches, False
+            matches.append(term)
+        rest = self.terms[start + MAX_PREFIX_TERMS : start + MAX_PREFIX_TERMS + 1]
+        return matches, bool(rest) and rest[0].startswith(prefix)
+
+    def term_scores(self, token: str, prefix: bool):
+        scores = dict(self.postings.get(token, {}))
+        if not prefix:
+            return scores, False
+        terms, truncated = self.expand(token)
+        for term in terms:
+            if term == token:
+                continue
+            for id, score in self.postings[term].items():
+                score *= PREFIX_PENALTY
+                if score > scores.get(id, 0.0):
+                    scores[id] = score
+        return scores, truncated
+
+    def name_matches(self, needle: str):
+        """Ids of the nikos whose name contains `needle` (casefolded)."""
+        if "\n" in needle:
+            return []
+        ids = []
+        at = self.names.find(needle)
+        while at != -1:
+            i = bisect_right(self.name_starts, at) - 1
+            ids.append(self.order[i])
+            if i + 1 == len(self.name_starts):
+                break
+            at = self.names.find(needle, self.name_starts[i + 1])
+        return ids
+
+    def scores(self, query: str):
+        """(score of every niko matching `query`, whether some may be missing).
+
+        A niko matches when it has all words of `query`, the last one also as
+        a prefix so results update while the user is still typing it, or when
+        its name contains `query` as is (ranked after the others). The score
+        map is None for a blank query.
+        """
+        if not query.strip():
+            return None, False
+
+        totals: dict[int, float] = {}
+        truncated = False
+        tokens = tokenize(query)
+        for i, token in enumerate(tokens):
+            scores, truncated = self.term_scores(token, prefix=i == len(tokens) - 1)
+            if i == 0:
+                totals = scores
+            else:
+                totals = {
+                    id: total + scores[id]
+                    for id, total in totals.items()
+                    if id in scores
+                }
+            if not totals:
+                break
+        for id in self.name_matches(query.casefold()):
+            totals.setdefault(id, 0.0)
+        return totals, truncated
+
+    def search(self, query: str, offset: int = 0, count: int | None = None):
+        """(the matching nikos, most relevant first, whether some may be missing)."""
+        totals, truncated = self.scores(query)
+        end = None if count is None else offset + count
+        if totals is None:
+            ranked = self.order[offset:end]
+        elif end is None:
+            ranked = sorted(totals, key=lambda id: (-totals[id], id))[offset:]
+        else:
+            # only the requested page needs ordering
+            ranked = nlargest(end, totals, key=lambda id: (totals[id], -id))[offset:]
+        return [self.nikos[id] for id in ranked], truncated
+
+    def suggest(self, query: str, limit: int):
+        return self.search(query, 0, limit)[0]
+
+
+class CatalogSearch:
+    """Keeps a SearchIndex in step with the catalog.
+
+    When the catalog reloads, the index is rebuilt on a background thread
+    while the previous one keeps answering; only the very first build is
+    waited for. A reload that changed nothing (the CATALOG_CACHE_TTL ones,
+    mostly) keeps the index as it is.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.state: CatalogState | None = None
+        self.index: SearchIndex | None = None
+        self.rebuilding = False
+        self.builds = 0
+
+    def current(self):
+        state = catalog.snapshot()
+        with self.lock:
+            if self.index is not None:
+                if state is not self.state and not self.rebuilding:
+                    self.rebuilding = True
+                    threading.Thread(
+                        target=self._rebuild, args=(state,), daemon=True
+                    ).start()
+                return self.index
+
+        with self.build_lock:
+            with self.lock:
+                # built by another request while we waited
+                if self.index is not None:
+                    return self.index
+            index = SearchIndex(state.orders[SortType.oldest_added])
+            with self.lock:
+                self.index, self.state = index, state
+                self.builds += 1
+            return index
+
+    def _rebuild(self, state: CatalogState):
+        try:
+            with self.build_lock:
+                nikos = state.orders[SortType.oldest_added]
+                index = self.index
+                if list(index.nikos.values()) != nikos:
+                    index = SearchIndex(nikos)
+                    self.builds += 1
+                with self.lock:
+                    self.index, self.state = index, state
+        except Exception as e:
+            print(f"Couldn't rebuild the search index: {e}")
+        finally:
+            with self.lock:
+                self.rebuilding = False
+
+
+catalog_search = CatalogSearch()
@@ -0,0 +1,152 @@
+import gzip
+import hashlib
+import os
+import threading
+
+from common.dto import NikoSnapshotResponse, SortType
+from services._shared import env_int
+from services.catalog import catalog
+from services.images import IMAGE_DIR
+
+try:
+    import brotli
+except ImportError:
+    # optional: without it the snapshot is only served gzipped or plain
+    brotli = None
+
+# seconds to wait after a write before rebuilding, so a burst of writes makes
+# a single rebuild
+SNAPSHOT_DEBOUNCE = env_int("SNAPSHOT_DEBOUNCE", 5)
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR") or os.path.join(
+    os.path.dirname(os.path.normpath(os.path.abspath(IMAGE_DIR))), "snapshot"
+)
+os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+
+# encoding -> file suffix, in order of preference
+ENCODINGS = {"br": ".br", "gzip": ".gz", "identity": ""}
+# holds the hash of the current snapshot; files are named after it, so every
+# worker serving from the same directory agrees on what's current
+POINTER = os.path.join(SNAPSHOT_DIR, "current")
+
+
+def image_url(niko_id: int):
+    return f"/image?id={niko_id}"
+
+
+def render():
+    nikos = catalog.all(SortType.oldest_added)
+    items = [
+        NikoSnapshotResponse(**niko.model_dump(), image_url=image_url(niko.id))
+        for niko in nikos
+    ]
+    return ("[" + ",".join(item.model_dump_json() for item in items) + "]").encode()
+
+
+def write_atomic(path: str, data: bytes):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class NikoSnapshot:
+    """Prebuilt, precompressed JSON of the whole catalog on disk.
+
+    The services call schedule() wherever they invalidate the catalog; the
+    rebuild runs on a timer thread once writes settle.
+    """
+
+    def __init__(self, directory: str, debounce: int):
+        self.directory = directory
+        self.debounce = debounce
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.timer: threading.Timer | None = None
+        self.pointer_stat = None
+        self.hash: str | None = None
+        self.builds = 0
+
+    def path(self, hash: str, encoding: str):
+        return os.path.join(self.directory, f"nikos-{hash}.json{ENCODINGS[encoding]}")
+
+    def schedule(self):
+        with self.lock:
+            # a pending rebuild reads the catalog when it fires, so it will
+            # already include this write
+            if self.timer is None:
+                self.timer = threading.Timer(self.debounce, self._run)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _run(self):
+        with self.lock:
+            self.timer = None
+        try:
+            self.build()
+        except Exception as e:
+            print(f"Couldn't rebuild the niko snapshot: {e}")
+
+    def build(self):
+        with self.build_lock:
+            data = render()
+            hash = hashlib.sha256(data).hexdigest()[:20]
+            if hash != self.current() or not os.path.exists(
+                self.path(hash, "identity")
+            ):
+                write_atomic(self.path(hash, "identity"), data)
+                write_atomic(self.path(hash, "gzip"), gzip.compress(data, 9))
+                if brotli is not None:
+                    write_atomic(self.path(hash, "br"), brotli.compress(data))
+                previous = self.current()
+                write_atomic(POINTER, hash.encode())
+                self.cleanup(keep={hash, previous})
+            self.builds += 1
+            return hash
+
+    def cleanup(self, keep: set[str | None]):
+        # the previous snapshot stays for requests that already picked it
+        for name in os.listdir(self.directory):
+            if not name.startswith("nikos-") or name.endswith(".tmp"):
+                continue
+            if name[len("nikos-") :].split(".")[0] not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def current(self):
+        """Hash of the current snapshot, None before the first build. Only
+        re-reads the pointer when another worker replaced it."""
+        try:
+            stat = os.stat(POINTER)
+        except FileNotFoundError:
+            return None
+        # replacing the pointer gives it a new inode
+        key = (stat.st_ino, stat.st_mtime_ns)
+        with self.lock:
+            if key != self.pointer_stat:
+                with open(POINTER) as f:
+                    self.hash = f.read().strip()
+                self.pointer_stat = key
+            return self.hash
+
+    def pick(self, accept_encoding: str):
+        """(path, encoding, hash) of the best variant the client accepts."""
+        hash = self.current()
+        if hash is None or not os.path.exists(self.path(hash, "identity")):
+            hash = self.build()
+        accepted = {
+            part.split(";")[0].strip().lower()
+            for part in accept_encoding.split(",")
+            if not part.strip().endswith("q=0")
+        }
+        for encoding in ENCODINGS:
+            if encoding != "identity" and encoding not in accepted:
+                continue
+            path = self.path(hash, encoding)
+            if os.path.exists(path):
+                return path, encoding, hash
+        return self.path(hash, "identity"), "identity", hash
+
+
+nikos_snapshot = NikoSnapshot(SNAPSHOT_DIR, SNAPSHOT_DEBOUNCE)
@@ -1,106 +1,142 @@
-import io
-import os
 import re
-import uuid
 
 from dotenv import load_dotenv
 from fastapi import UploadFile
-from fastapi.responses import FileResponse
 from passlib.context import CryptContext
-from PIL import Image
 from sqlalchemy import (
-    func,
     select,
+    update,
 )
 from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 
 from common.dto import (
     SubmitUserRequest,
     UserChangeRequest,
 )
 from common.helper2 import account_of_type
-from common.models import AccountType, SubmitUser, User
-from services._shared import SessionManager
-from services.images import IMAGE_DIR, MAX_IMG_SIZE
+from common.models import AccountType, Niko, SubmitUser, User
+from services._shared import (
+    AsyncSessionManager,
+    SessionManager,
+    async_variant,
+    batch_result,
+    run_db,
+)
+from services.blobs import add_blob, drop_blob, drop_user_blobs, record_image_change
+from services.catalog import catalog
+from services.changes import record_user_deleted, record_user_renamed
+from services.counters import (
+    bump_counter,
+    forget_user,
+    get_counter,
+    get_counter_async,
+)
+from services.image_paths import image_paths
+from services.images import MAX_IMG_SIZE
+from services.imaging import ImageDecodeError, image_pool, normalize_png
+from services.snapshot import nikos_snapshot
+from services.versions import bump_version
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 load_dotenv()
 
 
-def get_user_count():
-    with SessionManager() as session:
-        return session.query(func.count(User.id)).one()[0]
+def get_user_count(db: Session | None = None):
+    return get_counter("users", db=db)
+
 
+@async_variant(get_user_count)
+async def get_user_count_async(db: AsyncSession | None = None):
+    return await get_counter_async("users", db=db)
 
-def get_user_by_username(username: str):
-    with SessionManager() as session:
+
+def get_user_by_username(username: str, db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = select(User).where(User.username == username).limit(1)
         return session.scalars(stmt).one()
 
 
-def get_user_by_name(username: str):
-    with SessionManager() as session:
+def get_user_by_name(username: str, db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = select(User).where(User.username == username)
         return session.scalars(stmt).one()
 
 
-def get_user_by_id(id: int):
-    with SessionManager() as session:
+def get_user_by_id(id: int, db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = select(User).where(User.id == id)
         return session.scalars(stmt).one()
 
 
-def get_user_profile_picture(id: int):
-    with SessionManager() as session:
-        stmt = session.execute(select(User).where(User.id == id)).scalar_one_or_none()
+@async_variant(get_user_by_id)
+async def get_user_by_id_async(id: int, db: AsyncSession | None = None):
+    async with AsyncSessionManager(db) as session:
+        stmt = select(User).where(User.id == id)
+        return (await session.scalars(stmt)).one()
 
-        if not stmt:
-            return None
 
-        if stmt.profile_picture is None:
-            return FileResponse("images/default_pfp.png")
+def get_users_by_ids(ids: list[int], db: Session | None = None):
+    with SessionManager(db) as session:
+        stmt = select(User).where(User.id.in_(ids))
+        return batch_result(session.scalars(stmt).fetchall(), ids)
+
 
-        path = os.path.join(IMAGE_DIR, stmt.profile_picture)
-        if stmt.profile_picture is None or not os.path.exists(path):
-            return FileResponse("images/default_pfp.png")
+@async_variant(get_users_by_ids)
+async def get_users_by_ids_async(ids: list[int], db: AsyncSession | None = None):
+    async with AsyncSessionManager(db) as session:
+        stmt = select(User).where(User.id.in_(ids))
+        return batch_result((await session.scalars(stmt)).fetchall(), ids)
 
-        return FileResponse(path, headers={"ETag": stmt.profile_picture})
+
+def get_user_profile_picture(id: int):
+    """(path, stat) of a user's profile picture, None if there's no such user."""
+    return image_paths.get("users", id)
 
 
-def delete_profile_picture(user_id: int):
-    with SessionManager() as session:
+def delete_profile_picture(user_id: int, db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = session.execute(
             select(User).where(User.id == user_id)
         ).scalar_one_or_none()
 
         if not stmt:
             return False
-        if stmt.profile_picture is not None:
-            path = os.path.join(IMAGE_DIR, stmt.profile_picture)
-            os.remove(path)
-
+        drop_blob(session, stmt.profile_picture)
         stmt.profile_picture = None
+        record_image_change(session, User.profile_picture, stmt.id)
         session.commit()
 
         return True
 
 
-def get_user_by_usersearch(username: str, page: int, count: int):
-    with SessionManager() as session:
+def get_user_by_usersearch(
+    username: str, page: int, count: int, db: Session | None = None
+):
+    with SessionManager(db) as session:
         stmt = select(User).where(User.username.like(f"%{username}%"))
         stmt = stmt.offset(int(count) * (int(page) - 1)).limit(int(count))
         return session.scalars(stmt).fetchall()
 
 
-def delete_user(id: int):
-    with SessionManager() as session:
+def delete_user(id: int, db: Session | None = None):
+    with SessionManager(db) as session:
         user = session.execute(select(User).where(User.id == id)).scalar_one_or_none()
         if user:
             if account_of_type(user, AccountType.ADMIN):
                 return False
+            forget_user(session, user)
+            drop_user_blobs(session, user)
             session.delete(user)
+            # their nikos and posts go with them
+            for name in ("nikos", "posts", "users"):
+                bump_version(session, name)
+            record_user_deleted(session, user.id)
             session.commit()
+            catalog.invalidate()
+            nikos_snapshot.schedule()
             return True
         else:
             return False
@@ -110,8 +146,10 @@ def is_valid_username(username: str):
     return re.fullmatch(r"[A-Za-z0-9_]{1,32}", username)
 
 
-def insert_user(req: UserChangeRequest, account_type: AccountType):
-    with SessionManager() as session:
+def insert_user(
+    req: UserChangeRequest, account_type: AccountType, db: Session | None = None
+):
+    with SessionManager(db) as session:
         same_name_entity = session.execute(
             select(User).where(User.username == req.new_username)
         ).scalar_one_or_none()
@@ -135,12 +173,13 @@ def insert_user(req: UserChangeRequest, account_type: AccountType):
         )
 
         session.execute(stmt)
+        bump_counter(session, "users", 1)
         session.commit()
         return True
 
 
-async def update_profile_picture(user_id: int, file: UploadFile):
-    with SessionManager() as session:
+def save_profile_picture(user_id: int, png: bytes, db: Session | None = None):
+    with SessionManager(db) as session:
         user_entity = session.execute(
             select(User).where(User.id == user_id)
         ).scalar_one_or_none()
@@ -148,45 +187,42 @@ async def update_profile_picture(user_id: int, file: UploadFile):
         if not user_entity:
             return {"msg": "User doesn't exist!", "err": True}
 
-        if not file.content_type or not file.content_type.startswith("image/"):
-            return {"msg": "Not a valid file!", "err": True}
-        if not file.size or file.size > MAX_IMG_SIZE:
-            return {"msg": "File too large!", "err": True}
+        old = user_entity.profile_picture
+        user_entity.profile_picture = add_blob(session, png)
+        drop_blob(session, old)
+        record_image_change(session, User.profile_picture, user_entity.id)
+        session.commit()
 
-        data = await file.read()
-        try:
-            image = Image.open(io.BytesIO(data))
-        except Exception:
-            return {"msg": "Failed to open image!", "err": True}
+        return {"msg": "Updated profile.", "err": False}
 
-        img_path = f"u_{user_id}_{uuid.uuid4()}.png"
-        if user_entity.profile_picture:
-            old_profile_exists = os.path.join(IMAGE_DIR, user_entity.profile_picture)
 
-            try:
-                if os.path.exists(old_profile_exists):
-                    os.remove(old_profile_exists)
-            except:
-                print("Couldn't remove profile picture. Skipping...")
+async def update_profile_picture(
+    user_id: int, file: UploadFile, db: Session | None = None
+):
+    if not file.content_type or not file.content_type.startswith("image/"):
+        return {"msg": "Not a valid file!", "err": True}
+    if not file.size or file.size > MAX_IMG_SIZE:
+        return {"msg": "File too large!", "err": True}
 
-        image.save(os.path.join(IMAGE_DIR, img_path), format="PNG")
+    data = await file.read()
+    try:
+        png = await image_pool.run_async(normalize_png, data)
+    except ImageDecodeError:
+        return {"msg": "Failed to open image!", "err": True}
+    return await run_db(save_profile_picture, user_id, png, db=db)
 
-        user_entity.profile_picture = img_path
-        session.commit()
 
-        return {"msg": "Updated profile.", "err": False}
-
-
-def update_user(username: str, req: UserChangeRequest):
-    with SessionManager() as session:
+def update_user(username: str, req: UserChangeRequest, db: Session | None = None):
+    with SessionManager(db) as session:
         entity = session.execute(
             select(User).where(User.username == username)
         ).scalar_one_or_none()
         if entity is None:
             return False
 
+        renamed = len(req.new_username) > 0 and req.new_username != username
         if len(req.new_username) > 0:
-            if req.new_username != username:
+            if renamed:
                 same_name_entity = session.execute(
                     select(User).where(User.username == req.new_username)
                 ).scalar_one_or_none()
@@ -195,7 +231,18 @@ def update_user(username: str, req: UserChangeRequest):
 
             if not is_valid_username(req.new_username):
                 return False
+
+        if renamed:
             entity.username = req.new_username
+            # keep the denormalized author name on their nikos in step
+            session.execute(
+                update(Niko)
+                .where(Niko.author_id == entity.id)
+                .values(author_display=req.new_username)
+            )
+            bump_version(session, "nikos")
+            bump_version(session, "users")
+            record_user_renamed(session, entity.id)
 
         if len(req.new_password) > 0:
             entity.hashed_pass = pwd_context.hash(req.new_password)
@@ -205,18 +252,22 @@ def update_user(username: str, req: UserChangeRequest):
                 return False
             entity.description = req.new_description
         session.commit()
+        if renamed:
+            # the catalog and snapshot show author names, nothing else of a user
+            catalog.invalidate()
+            nikos_snapshot.schedule()
 
         return True
 
 
-def get_submit_user(user_id: str):
-    with SessionManager() as session:
+def get_submit_user(user_id: str, db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = select(SubmitUser).where(SubmitUser.user_id == user_id).limit(1)
         return session.scalars(stmt).one_or_none()
 
 
-def post_submit_user(user_id: str, req: SubmitUserRequest):
-    with SessionManager() as session:
+def post_submit_user(user_id: str, req: SubmitUserRequest, db: Session | None = None):
+    with SessionManager(db) as session:
         stmt = (
             insert(SubmitUser)
             .values(
@@ -0,0 +1,85 @@
+import threading
+import time
+
+from sqlalchemy import event, select, update
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.orm import Session
+
+from common.models import Counter
+from services._shared import SessionManager, env_int
+
+# how long a worker trusts the versions it read before asking the DB again.
+# this is how late other workers notice a write
+VERSION_CACHE_TTL = env_int("VERSION_CACHE_TTL", 2)
+VERSION_PREFIX = "version:"
+
+# what each version covers (bumped by the services writing to it):
+#   nikos  - nikos, their abilities and their authors' names
+#   posts  - posts
+#   users  - usernames (shown in posts)
+#   blogs  - blogs
+#   banner - the banner
+#   images - the image columns; also numbers the image_changes log
+#            (see services/blobs.py record_image_changes)
+
+
+def bump_version(session: Session, name: str, by: int = 1):
+    """Bump a version in the caller's transaction. The cached versions of
+    this worker are dropped once the transaction commits."""
+    key = VERSION_PREFIX + name
+    result = session.execute(
+        update(Counter).where(Counter.name == key).values(value=Counter.value + by)
+    )
+    if result.rowcount == 0:
+        # the migrations seed every version; if one is missing anyway, two
+        # first bumps racing must not both insert it
+        session.execute(
+            insert(Counter)
+            .values(name=key, value=by)
+            .on_duplicate_key_update(value=Counter.value + by)
+        )
+    session.info["versions_bumped"] = True
+
+
+class VersionCache:
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.versions: dict[str, int] = {}
+        self.loaded_at = 0.0
+
+    def _load(self):
+        with SessionManager() as session:
+            rows = session.execute(
+                select(Counter.name, Counter.value).where(
+                    Counter.name.startswith(VERSION_PREFIX)
+                )
+            )
+            return {name[len(VERSION_PREFIX) :]: value for name, value in rows}
+
+    def get_many(self, names):
+        with self.lock:
+            if time.monotonic() - self.loaded_at < self.ttl:
+                return {name: self.versions.get(name, 0) for name in names}
+
+        versions = self._load()
+        with self.lock:
+            self.versions = versions
+            self.loaded_at = time.monotonic()
+        return {name: versions.get(name, 0) for name in names}
+
+    def get(self, name: str):
+        return self.get_many((name,))[name]
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = 0.0
+
+
+versions = VersionCache(VERSION_CACHE_TTL)
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_cached_versions(session: Session):
+    if session.info.pop("versions_bumped", False):
+        versions.invalidate()